@@ -0,0 +1,117 @@
+"""
+Load test of the sync (WSGI) and async (ASGI) route endpoints against a local
+OSRM stub with fixed upstream latency.
+
+The sync path is driven through Django's WSGI handler from a fixed pool of
+threads, like one gthread worker; the async path through the ASGI handler on a
+single event loop. Both run in-process, so the numbers compare how many
+requests one worker keeps in flight while it waits on OSRM.
+
+    python benchmarks/bench_async_concurrency.py --latency 0.2 --concurrency 1 10 50 200
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fuel_route_api.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.test import AsyncClient, Client  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+
+from route_planner.osrm_stub import StubOSRMServer  # noqa: E402
+
+# Chicago -> Indianapolis: short enough that upstream latency dominates
+BODY = {'start_lat': 41.8781, 'start_lon': -87.6298, 'end_lat': 39.7684, 'end_lon': -86.1581, 'cache': 'false'}
+
+
+def summarize(label, concurrency, latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    p95 = latencies[int(0.95 * (len(latencies) - 1))]
+    print(f'{label:<5} concurrency {concurrency:>4}  {len(latencies) / elapsed:8.1f} req/s  '
+          f'p50 {statistics.median(latencies) * 1000:8.1f} ms  p95 {p95 * 1000:8.1f} ms  errors {errors}')
+
+
+def serve_stub(latency, ports):
+    server = StubOSRMServer(latency=latency)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_stub(latency):
+    """Run the OSRM stub in its own process so it doesn't compete for our GIL"""
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_stub, args=(latency, ports), daemon=True)
+    process.start()
+    return process, f'http://127.0.0.1:{ports.get(timeout=30)}'
+
+
+def run_wsgi(requests, concurrency, threads):
+    local = threading.local()
+
+    def one(_):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = Client()
+        start = time.perf_counter()
+        response = client.post('/route/', BODY, content_type='application/json')
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(concurrency, threads)) as pool:
+        results = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    summarize('wsgi', concurrency, [r[0] for r in results], elapsed, sum(r[1] != 200 for r in results))
+
+
+async def run_asgi(requests, concurrency, report=True):
+    client = AsyncClient()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post('/route/async/', BODY, content_type='application/json')
+            return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    if report:
+        summarize('asgi', concurrency, [r[0] for r in results], elapsed, sum(r[1] != 200 for r in results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds the stub waits before answering')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 200])
+    parser.add_argument('--requests-per-level', type=int, default=200)
+    parser.add_argument('--wsgi-threads', type=int, default=8, help='threads of the simulated sync worker')
+    args = parser.parse_args()
+
+    setup_test_environment()
+    stub, stub_url = start_stub(args.latency)
+    with override_settings(OSRM={'BASE_URL': stub_url, 'POOL_SIZE': args.wsgi_threads, 'ASYNC_POOL_SIZE': 500}):
+        # Warm up the station table, index and clients
+        Client().post('/route/', BODY, content_type='application/json')
+        asyncio.run(run_asgi(2, 1, report=False))
+        print(f'upstream latency {args.latency * 1000:.0f} ms, sync worker with {args.wsgi_threads} threads')
+        for concurrency in args.concurrency:
+            requests = max(args.requests_per_level, concurrency)
+            run_wsgi(requests, concurrency, args.wsgi_threads)
+            asyncio.run(run_asgi(requests, concurrency))
+    stub.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Compare the legacy DataFrame scan in find_nearby_stations with the k-d tree index.
+
+    python benchmarks/bench_nearby_stations.py --sizes 8000 500000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fuel_route_api.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+import pandas as pd  # noqa: E402
+
+from route_planner.stations import StationTable, get_station_table  # noqa: E402
+from route_planner.utils import RoutePlanner  # noqa: E402
+
+
+def synthetic_table(base: StationTable, size: int, seed: int = 0) -> StationTable:
+    """Resample the real stations up to ``size`` rows, jittered by up to ~20 miles"""
+    rng = np.random.default_rng(seed)
+    pick = rng.integers(0, len(base), size)
+    name = np.empty(size, dtype=object)
+    name[:] = base.name[pick]
+    return StationTable(
+        opis_id=np.arange(size, dtype=np.int64),
+        name=name,
+        latitude=base.latitude[pick] + rng.uniform(-0.3, 0.3, size),
+        longitude=base.longitude[pick] + rng.uniform(-0.3, 0.3, size),
+        price=base.price[pick] + rng.uniform(-0.2, 0.2, size),
+    )
+
+
+def legacy_find_nearby_stations(planner: RoutePlanner, df: pd.DataFrame, position, max_range=50):
+    nearby = []
+    current_lat, current_lon = position
+    for _, station in df.iterrows():
+        distance = planner.calculate_distance((current_lat, current_lon), (station['Latitude'], station['Longitude']))
+        if distance <= max_range:
+            nearby.append({
+                'name': station['Truckstop Name'],
+                'latitude': station['Latitude'],
+                'longitude': station['Longitude'],
+                'price': station['Retail Price'],
+                'distance': distance
+            })
+    return nearby
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[8000, 500000])
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--legacy-queries', type=int, default=3, help='the full scan is slow at large sizes')
+    parser.add_argument('--radius', type=float, default=50)
+    args = parser.parse_args()
+
+    base = get_station_table()
+    rng = np.random.default_rng(1)
+    for size in args.sizes:
+        start = time.perf_counter()
+        table = synthetic_table(base, size)
+        build = time.perf_counter() - start
+        df = pd.DataFrame({
+            'Truckstop Name': table.name, 'Latitude': table.latitude,
+            'Longitude': table.longitude, 'Retail Price': table.price,
+        })
+        planner = RoutePlanner()
+        planner.fuel_stations = table
+
+        points = list(zip(rng.uniform(30, 45, args.queries), rng.uniform(-120, -75, args.queries)))
+        legacy_total = indexed_total = 0.0
+        for n, point in enumerate(points):
+            indexed_time, indexed = timed(lambda: planner.find_nearby_stations(point, args.radius), 5)
+            indexed_total += indexed_time
+            if n < args.legacy_queries:
+                legacy_time, legacy = timed(lambda: legacy_find_nearby_stations(planner, df, point, args.radius), 1)
+                legacy_total += legacy_time
+                assert [s['name'] for s in legacy] == [s['name'] for s in indexed], 'index results differ from scan'
+                assert np.allclose([s['distance'] for s in legacy], [s['distance'] for s in indexed])
+
+        legacy_ms = legacy_total / min(args.legacy_queries, len(points)) * 1000
+        indexed_ms = indexed_total / len(points) * 1000
+        print(f'{size:>9} stations  table+index build {build * 1000:8.1f} ms  '
+              f'scan {legacy_ms:10.2f} ms/query  index {indexed_ms:8.3f} ms/query  '
+              f'speedup {legacy_ms / indexed_ms:8.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Response size and serialization time for the /route/ payload options on a
+coast-to-coast route (Los Angeles to New York).
+
+    python benchmarks/bench_response_shaping.py --spacing 0.05 --repeat 5
+
+The route comes from the stub OSRM response builder. Its great-circle line is
+bent with a few miles of smooth lateral wander plus small jitter, so that
+simplification has something realistic to remove.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fuel_route_api.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from route_planner.osrm_stub import build_route_response  # noqa: E402
+from route_planner.renderers import ORJSONRenderer  # noqa: E402
+from route_planner.shaping import ResponseShape  # noqa: E402
+from route_planner.utils import RoutePlanner  # noqa: E402
+
+LOS_ANGELES = (-118.2437, 34.0522)
+NEW_YORK = (-74.0060, 40.7128)
+
+
+def wander(coordinates, seed: int = 0):
+    """Bend a straight line so it looks more like a road"""
+    points = np.asarray(coordinates)
+    t = np.linspace(0.0, 1.0, len(points))
+    rng = np.random.default_rng(seed)
+    lateral = 0.05 * np.sin(2 * np.pi * 40 * t) + 0.01 * np.sin(2 * np.pi * 900 * t)
+    lateral = lateral + np.cumsum(rng.normal(0.0, 2e-5, len(points)))
+    points = points + np.column_stack((np.zeros(len(points)), lateral))
+    return points.round(6).tolist()
+
+
+def osrm_response(spacing: float, steps: bool, annotations: bool):
+    data = build_route_response([LOS_ANGELES, NEW_YORK], spacing, steps=steps, annotations=annotations)
+    route = data['routes'][0]
+    route['geometry']['coordinates'] = wander(route['geometry']['coordinates'])
+    for leg in route['legs']:
+        for step in leg.get('steps', []):
+            if len(step['geometry']['coordinates']) > 2:
+                step['geometry']['coordinates'] = route['geometry']['coordinates']
+    return data
+
+
+def timed(func, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--spacing', type=float, default=0.05, help='miles between route vertices')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    planner = RoutePlanner()
+    # What OSRM sends us: annotations used to be requested on every call
+    print(f'{"OSRM response":<56} {"bytes":>11}')
+    upstream = {}
+    for steps, annotations in ((True, True), (True, False), (False, False)):
+        upstream[steps, annotations] = osrm_response(args.spacing, steps=steps, annotations=annotations)
+        size = len(JSONRenderer().render(upstream[steps, annotations]))
+        print(f'{f"steps={str(steps).lower()} annotations={str(annotations).lower()}":<56} {size:>11,}')
+    print()
+
+    legacy_route = planner.map_osrm_response(upstream[True, True])
+    default_route = planner.map_osrm_response(upstream[True, False])
+    lean_route = planner.map_osrm_response(upstream[False, False])
+    fuel_stops = planner.find_optimal_fuel_stops(default_route)
+    total_cost = planner.calculate_total_cost(default_route, fuel_stops)
+    vertices = len(default_route['routes'][0]['geometry']['coordinates'])
+    print(f'{vertices} vertices, {len(fuel_stops)} fuel stops')
+
+    variants = [
+        ('before: steps, DRF JSONRenderer', default_route, {}, JSONRenderer()),
+        ('default: steps, orjson', default_route, {}, ORJSONRenderer()),
+        ('annotations=true', legacy_route, {'annotations': 'true'}, ORJSONRenderer()),
+        ('geometry=geojson steps=false', lean_route, {'steps': 'false'}, ORJSONRenderer()),
+        ('geometry=simplified steps=false', lean_route, {'geometry': 'simplified', 'steps': 'false'}, ORJSONRenderer()),
+        ('geometry=polyline steps=false', lean_route, {'geometry': 'polyline', 'steps': 'false'}, ORJSONRenderer()),
+        ('geometry=polyline steps=false fields=route,total_cost', lean_route,
+         {'geometry': 'polyline', 'steps': 'false', 'fields': 'route,total_cost'}, ORJSONRenderer()),
+    ]
+    baseline = None
+    print(f'{"variant":<56} {"bytes":>11} {"shape ms":>9} {"render ms":>10} {"total ms":>9}')
+    for label, route, params, renderer in variants:
+        shape = ResponseShape.from_params(params)
+        payload = {'route': route, 'fuel_stops': fuel_stops, 'total_cost': total_cost}
+        shaped, shape_time = timed(lambda: shape.shape_response(payload), args.repeat)
+        body, render_time = timed(lambda: renderer.render(shaped), args.repeat)
+        total = shape_time + render_time
+        if baseline is None:
+            baseline = (len(body), total)
+        print(f'{label:<56} {len(body):>11,} {shape_time * 1000:>9.1f} {render_time * 1000:>10.1f} '
+              f'{total * 1000:>9.1f}  ({len(body) / baseline[0]:.1%} size, {total / baseline[1]:.1%} time)')
+
+
+if __name__ == '__main__':
+    main()
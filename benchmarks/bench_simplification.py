@@ -0,0 +1,114 @@
+"""
+Route simplification: vertex counts, stop-search and map-render time, and
+whether the chosen fuel stops change.
+
+    python benchmarks/bench_simplification.py --routes 40 --search-tolerance 25 --map-tolerance 50
+
+Routes run between random points in the continental US. They are stub OSRM
+great-circle lines with a vertex every ``--spacing`` miles, bent with
+highway-like curves so that there is something to simplify.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fuel_route_api.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from route_planner.distance import METERS_PER_MILE, coordinates_array  # noqa: E402
+from route_planner.fuel_solver import NoFuelStopError  # noqa: E402
+from route_planner.geometry import simplify_route  # noqa: E402
+from route_planner.map_visualizer import create_route_map  # noqa: E402
+from route_planner.osrm_stub import build_route_response  # noqa: E402
+from route_planner.utils import RoutePlanner  # noqa: E402
+
+
+def curvy_route(rng: np.random.Generator, spacing: float):
+    start = (rng.uniform(-120, -75), rng.uniform(30, 45))
+    end = (rng.uniform(-120, -75), rng.uniform(30, 45))
+    data = build_route_response([start, end], spacing, steps=False)
+    points = np.asarray(data['routes'][0]['geometry']['coordinates'])
+    t = np.linspace(0.0, 1.0, len(points))
+    lateral = (0.05 * np.sin(2 * np.pi * rng.uniform(5, 60) * t + rng.uniform(0, 6))
+               + 0.002 * np.sin(2 * np.pi * rng.uniform(100, 300) * t)
+               + np.cumsum(rng.normal(0.0, 3e-6, len(points))))
+    lateral -= np.linspace(lateral[0], lateral[-1], len(points))
+    points[:, 1] += lateral
+    data['routes'][0]['geometry']['coordinates'] = points.round(6).tolist()
+    return data
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def plan(planner: RoutePlanner, route):
+    try:
+        return planner.find_optimal_fuel_stops(route)
+    except NoFuelStopError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routes', type=int, default=40)
+    parser.add_argument('--spacing', type=float, default=0.05, help='miles between raw vertices')
+    parser.add_argument('--search-tolerance', type=float, default=25.0, help='meters')
+    parser.add_argument('--map-tolerance', type=float, default=50.0, help='meters')
+    parser.add_argument('--maps', type=int, default=3, help='routes to render maps for')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    full, simplified = RoutePlanner(), RoutePlanner()
+    full.search_tolerance = 0.0
+    simplified.search_tolerance = args.search_tolerance / METERS_PER_MILE
+    map_tolerance = args.map_tolerance / METERS_PER_MILE
+
+    reductions, full_times, simplified_times, changed = [], [], [], 0
+    map_times = {0.0: [], map_tolerance: []}
+    for i in range(args.routes):
+        route = full.map_osrm_response(curvy_route(rng, args.spacing))
+        coordinates = coordinates_array(route['routes'][0]['geometry']['coordinates'])
+        kept, _ = simplify_route(coordinates, simplified.search_tolerance)
+        reductions.append(len(coordinates) / len(kept))
+
+        full_stops, elapsed = timed(lambda: plan(full, route))
+        full_times.append(elapsed)
+        simplified_stops, elapsed = timed(lambda: plan(simplified, route))
+        simplified_times.append(elapsed)
+        names = [[stop['name'] for stop in stops] if stops is not None else None
+                 for stops in (full_stops, simplified_stops)]
+        if names[0] != names[1]:
+            changed += 1
+            print(f'route {i}: stops changed {names[0]} -> {names[1]}')
+
+        if i < args.maps and full_stops:
+            for tolerance in map_times:
+                _, elapsed = timed(lambda: create_route_map(
+                    route['routes'][0]['geometry']['coordinates'], full_stops, tolerance=tolerance)._repr_html_())
+                map_times[tolerance].append(elapsed)
+
+    print(f'{args.routes} routes, {args.spacing} mi raw vertex spacing')
+    print(f'vertex reduction at {args.search_tolerance:g} m: median {statistics.median(reductions):.1f}x, '
+          f'min {min(reductions):.1f}x, max {max(reductions):.1f}x')
+    print(f'stop search: full {statistics.median(full_times) * 1000:.1f} ms, '
+          f'simplified {statistics.median(simplified_times) * 1000:.1f} ms (median per route)')
+    print(f'routes whose stops changed: {changed}')
+    if map_times[0.0]:
+        print(f'map render: full {statistics.median(map_times[0.0]) * 1000:.1f} ms, '
+              f'{args.map_tolerance:g} m {statistics.median(map_times[map_tolerance]) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
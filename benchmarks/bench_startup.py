@@ -0,0 +1,94 @@
+"""
+Cold start of a worker: time and memory to get from a fresh interpreter to
+a loaded URLconf, and the packages whose imports cost the most on the way
+(from -X importtime).
+
+    python benchmarks/bench_startup.py --runs 5 --top 15
+
+Each run is a new ``python -X importtime`` process. It runs django.setup(),
+imports ROOT_URLCONF, and reports VmRSS. It then times the imports that only
+the first /map/ render pays for.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r'''
+import json, os, sys, time
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fuel_route_api.settings')
+import django
+django.setup()
+from django.conf import settings
+from django.urls import get_resolver
+get_resolver(settings.ROOT_URLCONF).url_patterns
+ready = time.perf_counter() - start
+
+def rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmRSS'))
+    except (OSError, StopIteration):
+        return 0
+
+rss = rss_kb()
+heavy = [name for name in ('folium', 'pandas', 'branca') if name in sys.modules]
+sys.stderr.write('deferred imports\n')
+sys.stderr.flush()
+start = time.perf_counter()
+import folium, folium.plugins
+print(json.dumps({'ready': ready, 'rss_kb': rss, 'heavy': heavy,
+                  'first_map_imports': time.perf_counter() - start, 'rss_after_map_kb': rss_kb()}))
+'''
+
+
+def parse_importtime(stderr: str):
+    """{top-level package: import microseconds} spent getting ready, from the per-module self times"""
+    packages = defaultdict(int)
+    for line in stderr.splitlines():
+        if line == 'deferred imports':
+            break
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        packages[name.split('.')[0]] += int(self_us)
+    return packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='slowest packages to list')
+    args = parser.parse_args()
+
+    results, imports = [], defaultdict(list)
+    for _ in range(args.runs):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD], cwd=ROOT,
+                                 capture_output=True, text=True, check=True)
+        results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+        for name, micros in parse_importtime(process.stderr).items():
+            imports[name].append(micros)
+
+    def median(key):
+        return statistics.median(result[key] for result in results)
+
+    print(f'ready (setup + URLconf): {median("ready") * 1000:.0f} ms, RSS {median("rss_kb") / 1024:.1f} MiB')
+    print(f'loaded at startup: {", ".join(results[0]["heavy"]) or "no folium/pandas/branca"}')
+    print(f'deferred to the first /map/: {median("first_map_imports") * 1000:.0f} ms, '
+          f'RSS {median("rss_after_map_kb") / 1024:.1f} MiB after')
+    print()
+    print(f'{"import ms":>10}  package')
+    slowest = sorted(((statistics.median(times), name) for name, times in imports.items()), reverse=True)
+    for micros, name in slowest[:args.top]:
+        print(f'{micros / 1000:>10.1f}  {name}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Worker start-up cost of loading the stations from the CSV versus the binary
+snapshot. Every load runs in a fresh interpreter, like a new worker.
+
+    python benchmarks/bench_station_snapshot.py --sizes 8000 500000 --runs 5
+
+Sizes other than the real file's are resampled from it (see
+bench_nearby_stations.py). Private memory comes from /proc/self/smaps_rollup:
+memory-mapped snapshot columns sit in the shared page cache instead.
+"""
+import argparse
+import csv
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fuel_route_api.settings')
+
+
+def private_kb() -> int:
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            return sum(int(line.split()[1]) for line in f if line.startswith(('Private_Clean', 'Private_Dirty')))
+    except OSError:
+        return 0
+
+
+def child(kind: str, path: str):
+    import django
+    django.setup()
+    from route_planner.snapshot import load_snapshot
+    from route_planner.stations import StationTable
+
+    before = private_kb()
+    start = time.perf_counter()
+    table = StationTable.from_csv(path) if kind == 'csv' else load_snapshot(path)
+    elapsed = time.perf_counter() - start
+    table.index.query_radius((35.0, -100.0), 50)
+    print(json.dumps({'seconds': elapsed, 'private_kb': private_kb() - before}))
+
+
+def write_csv(table, path: str):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['OPIS Truckstop ID', 'Truckstop Name', 'Latitude', 'Longitude', 'Retail Price'])
+        for row in zip(table.opis_id.tolist(), table.name, table.latitude.tolist(),
+                       table.longitude.tolist(), table.price.tolist()):
+            writer.writerow(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[8000, 500000])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child', nargs=2, metavar=('KIND', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(*args.child)
+
+    import django
+    django.setup()
+    from bench_nearby_stations import synthetic_table
+    from route_planner.snapshot import write_snapshot
+    from route_planner.stations import get_source_store
+
+    base = get_source_store().get()
+    print(f'{"stations":>9} {"source":>9} {"file bytes":>12} {"load ms":>9} {"private KB":>11}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            table = synthetic_table(base, size)
+            paths = {'csv': os.path.join(tmp, f'{size}.csv'), 'snapshot': os.path.join(tmp, f'{size}.snapshot')}
+            write_csv(table, paths['csv'])
+            write_snapshot(table, paths['snapshot'])
+            for kind, path in paths.items():
+                results = [
+                    json.loads(subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), '--child', kind, path],
+                        check=True, capture_output=True, text=True, cwd=ROOT).stdout)
+                    for _ in range(args.runs)
+                ]
+                load_ms = statistics.median(r['seconds'] for r in results) * 1000
+                memory = statistics.median(r['private_kb'] for r in results)
+                print(f'{size:>9} {kind:>9} {os.path.getsize(path):>12,} {load_ms:>9.1f} {memory:>11,.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""
+Benchmark suite for the planning pipeline. It runs the recorded OSRM routes
+in benchmarks/fixtures/osrm (see osrm_fixtures.py) against synthetic station
+sets, so it needs no network. Results are saved as JSON so regressions show
+up between commits.
+
+    python benchmarks/bench_suite.py --sizes 8000 100000 1000000 --repeat 5
+    python benchmarks/bench_suite.py --compare benchmarks/results/<older commit>.json
+
+Cases:
+  calculate_distance       the haversine helper over every vertex pair of a route
+  find_nearby_stations     50-mile lookups at 100 points along a route
+  find_optimal_fuel_stops  corridor search and fuel plan for a route
+  calculate_total_cost     cost of that plan
+  create_route_map         folium map of the route and its stops, rendered to HTML
+  route_view               POST /route/ end to end, with OSRM replayed by the stub
+                           server and the route cache bypassed
+
+Station sets of each size are resampled from the real CSV (see
+bench_nearby_stations.py). The view reads them from a snapshot in a
+temporary directory. Results go to benchmarks/results/<commit>.json unless
+--output says otherwise. --compare prints the change against an earlier
+file and exits with status 1 when a case slowed down by more than --threshold
+(cases under --floor-ms are too short to tell).
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fuel_route_api.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+
+from bench_nearby_stations import synthetic_table  # noqa: E402
+from osrm_fixtures import ROUTES, load_fixtures, recordings  # noqa: E402
+from route_planner.map_visualizer import create_route_map  # noqa: E402
+from route_planner.osrm_stub import StubOSRMServer  # noqa: E402
+from route_planner.snapshot import write_snapshot  # noqa: E402
+from route_planner.stations import get_source_store  # noqa: E402
+from route_planner.utils import RoutePlanner  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+
+def measure(func, repeat: int):
+    """(last result, per-run seconds) after one warm-up call"""
+    result = func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, timings
+
+
+def git(*args) -> str:
+    try:
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+class Suite:
+    def __init__(self, repeat: int, sizes):
+        self.repeat = repeat
+        self.sizes = sorted(sizes)
+        self.results = []
+
+    def run(self, case: str, route: str, stations, func, calls: int = 1):
+        result, timings = measure(func, self.repeat)
+        record = {
+            'case': case, 'route': route, 'stations': stations, 'calls': calls,
+            'median': statistics.median(timings), 'min': min(timings), 'runs': len(timings),
+        }
+        self.results.append(record)
+        print(f'{case:<24} {route:<15} {stations if stations else "-":>9} '
+              f'{record["median"] * 1000:>10.2f} {record["min"] * 1000:>10.2f}')
+        return result
+
+
+def bench_planner(suite: Suite, fixtures, table, size: int, map_stops: dict):
+    planner = RoutePlanner(fuel_stations=table)
+    for name, fixture in fixtures.items():
+        route = planner.map_osrm_response(fixture['response'])
+        coordinates = route['routes'][0]['geometry']['coordinates']
+        if size == suite.sizes[0]:
+            # Pure geometry; the station count doesn't matter
+            pairs = [((lat1, lon1), (lat2, lon2))
+                     for (lon1, lat1), (lon2, lat2) in zip(coordinates[:-1], coordinates[1:])]
+            suite.run('calculate_distance', name, None,
+                      lambda: [planner.calculate_distance(a, b) for a, b in pairs], calls=len(pairs))
+
+        positions = [(lat, lon) for lon, lat in
+                     (coordinates[i] for i in np.linspace(0, len(coordinates) - 1, 100).astype(int))]
+        suite.run('find_nearby_stations', name, size,
+                  lambda: [planner.find_nearby_stations(p, 50) for p in positions], calls=len(positions))
+        stops = suite.run('find_optimal_fuel_stops', name, size, lambda: planner.find_optimal_fuel_stops(route))
+        suite.run('calculate_total_cost', name, size, lambda: planner.calculate_total_cost(route, stops))
+        if size == suite.sizes[0]:
+            map_stops[name] = (coordinates, stops, planner.map_tolerance)
+
+
+def bench_maps(suite: Suite, map_stops: dict):
+    for name, (coordinates, stops, tolerance) in map_stops.items():
+        suite.run('create_route_map', name, suite.sizes[0],
+                  lambda: create_route_map(coordinates, stops, tolerance=tolerance)._repr_html_())
+
+
+def bench_view(suite: Suite, fixtures, table, size: int, directory: str):
+    snapshot = os.path.join(directory, f'{size}.snapshot')
+    write_snapshot(table, snapshot)
+    with override_settings(FUEL_STATIONS_SOURCE='csv', FUEL_STATIONS_SNAPSHOT=snapshot, FUEL_PRICE_FEED=None):
+        client = Client()
+        for name, fixture in fixtures.items():
+            (start_lon, start_lat), (end_lon, end_lat) = fixture['start'], fixture['end']
+            body = {'start_lat': start_lat, 'start_lon': start_lon, 'end_lat': end_lat, 'end_lon': end_lon}
+
+            def post():
+                # no-cache skips the route cache, so every run goes through OSRM
+                response = client.post('/route/', body, content_type='application/json',
+                                       HTTP_CACHE_CONTROL='no-cache')
+                if response.status_code != 200:
+                    raise RuntimeError(f'/route/ returned {response.status_code}: {response.content[:200]}')
+                return response
+
+            suite.run('route_view', name, size, post)
+
+
+def result_key(record) -> str:
+    return f'{record["case"]}[{record["route"]},{record["stations"] or "-"}]'
+
+
+def compare(current, baseline_path: str, threshold: float, floor: float) -> int:
+    """
+    Print current against baseline medians; returns the number of cases
+    slower by more than ``threshold``. Cases under ``floor`` seconds are
+    mostly timer noise and never count.
+    """
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    before = {result_key(record): record for record in baseline['results']}
+    print()
+    print(f'against {baseline_path} ({baseline["meta"].get("commit") or "unknown commit"})')
+    print(f'{"case":<58} {"before ms":>10} {"after ms":>10} {"change":>8}')
+    regressions = 0
+    for record in current:
+        old = before.get(result_key(record))
+        if old is None:
+            continue
+        change = record['median'] / old['median'] - 1
+        flag = ''
+        if change > threshold and record['median'] >= floor:
+            regressions += 1
+            flag = '  slower'
+        print(f'{result_key(record):<58} {old["median"] * 1000:>10.2f} {record["median"] * 1000:>10.2f} '
+              f'{change:>+8.0%}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[8000, 100000, 1000000])
+    parser.add_argument('--routes', nargs='+', choices=list(ROUTES), default=list(ROUTES))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip', nargs='+', default=[], choices=['map', 'view'], help='slow cases to leave out')
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', metavar='BASELINE', help='earlier results file to compare with')
+    parser.add_argument('--threshold', type=float, default=0.10, help='slowdown that counts as a regression')
+    parser.add_argument('--floor-ms', type=float, default=1.0, help='cases faster than this never count')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.routes)
+    base = get_source_store().get()
+    suite = Suite(args.repeat, args.sizes)
+    print(f'{"case":<24} {"route":<15} {"stations":>9} {"median ms":>10} {"min ms":>10}')
+    map_stops = {}
+    # The OSRM client is built once per process, so one stub serves every size
+    server = StubOSRMServer(recordings=recordings(fixtures)).start()
+    try:
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+                OSRM=dict(settings.OSRM, BASE_URL=server.url),
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for size in suite.sizes:
+                table = synthetic_table(base, size)
+                bench_planner(suite, fixtures, table, size, map_stops)
+                if 'view' not in args.skip:
+                    bench_view(suite, fixtures, table, size, directory)
+    finally:
+        server.stop()
+    if 'map' not in args.skip:
+        bench_maps(suite, map_stops)
+
+    commit = git('rev-parse', '--short', 'HEAD')
+    document = {
+        'meta': {
+            'commit': commit,
+            'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': f'{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs',
+            'repeat': args.repeat,
+            'fixtures': {name: fixture['source'] for name, fixture in fixtures.items()},
+        },
+        'results': suite.results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f'{commit or "unversioned"}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2)
+    print(f'\nresults written to {output}')
+
+    if args.compare and compare(suite.results, args.compare, args.threshold, args.floor_ms / 1000):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
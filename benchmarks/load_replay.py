@@ -0,0 +1,302 @@
+"""
+Replay a JSONL workload of trips against a running API, with OSRM replaced
+by the local stub server, and report throughput, latency percentiles and
+error rate per endpoint.
+
+    python benchmarks/load_replay.py --concurrency 32 --rate 50 --latency 0.15
+    python benchmarks/load_replay.py --target http://127.0.0.1:8000 --async-views
+    python benchmarks/load_replay.py --server-command \\
+        "gunicorn fuel_route_api.wsgi -w 4 -k gthread --threads 8 -b 127.0.0.1:{port}"
+    python benchmarks/load_replay.py --generate 500 --workload my_workload.jsonl
+
+Each workload line is one trip:
+
+    {"endpoint": "route", "start_lat": 41.88, "start_lon": -87.63, "end_lat": 39.77, "end_lon": -86.16}
+
+"endpoint" is "route" (POST /route/) or "map" (GET /map/), and defaults to
+"route". Other keys are sent along as they are, for example max_range, mpg,
+geometry or cache. Lines without the four coordinates are skipped. The
+default workload is benchmarks/fixtures/workload.jsonl. --generate writes a
+new one in which a few popular lanes take most of the traffic, like real
+demand does.
+
+Without --target the API is started here with ``manage.py runserver``, or
+with --server-command, on a free port. OSRM_BASE_URL then points it at a
+stub OSRM server that runs in its own process and waits --latency seconds
+per call. Give an external --target the printed OSRM_BASE_URL yourself, or
+leave --latency unset to use its own upstream.
+
+With --rate, requests start on a fixed schedule and latency counts from the
+scheduled start. A slow server then shows up as queueing delay instead of
+silently lowering the offered load. Without --rate, --concurrency workers
+send requests back to back.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_WORKLOAD = os.path.join(ROOT, 'benchmarks', 'fixtures', 'workload.jsonl')
+COORDINATES = ('start_lat', 'start_lon', 'end_lat', 'end_lon')
+ENDPOINTS = {
+    # endpoint: (method, sync path, async path)
+    'route': ('POST', '/route/', '/route/async/'),
+    'map': ('GET', '/map/', '/map/async/'),
+}
+
+# (name, lat, lon) of metro areas the generated trips run between
+CITIES = [
+    ('Chicago', 41.8781, -87.6298), ('Indianapolis', 39.7684, -86.1581), ('Dallas', 32.7767, -96.7970),
+    ('Houston', 29.7604, -95.3698), ('Atlanta', 33.7490, -84.3880), ('Denver', 39.7392, -104.9903),
+    ('Los Angeles', 34.0522, -118.2437), ('Phoenix', 33.4484, -112.0740), ('New York', 40.7128, -74.0060),
+    ('Kansas City', 39.0997, -94.5786), ('Memphis', 35.1495, -90.0490), ('Nashville', 36.1627, -86.7816),
+    ('St. Louis', 38.6270, -90.1994), ('Columbus', 39.9612, -82.9988), ('Salt Lake City', 40.7608, -111.8910),
+    ('Seattle', 47.6062, -122.3321), ('Minneapolis', 44.9778, -93.2650), ('Charlotte', 35.2271, -80.8431),
+]
+
+
+class Request(NamedTuple):
+    endpoint: str
+    method: str
+    path: str
+    params: Dict
+
+
+class Result(NamedTuple):
+    endpoint: str
+    status: str
+    seconds: float
+    cache: Optional[str]
+
+
+def read_workload(path: str, async_views: bool) -> List[Request]:
+    requests, skipped = [], 0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            trip = json.loads(line)
+            endpoint = trip.pop('endpoint', 'route')
+            if endpoint not in ENDPOINTS or not all(key in trip for key in COORDINATES):
+                skipped += 1
+                continue
+            method, sync_path, async_path = ENDPOINTS[endpoint]
+            requests.append(Request(endpoint, method, async_path if async_views else sync_path, trip))
+    if skipped:
+        print(f'skipped {skipped} lines of {path} that are not trips', file=sys.stderr)
+    return requests
+
+
+def generate_workload(path: str, count: int, map_share: float, seed: int = 0):
+    """Trips between CITIES, Zipf-weighted so a few lanes repeat a lot"""
+    rng = random.Random(seed)
+    lanes = [(a, b) for a in CITIES for b in CITIES if a is not b]
+    rng.shuffle(lanes)
+    weights = [1 / rank for rank in range(1, len(lanes) + 1)]
+    with open(path, 'w', encoding='utf-8') as f:
+        for (_, start_lat, start_lon), (_, end_lat, end_lon) in rng.choices(lanes, weights, k=count):
+            trip = {'endpoint': 'map' if rng.random() < map_share else 'route',
+                    'start_lat': start_lat, 'start_lon': start_lon, 'end_lat': end_lat, 'end_lon': end_lon}
+            f.write(json.dumps(trip) + '\n')
+    print(f'{count} trips over {len(lanes)} lanes written to {path}')
+
+
+async def replay(target: str, requests: List[Request], concurrency: int, rate: float,
+                 timeout: float) -> Tuple[List[Result], float]:
+    """Send ``requests``; returns their results and the elapsed seconds"""
+    results: List[Result] = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def one(client: httpx.AsyncClient, request: Request, scheduled: Optional[float]):
+        async with semaphore:
+            start = scheduled if scheduled is not None else loop.time()
+            cache = None
+            try:
+                if request.method == 'GET':
+                    response = await client.get(request.path, params=request.params)
+                else:
+                    response = await client.post(request.path, json=request.params)
+                status = str(response.status_code)
+                cache = response.headers.get('X-Map-Cache') or response.headers.get('X-Route-Cache')
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            results.append(Result(request.endpoint, status, loop.time() - start, cache))
+
+    async with httpx.AsyncClient(base_url=target, limits=limits, timeout=timeout) as client:
+        start = loop.time()
+        tasks = []
+        for i, request in enumerate(requests):
+            scheduled = None
+            if rate:
+                scheduled = start + i / rate
+                await asyncio.sleep(max(0.0, scheduled - loop.time()))
+            tasks.append(asyncio.create_task(one(client, request, scheduled)))
+        await asyncio.gather(*tasks)
+        return results, loop.time() - start
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def report(results: List[Result], elapsed: float) -> Dict:
+    groups = defaultdict(list)
+    for result in results:
+        groups[result.endpoint].append(result)
+        groups['all'].append(result)
+    summary = {}
+    print(f'{"endpoint":<8} {"requests":>8} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+          f'{"errors":>7}  cache')
+    for endpoint, group in sorted(groups.items(), key=lambda item: (item[0] == 'all', item[0])):
+        latencies = sorted(result.seconds for result in group)
+        errors = sum(not result.status.startswith(('2', '3')) for result in group)
+        caches = Counter(result.cache for result in group if result.cache)
+        summary[endpoint] = {
+            'requests': len(group),
+            'throughput': len(group) / elapsed,
+            'p50': statistics.median(latencies),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'error_rate': errors / len(group),
+            'statuses': dict(Counter(result.status for result in group)),
+            'cache': dict(caches),
+        }
+        row = summary[endpoint]
+        cache_text = ' '.join(f'{key} {count}' for key, count in sorted(caches.items())) or '-'
+        print(f'{endpoint:<8} {row["requests"]:>8} {row["throughput"]:>8.1f} {row["p50"] * 1000:>8.1f} '
+              f'{row["p95"] * 1000:>8.1f} {row["p99"] * 1000:>8.1f} {row["error_rate"]:>7.1%}  {cache_text}')
+    failures = Counter(result.status for result in results if not result.status.startswith(('2', '3')))
+    if failures:
+        print('errors: ' + ', '.join(f'{status} x{count}' for status, count in failures.most_common()))
+    return summary
+
+
+def serve_stub(latency: float, ports):
+    from route_planner.osrm_stub import StubOSRMServer
+    server = StubOSRMServer(latency=latency)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_stub(latency: float):
+    """Run the OSRM stub in its own process so it doesn't compete with the API or the load generator"""
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_stub, args=(latency, ports), daemon=True)
+    process.start()
+    return process, f'http://127.0.0.1:{ports.get(timeout=30)}'
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(command: Optional[str], osrm_url: Optional[str], timeout: float = 60.0):
+    """Launch the API on a free port; (process, base URL) once it answers"""
+    port = free_port()
+    if command:
+        args = command.format(port=port)
+        shell = True
+    else:
+        args = [sys.executable, 'manage.py', 'runserver', f'127.0.0.1:{port}', '--noreload']
+        shell = False
+    env = dict(os.environ)
+    if osrm_url:
+        env['OSRM_BASE_URL'] = osrm_url
+    process = subprocess.Popen(args, cwd=ROOT, env=env, shell=shell,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    target = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'API server exited with status {process.returncode}: {args}')
+        try:
+            httpx.get(f'{target}/metrics/', timeout=1.0)
+            return process, target
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit(f'API server did not answer on {target} within {timeout:.0f} s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workload', default=DEFAULT_WORKLOAD, help='JSONL file of trips')
+    parser.add_argument('--requests', type=int, help='requests to send, cycling through the workload '
+                                                     '(default: one pass)')
+    parser.add_argument('--concurrency', type=int, default=16, help='most requests in flight at once')
+    parser.add_argument('--rate', type=float, default=0.0, help='requests started per second (0: as fast as possible)')
+    parser.add_argument('--latency', type=float, help='seconds the OSRM stub waits before answering '
+                                                      '(default: 0.1, or no stub with --target)')
+    parser.add_argument('--target', help='base URL of an API that is already running')
+    parser.add_argument('--server-command', help='command that starts the API on {port}')
+    parser.add_argument('--async-views', action='store_true', help='use /route/async/ and /map/async/')
+    parser.add_argument('--timeout', type=float, default=60.0, help='per-request timeout in seconds')
+    parser.add_argument('--warmup', type=int, default=5, help='requests sent before measuring')
+    parser.add_argument('--output', help='also write the summary to this JSON file')
+    parser.add_argument('--generate', type=int, metavar='COUNT', help='write COUNT trips to --workload and exit')
+    parser.add_argument('--map-share', type=float, default=0.2, help='share of /map/ trips when generating')
+    args = parser.parse_args()
+
+    if args.generate:
+        return generate_workload(args.workload, args.generate, args.map_share)
+
+    workload = read_workload(args.workload, args.async_views)
+    if not workload:
+        raise SystemExit(f'{args.workload} holds no trips')
+    count = args.requests or len(workload)
+    requests = [workload[i % len(workload)] for i in range(count)]
+
+    stub = server = None
+    osrm_url = None
+    try:
+        if args.target:
+            target = args.target.rstrip('/')
+            if args.latency is not None:
+                stub, osrm_url = start_stub(args.latency)
+                print(f'stub OSRM at {osrm_url}; start {target} with OSRM_BASE_URL={osrm_url} to use it')
+        else:
+            args.latency = 0.1 if args.latency is None else args.latency
+            stub, osrm_url = start_stub(args.latency)
+            server, target = start_server(args.server_command, osrm_url)
+
+        upstream = f'stub latency {args.latency * 1000:.0f} ms' if stub else 'its own upstream'
+        print(f'{count} requests to {target}, concurrency {args.concurrency}, '
+              f'{f"{args.rate:g} req/s" if args.rate else "closed loop"}, {upstream}')
+        if args.warmup:
+            asyncio.run(replay(target, requests[:args.warmup], 1, 0.0, args.timeout))
+        results, elapsed = asyncio.run(replay(target, requests, args.concurrency, args.rate, args.timeout))
+        summary = report(results, elapsed)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump({'target': target, 'requests': count, 'concurrency': args.concurrency,
+                           'rate': args.rate, 'latency': args.latency, 'elapsed': elapsed,
+                           'endpoints': summary}, f, indent=2)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if stub is not None:
+            stub.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Recorded OSRM /route responses for the benchmarks, so they run without a
+network. There is a short (Chicago to Milwaukee), a regional (Dallas to
+Denver) and a coast-to-coast (Los Angeles to New York) route, each stored as
+gzipped JSON in benchmarks/fixtures/osrm.
+
+    python benchmarks/osrm_fixtures.py            # record from settings.OSRM['BASE_URL']
+    python benchmarks/osrm_fixtures.py --stub     # synthesize with the stub OSRM server
+
+Requests use the same parameters as /route/. Stub routes are great circles,
+so --stub bends them with a few miles of smooth lateral wander to give
+simplification and the corridor search something road-like.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fuel_route_api.settings')
+
+FIXTURE_DIR = os.path.join(ROOT, 'benchmarks', 'fixtures', 'osrm')
+
+# [lon, lat] start and end of each recorded route
+ROUTES = {
+    'short': ((-87.6298, 41.8781), (-87.9065, 43.0389)),
+    'regional': ((-96.7970, 32.7767), (-104.9903, 39.7392)),
+    'coast_to_coast': ((-118.2437, 34.0522), (-74.0060, 40.7128)),
+}
+
+
+def fixture_path(name: str) -> str:
+    return os.path.join(FIXTURE_DIR, f'{name}.json.gz')
+
+
+def load_fixtures(names: Optional[Iterable[str]] = None) -> Dict[str, Dict]:
+    """{name: {'name', 'start', 'end', 'source', 'response'}} for the recorded routes"""
+    fixtures = {}
+    for name in names or ROUTES:
+        with gzip.open(fixture_path(name), 'rt', encoding='utf-8') as f:
+            fixtures[name] = json.load(f)
+    return fixtures
+
+
+def recordings(fixtures: Dict[str, Dict]) -> Dict:
+    """The fixtures keyed for StubOSRMServer(recordings=...)"""
+    from route_planner.osrm_stub import recording_key
+    return {recording_key([fixture['start'], fixture['end']]): fixture['response'] for fixture in fixtures.values()}
+
+
+def bend(coordinates, seed: int = 0):
+    """Wander sideways off a straight line with wavelengths in miles, whatever its length"""
+    from route_planner.distance import coordinates_array, cumulative_distances
+
+    points = np.asarray(coordinates, dtype=float)
+    miles = cumulative_distances(coordinates_array(coordinates))
+    rng = np.random.default_rng(seed)
+    lateral = (0.03 * np.sin(2 * np.pi * miles / 40 + rng.uniform(0, 2 * np.pi))
+               + 0.003 * np.sin(2 * np.pi * miles / 3 + rng.uniform(0, 2 * np.pi))
+               + rng.normal(0.0, 2e-5, len(points)))
+    # Keep the endpoints where they were requested
+    lateral *= np.sin(np.pi * miles / max(miles[-1], 1e-9))
+    points[:, 1] += lateral
+    return points.round(6).tolist()
+
+
+def record(name: str, start, end, stub: bool) -> Dict:
+    from route_planner.routing_client import get_routing_client
+    from route_planner.utils import RoutePlanner
+
+    planner = RoutePlanner()
+    profile, coordinates, params = planner.route_request(start, end)
+    response = get_routing_client().route(coordinates, params, profile)
+    if stub:
+        from route_planner.distance import METERS_PER_MILE, coordinates_array, cumulative_distances
+
+        route = response['routes'][0]
+        route['geometry']['coordinates'] = bend(route['geometry']['coordinates'], seed=len(name))
+        # The wander lengthens the road, so the distances OSRM would report grow with it
+        meters = cumulative_distances(coordinates_array(route['geometry']['coordinates']))[-1] * METERS_PER_MILE
+        scale = meters / route['distance']
+        for item in (route, *route['legs'], *(step for leg in route['legs'] for step in leg.get('steps', []))):
+            for key in ('distance', 'duration', 'weight'):
+                if key in item:
+                    item[key] *= scale
+        for leg in route['legs']:
+            for step in leg.get('steps', []):
+                if len(step['geometry']['coordinates']) > 2:
+                    step['geometry']['coordinates'] = route['geometry']['coordinates']
+    return {'name': name, 'start': list(start), 'end': list(end), 'source': 'stub' if stub else 'osrm',
+            'response': response}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stub', action='store_true', help='synthesize the routes instead of calling OSRM')
+    parser.add_argument('--spacing', type=float, default=0.25, help='miles between stub route vertices')
+    parser.add_argument('--routes', nargs='+', choices=list(ROUTES), default=list(ROUTES))
+    args = parser.parse_args()
+
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.test.utils import override_settings
+
+    from route_planner.osrm_stub import StubOSRMServer
+
+    server = StubOSRMServer(spacing=args.spacing).start() if args.stub else None
+    osrm = dict(settings.OSRM, BASE_URL=server.url) if server else settings.OSRM
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    try:
+        with override_settings(OSRM=osrm):
+            for name in args.routes:
+                fixture = record(name, *ROUTES[name], stub=args.stub)
+                # mtime=0 so re-recording the same responses leaves the files unchanged
+                with open(fixture_path(name), 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as f:
+                    f.write(json.dumps(fixture, separators=(',', ':')).encode())
+                route = fixture['response']['routes'][0]
+                print(f'{name}: {route["distance"] / 1609.34:.0f} miles, '
+                      f'{len(route["geometry"]["coordinates"])} vertices -> {fixture_path(name)}')
+    finally:
+        if server:
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
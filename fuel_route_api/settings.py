@@ -54,6 +54,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'route_planner.instrumentation.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -137,3 +139,169 @@ STATIC_URL = '/static/'
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Route planner
+# Station price file; loaded once per worker and reloaded when its mtime changes
+
+FUEL_STATIONS_CSV = os.getenv('FUEL_STATIONS_CSV', str(BASE_DIR / 'route_planner' / 'no_nan.csv'))
+
+# Where planners load stations from: 'csv' (the file above) or 'db' (the
+# FuelStation table, filled with `manage.py import_stations`). The db store
+# checks for new imports at most every FUEL_STATIONS_DB_RECHECK_SECONDS.
+FUEL_STATIONS_SOURCE = os.getenv('FUEL_STATIONS_SOURCE', 'csv')
+FUEL_STATIONS_DATABASE = 'default'
+FUEL_STATIONS_DB_RECHECK_SECONDS = 30
+
+# Binary station snapshot (`manage.py build_station_snapshot`). Workers
+# memory-map it instead of parsing the source, and fall back to the source
+# above when the file doesn't exist or was built from older data (a new CSV
+# or import_stations run; logged as a warning). Rebuild it after the source
+# changes; price feeds still apply on top.
+FUEL_STATIONS_SNAPSHOT = os.getenv('FUEL_STATIONS_SNAPSHOT', str(BASE_DIR / 'route_planner' / 'stations.snapshot'))
+
+# Optional price delta feed (CSV with OPIS Truckstop ID and Retail Price
+# columns, or .jsonl of {"opis_id", "price"}). Whenever the file is newer than
+# the station data, its prices are patched onto the live table without
+# rebuilding the spatial index. Publish it with `manage.py apply_price_feed`,
+# which checks the prices and replaces the file atomically.
+FUEL_PRICE_FEED = os.getenv('FUEL_PRICE_FEED') or None
+
+# Default vehicle: miles on a full tank and miles per gallon
+VEHICLE_RANGE_MILES = 500
+VEHICLE_MPG = 10
+
+# Fleet vehicle profiles (VehicleProfile, edited in the admin) selected with
+# vehicle_profile=<slug>. Workers keep them in memory and check for edits at
+# most every VEHICLE_PROFILES_RECHECK_SECONDS. The station prices are for
+# FUEL_STATIONS_FUEL_TYPE; profiles burning anything else are refused.
+VEHICLE_PROFILES_DATABASE = 'default'
+VEHICLE_PROFILES_RECHECK_SECONDS = 30
+FUEL_STATIONS_FUEL_TYPE = 'diesel'
+
+# Distances from the route (miles) searched for fuel stops, widest last
+FUEL_CORRIDOR_RADII_MILES = (10, 50, 100)
+
+# Stations are weighed by effective cost: pump price plus the fuel (and,
+# with TIME_VALUE_PER_HOUR, driver time at DETOUR_SPEED_MPH) spent driving
+# to them and back, spread over REFERENCE_TANK_FRACTION of a tank when
+# planning. /route/ takes alternates=N (at most MAX_ALTERNATES) to list the
+# next best stations within ALTERNATE_WINDOW_MILES of each stop. Set
+# ENABLED to False to plan on pump prices alone.
+DETOUR_SCORING = {
+    'ENABLED': True,
+    'REFERENCE_TANK_FRACTION': 0.5,
+    'TIME_VALUE_PER_HOUR': 0.0,
+    'DETOUR_SPEED_MPH': 35.0,
+    'ALTERNATE_WINDOW_MILES': 25.0,
+    'MAX_ALTERNATES': 10,
+}
+
+# Douglas-Peucker error bounds (meters) for the route geometry used by the
+# fuel stop search and drawn on the map; 0 uses every vertex OSRM returns.
+# The corridor search samples the route every mile whatever its vertex count,
+# so simplifying first costs more than it saves there (see
+# benchmarks/bench_simplification.py); 25 leaves the chosen stops unchanged
+# if you enable it anyway. The map renders about 4x faster at 50.
+ROUTE_SIMPLIFY_TOLERANCE_METERS = 0
+MAP_SIMPLIFY_TOLERANCE_METERS = 50
+
+# Cache of OSRM routes keyed by coordinates snapped to PRECISION decimal places
+# (4 ~ 11 m). Other backends: route_planner.route_cache.DjangoCacheBackend
+# (OPTIONS: alias) and route_planner.route_cache.SQLiteBackend (OPTIONS: path,
+# purge_interval). Set BACKEND to None to disable. Hits, misses and errors are
+# exported on /metrics/.
+ROUTE_CACHE = {
+    'BACKEND': 'route_planner.route_cache.MemoryBackend',
+    'PRECISION': 4,
+    'TIMEOUT': 24 * 60 * 60,
+    'OPTIONS': {'max_entries': 512},
+}
+
+# Rendered /map/ pages and /map/data/ payloads, keyed by trip (route cache
+# key, vehicle, station data) and served with ETags. Needs ROUTE_CACHE;
+# same backends and OPTIONS. Set BACKEND to None to disable.
+MAP_CACHE = {
+    'BACKEND': 'route_planner.route_cache.MemoryBackend',
+    'TIMEOUT': 60 * 60,
+    'OPTIONS': {'max_entries': 128},
+}
+
+# Routing backend. One keep-alive pool per worker; connection errors and
+# 429/5xx responses are retried with backoff, and after
+# CIRCUIT_FAILURE_THRESHOLD consecutive failures calls fail fast for
+# CIRCUIT_RESET_TIMEOUT seconds. `python manage.py osrm_stub` runs a local stub.
+OSRM = {
+    'BASE_URL': os.getenv('OSRM_BASE_URL', 'http://router.project-osrm.org'),
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 15.0,
+    'RETRIES': 2,
+    'BACKOFF_FACTOR': 0.3,
+    'POOL_SIZE': 10,
+    'CIRCUIT_FAILURE_THRESHOLD': 5,
+    'CIRCUIT_RESET_TIMEOUT': 30.0,
+}
+
+# Threads the async views use for stop selection and map rendering
+PLANNER_THREADS = 4
+
+# Request instrumentation. Timing spans (stations, lanes, route-cache, osrm,
+# distance, search, cost, serialize, map-render) go into a Server-Timing
+# header and the histograms at /metrics/. Set PROFILE_SAMPLE_RATE to a
+# fraction such as 0.01 to profile that share of requests into PROFILE_DIR,
+# with PROFILER 'cprofile' (.prof files) or 'pyinstrument' (.html, if installed).
+INSTRUMENTATION = {
+    'SERVER_TIMING': True,
+    'PROFILE_SAMPLE_RATE': float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+    'PROFILER': os.getenv('PROFILER', 'cprofile'),
+    'PROFILE_DIR': os.getenv('PROFILE_DIR', str(BASE_DIR / 'profiles')),
+}
+
+# Where routes come from: 'osrm' calls the OSRM HTTP API configured above,
+# 'local' answers in-process and offline from the road graph at GRAPH, built
+# with `manage.py build_road_graph` (e.g. from an interstate/highway extract).
+# Trip points further than MAX_SNAP_MILES from the graph get no route. The
+# route cache is keyed by coordinates only, so clear a persistent
+# ROUTE_CACHE backend after switching.
+ROUTING = {
+    'BACKEND': os.getenv('ROUTING_BACKEND', 'osrm'),
+    'GRAPH': os.getenv('ROUTING_GRAPH', str(BASE_DIR / 'route_planner' / 'road_graph.npz')),
+    'MAX_SNAP_MILES': 50.0,
+}
+
+# Plans for busy lanes stored by `manage.py precompute_lanes` (e.g. hourly
+# from cron with --from-log and --refresh) and served by /route/,
+# /route/async/ and /route/batch/ without routing. Trips match when their
+# points agree to PRECISION decimal places and the vehicle is the same. A
+# lane stops being served as soon as a station its plan was chosen from is
+# repriced, moved or removed, or a new station appears in the CELL_DEGREES
+# grid cells covering its corridor. Workers check DATABASE for new lanes
+# every RECHECK_SECONDS.
+PRECOMPUTED_LANES = {
+    'ENABLED': True,
+    'PRECISION': 4,
+    'RECHECK_SECONDS': 30,
+    'DATABASE': 'default',
+    'CELL_DEGREES': 0.25,
+}
+
+# /matrix/: road matrices are fetched from the routing backend's table
+# service in CHUNK_SIZE x CHUNK_SIZE blocks (OSRM's public server takes at
+# most 100 coordinates per call), CONCURRENCY blocks at a time, and cached
+# in ROUTE_CACHE. The haversine mode stretches great-circle distances by
+# CIRCUITY and drives them at AVERAGE_SPEED_MPH.
+MATRIX = {
+    'CHUNK_SIZE': 50,
+    'CONCURRENCY': 4,
+    'MAX_LOCATIONS': 1000,
+    'CIRCUITY': 1.2,
+    'AVERAGE_SPEED_MPH': 55.0,
+}
+
+# Most intermediate waypoints (pickups, drops) one trip may have; every
+# leg comes back from a single OSRM call
+ROUTE_MAX_WAYPOINTS = 25
+
+# /route/batch/: most routes accepted per request, and how many lanes are
+# fetched from OSRM at once (keep at or below OSRM['POOL_SIZE'])
+ROUTE_BATCH_MAX_ITEMS = 500
+ROUTE_BATCH_CONCURRENCY = 8
@@ -17,10 +17,24 @@ Including another URLconf
 # urls.py
 from django.urls import path
 from route_planner.views.route_views import RouteAPIView
-from route_planner.views.map_views import MapAPIView
+from route_planner.views.map_views import LeafletMapView, MapAPIView, MapDataAPIView
+from route_planner.views.batch_views import BatchRouteAPIView
+from route_planner.views.async_views import async_map_view, async_route_view
+from route_planner.views.matrix_views import MatrixAPIView
+from route_planner.views.metrics_views import metrics_view
 
 urlpatterns = [
     path('route/', RouteAPIView.as_view(), name='route'),
-    path('map/', MapAPIView.as_view(), name='map')
+    path('map/', MapAPIView.as_view(), name='map'),
+    # Static Leaflet page that draws the trip from the compact JSON at map/data/
+    path('map/leaflet/', LeafletMapView.as_view(), name='map-leaflet'),
+    path('map/data/', MapDataAPIView.as_view(), name='map-data'),
+    path('route/batch/', BatchRouteAPIView.as_view(), name='route-batch'),
+    path('matrix/', MatrixAPIView.as_view(), name='matrix'),
+    # Non-blocking versions for ASGI servers (uvicorn/daphne)
+    path('route/async/', async_route_view, name='route-async'),
+    path('map/async/', async_map_view, name='map-async'),
+    # Prometheus scrape target; every worker process reports its own numbers
+    path('metrics/', metrics_view, name='metrics'),
     
 ]
\ No newline at end of file
@@ -1,3 +1,23 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import FuelStation, PrecomputedLane, VehicleProfile
+
+
+@admin.register(FuelStation)
+class FuelStationAdmin(admin.ModelAdmin):
+    list_display = ('opis_id', 'name', 'city', 'state', 'price', 'updated_at')
+    list_filter = ('state',)
+    search_fields = ('name', 'opis_id', 'city')
+
+
+@admin.register(PrecomputedLane)
+class PrecomputedLaneAdmin(admin.ModelAdmin):
+    list_display = ('key', 'start_lat', 'start_lon', 'end_lat', 'end_lon', 'mpg', 'requests', 'computed_at')
+    exclude = ('plan', 'station_ids', 'station_prices', 'station_positions', 'cells')
+
+
+@admin.register(VehicleProfile)
+class VehicleProfileAdmin(admin.ModelAdmin):
+    list_display = ('slug', 'name', 'fuel_type', 'tank_gallons', 'mpg', 'reserve_fraction', 'updated_at')
+    list_filter = ('fuel_type',)
+    search_fields = ('slug', 'name')
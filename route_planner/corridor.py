@@ -0,0 +1,128 @@
+# route_planner/corridor.py
+from itertools import chain
+from typing import Optional, Sequence
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from .distance import MILES_PER_DEGREE, coordinates_to_arrays, cumulative_distances
+from .spatial import chord_length, to_unit_vectors
+from .stations import StationTable
+
+# Spacing of the resampled polyline used for the station search
+DEFAULT_SAMPLE_STEP_MILES = 1.0
+
+
+class RouteCorridor:
+    """
+    Stations within ``radius`` miles of a route, ordered by position along it.
+
+    ``stations`` are row indices into the StationTable the corridor was built
+    from, ``along`` is each station's projected distance from the start of the
+    route and ``detour`` its lateral distance from the route, both in miles.
+    """
+
+    def __init__(self, table: StationTable, stations: np.ndarray, along: np.ndarray,
+                 detour: np.ndarray, radius: float, total_distance: float):
+        self.table = table
+        self.stations = stations
+        self.along = along
+        self.detour = detour
+        self.radius = radius
+        self.total_distance = total_distance
+
+    def __len__(self) -> int:
+        return len(self.stations)
+
+    @property
+    def latitude(self) -> np.ndarray:
+        return self.table.latitude[self.stations]
+
+    @property
+    def longitude(self) -> np.ndarray:
+        return self.table.longitude[self.stations]
+
+    @property
+    def price(self) -> np.ndarray:
+        return self.table.price[self.stations]
+
+
+def resample_polyline(latitudes: np.ndarray, longitudes: np.ndarray, cumulative: np.ndarray, step: float):
+    """Points every ``step`` miles along the route (plus the end point) as (along, lats, lons)"""
+    total = float(cumulative[-1])
+    along = np.append(np.arange(0.0, total, step), total)
+    return along, np.interp(along, cumulative, latitudes), np.interp(along, cumulative, longitudes)
+
+
+def _project_to_segments(lat, lon, seg_lat1, seg_lon1, seg_lat2, seg_lon2):
+    """
+    Project points onto segments in a local equirectangular frame.
+    Returns (fraction along each segment, distance in miles to the segment).
+    """
+    scale = np.cos(np.radians(lat))
+    ax, ay = (seg_lon1 - lon) * scale, seg_lat1 - lat
+    bx, by = (seg_lon2 - lon) * scale, seg_lat2 - lat
+    dx, dy = bx - ax, by - ay
+    length2 = dx * dx + dy * dy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.where(length2 > 0, -(ax * dx + ay * dy) / length2, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    px, py = ax + t * dx, ay + t * dy
+    return t, np.hypot(px, py) * MILES_PER_DEGREE
+
+
+def build_corridor(coordinates: Sequence[Sequence[float]], table: StationTable, radius: float,
+                   cumulative: Optional[np.ndarray] = None,
+                   step: float = DEFAULT_SAMPLE_STEP_MILES) -> RouteCorridor:
+    """
+    Find every station within ``radius`` miles of a GeoJSON [lon, lat] polyline
+    in one batched pass over the station index.
+    """
+    lats, lons = coordinates_to_arrays(coordinates)
+    if cumulative is None:
+        cumulative = cumulative_distances(coordinates)
+    total = float(cumulative[-1])
+    sample_along, sample_lats, sample_lons = resample_polyline(lats, lons, cumulative, step)
+    sample_xyz = to_unit_vectors(sample_lats, sample_lons)
+
+    # Gather candidates from a coarser resample: any station within ``radius`` of
+    # the route is within radius + search_step/2 of some search point
+    search_step = max(step, radius / 4)
+    _, search_lats, search_lons = resample_polyline(lats, lons, cumulative, search_step)
+    hits = table.index.tree.query_ball_point(
+        to_unit_vectors(search_lats, search_lons),
+        chord_length(radius + search_step / 2),
+        return_sorted=False
+    )
+    candidates = np.unique(np.fromiter(chain.from_iterable(hits), dtype=np.intp))
+    if len(candidates) == 0:
+        empty = np.empty(0, dtype=np.float64)
+        return RouteCorridor(table, candidates, empty, empty, radius, total)
+
+    # Project each candidate onto the resampled segments either side of its nearest sample
+    station_lats = table.latitude[candidates]
+    station_lons = table.longitude[candidates]
+    _, nearest = cKDTree(sample_xyz).query(to_unit_vectors(station_lats, station_lons))
+    last = len(sample_along) - 1
+    best_along = np.full(len(candidates), np.nan)
+    best_detour = np.full(len(candidates), np.inf)
+    for start in (np.maximum(nearest - 1, 0), np.minimum(nearest, max(last - 1, 0))):
+        end = np.minimum(start + 1, last)
+        t, detour = _project_to_segments(
+            station_lats, station_lons,
+            sample_lats[start], sample_lons[start], sample_lats[end], sample_lons[end],
+        )
+        better = detour < best_detour
+        best_detour = np.where(better, detour, best_detour)
+        best_along = np.where(better, sample_along[start] + t * (sample_along[end] - sample_along[start]), best_along)
+
+    keep = best_detour <= radius
+    order = np.argsort(best_along[keep], kind='stable')
+    return RouteCorridor(
+        table,
+        candidates[keep][order],
+        best_along[keep][order],
+        best_detour[keep][order],
+        radius,
+        total,
+    )
@@ -0,0 +1,64 @@
+# route_planner/distance.py
+from itertools import chain
+from typing import Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_MILES = 3959.87433
+METERS_PER_MILE = 1609.34
+MILES_PER_DEGREE = EARTH_RADIUS_MILES * np.pi / 180.0
+
+
+def haversine(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Great-circle distance in miles between points given in degrees.
+    Arguments broadcast against each other like any NumPy ufunc.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return EARTH_RADIUS_MILES * 2 * np.arcsin(np.sqrt(a))
+
+
+def haversine_one_to_many(point: Tuple[float, float], latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """Distances in miles from one (lat, lon) point to every point in the arrays"""
+    lat, lon = point
+    return haversine(lat, lon, latitudes, longitudes)
+
+
+def haversine_pairwise(latitudes1: np.ndarray, longitudes1: np.ndarray,
+                       latitudes2: np.ndarray, longitudes2: np.ndarray) -> np.ndarray:
+    """Distance matrix in miles, shape (len(latitudes1), len(latitudes2))"""
+    return haversine(
+        np.asarray(latitudes1)[:, None], np.asarray(longitudes1)[:, None],
+        np.asarray(latitudes2)[None, :], np.asarray(longitudes2)[None, :],
+    )
+
+
+def coordinates_array(coordinates: Sequence[Sequence[float]]) -> np.ndarray:
+    """GeoJSON [lon, lat] pairs as an (n, 2) float64 array; arrays pass through untouched"""
+    if isinstance(coordinates, np.ndarray):
+        return coordinates.reshape(-1, 2)
+    # Much faster than np.asarray on the nested lists json.loads produces
+    return np.fromiter(chain.from_iterable(coordinates), dtype=np.float64, count=2 * len(coordinates)).reshape(-1, 2)
+
+
+def coordinates_to_arrays(coordinates: Sequence[Sequence[float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Split GeoJSON [lon, lat] pairs into (latitudes, longitudes) arrays"""
+    coords = coordinates_array(coordinates)
+    return coords[:, 1], coords[:, 0]
+
+
+def segment_distances(coordinates: Sequence[Sequence[float]]) -> np.ndarray:
+    """Length in miles of every segment of a GeoJSON [lon, lat] polyline"""
+    lats, lons = coordinates_to_arrays(coordinates)
+    return haversine(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+
+def cumulative_distances(coordinates: Sequence[Sequence[float]]) -> np.ndarray:
+    """Distance in miles from the first vertex to every vertex; the first entry is 0"""
+    segments = segment_distances(coordinates)
+    cumulative = np.empty(len(segments) + 1, dtype=np.float64)
+    cumulative[0] = 0.0
+    np.cumsum(segments, out=cumulative[1:])
+    return cumulative
+
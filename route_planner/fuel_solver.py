@@ -0,0 +1,204 @@
+# route_planner/fuel_solver.py
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+class NoFuelStopError(Exception):
+    """Raised when the route can't be driven with the stations available"""
+
+
+class _RangeArgMin:
+    """Sparse table answering "index of the cheapest price in [lo, hi)" in O(1)"""
+
+    def __init__(self, prices: np.ndarray):
+        self.prices = prices
+        levels = [np.arange(len(prices))]
+        width = 1
+        while 2 * width <= len(prices):
+            prev = levels[-1]
+            left, right = prev[:-width], prev[width:]
+            # <= keeps the earliest station on ties
+            levels.append(np.where(prices[left] <= prices[right], left, right))
+            width *= 2
+        self.levels = levels
+
+    def __call__(self, lo: int, hi: int) -> int:
+        k = (hi - lo).bit_length() - 1
+        a = self.levels[k][lo]
+        b = self.levels[k][hi - (1 << k)]
+        return int(a if self.prices[a] <= self.prices[b] else b)
+
+
+def _next_cheaper(prices: np.ndarray, tolerance: float) -> List[int]:
+    """For each station, the index of the next station cheaper by more than ``tolerance`` (or len)"""
+    result = [len(prices)] * len(prices)
+    stack = []
+    for i, price in enumerate(prices.tolist()):
+        while stack and prices[stack[-1]] - tolerance > price:
+            result[stack.pop()] = i
+        stack.append(i)
+    return result
+
+
+def collapse_exits(positions: np.ndarray, prices: np.ndarray, exit_miles: float) -> np.ndarray:
+    """
+    Indices of the cheapest station in each ``exit_miles`` stretch of the route.
+    Stations that close together are one stop for planning purposes.
+    """
+    if len(positions) == 0 or exit_miles <= 0:
+        return np.arange(len(positions))
+    bucket = np.floor(positions / exit_miles)
+    order = np.lexsort((np.arange(len(positions)), prices, bucket))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = bucket[order][1:] != bucket[order][:-1]
+    return order[first]
+
+
+def merge_small_purchases(plan: List[Tuple[int, float]], positions: np.ndarray, prices: np.ndarray,
+                          start_fuel: float, capacity: float, mpg: float, min_gallons: float,
+                          max_extra_cost: float, detours: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+    """
+    Fold purchases smaller than ``min_gallons`` into the previous stop when the
+    tank has room for them there and it costs at most ``max_extra_cost``, so
+    the driver doesn't pull off for a top-up. Dropping a stop also drops its
+    detour, so the previous stop buys that much less and the tank arrives at
+    the next stop exactly as full as before.
+    """
+    if detours is None:
+        detours = np.zeros(len(positions))
+    plan = list(plan)
+    k = 1
+    while k < len(plan):
+        station, gallons = plan[k]
+        if gallons >= min_gallons:
+            k += 1
+            continue
+        # Tank level right after buying at the previous stop
+        fuel = start_fuel - (positions[plan[0][0]] + detours[plan[0][0]]) / mpg
+        for m in range(k):
+            fuel += plan[m][1]
+            if m < k - 1:
+                here, there = plan[m][0], plan[m + 1][0]
+                fuel -= (positions[there] - positions[here] + detours[here] + detours[there]) / mpg
+        previous, previous_gallons = plan[k - 1]
+        moved = gallons - 2 * detours[station] / mpg
+        extra_cost = prices[previous] * moved - prices[station] * gallons
+        if (fuel + moved <= capacity + 1e-9 and previous_gallons + moved > 1e-9
+                and extra_cost <= max_extra_cost):
+            plan[k - 1] = (previous, float(previous_gallons + moved))
+            del plan[k]
+        else:
+            k += 1
+    return plan
+
+
+def solve_fuel_stops(positions: np.ndarray, prices: np.ndarray, total_distance: float,
+                     max_range: float, mpg: float, start_fuel: Optional[float] = None,
+                     price_tolerance: float = 0.01, exit_miles: float = 1.0,
+                     min_purchase: float = 0.1, detours: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+    """
+    Minimum-cost refuelling plan for a single route.
+
+    ``positions`` are station distances from the start in miles, sorted
+    ascending, and ``prices`` the matching price per gallon. The tank holds
+    ``max_range / mpg`` gallons and starts with ``start_fuel`` gallons (full by
+    default). Returns ``(station index, gallons to buy)`` pairs in route order.
+
+    This is the classic greedy for the gas station problem: at each stop, if a
+    cheaper station is within one tank, buy just enough to reach it; otherwise
+    fill up and continue to the cheapest station in range. Runs in O(n log n)
+    plus a scan of the stations in range at each fill-up.
+
+    The pure greedy happily stops at every exit for a fraction of a gallon, so
+    stations within ``exit_miles`` of each other count as one stop and prices
+    within ``price_tolerance`` as equal (preferring the farther station), and
+    stops buying under ``min_purchase`` of a tank are avoided where that is
+    cheap to do.
+    With all three set to 0 the result is the exact optimum.
+
+    ``detours`` are the stations' miles off the route. Stopping at one means
+    driving there and back, so the leg between two stops is the distance
+    along the route plus both detours, and the plan only picks stations it
+    can reach and buys the fuel for the extra miles.
+    """
+    positions_all = positions = np.asarray(positions, dtype=np.float64)
+    prices_all = prices = np.asarray(prices, dtype=np.float64)
+    capacity = max_range / mpg
+    fuel = capacity if start_fuel is None else min(start_fuel, capacity)
+    start_fuel = fuel
+    detours_all = detours = None if detours is None else np.asarray(detours, dtype=np.float64)
+    min_hop = min_purchase * max_range
+
+    # Stations past the destination are never useful
+    n = int(np.searchsorted(positions, total_distance, side='right'))
+    candidates = collapse_exits(positions[:n], prices[:n], exit_miles)
+    positions, prices = positions[candidates], prices[candidates]
+    detours = np.zeros(len(candidates)) if detours is None else detours[candidates]
+    n = len(candidates)
+    next_cheaper = _next_cheaper(prices, price_tolerance)
+    cheapest_in = _RangeArgMin(prices) if n else None
+
+    def cheapest_reachable(after: int, position: float, reach: float) -> Optional[int]:
+        hi = int(np.searchsorted(positions, position + reach, side='right'))
+        if hi <= after:
+            return None
+        if detours_all is None:
+            # Farthest station priced within tolerance of the cheapest one in range
+            best = prices[cheapest_in(after, hi)]
+            return after + int(np.flatnonzero(prices[after:hi] <= best + price_tolerance)[-1])
+        # Only the stations whose own detour is also within reach
+        reachable = after + np.flatnonzero(positions[after:hi] + detours[after:hi] <= position + reach)
+        if len(reachable) == 0:
+            return None
+        best = prices[reachable].min()
+        return int(reachable[prices[reachable] <= best + price_tolerance][-1])
+
+    plan = []
+    position = 0.0
+    # The fuel already on board is free, so start as if parked at a zero-price station
+    if total_distance - position <= fuel * mpg:
+        return plan
+    i = cheapest_reachable(0, position, fuel * mpg)
+    if i is None:
+        raise NoFuelStopError("Could not find any suitable fuel stops along the route")
+    fuel -= (positions[i] + detours[i] - position) / mpg
+
+    while True:
+        position = float(positions[i])
+        # Getting back onto the route comes out of every leg from here
+        reach = max_range - detours[i]
+        j = next_cheaper[i]
+        if j < n and positions[j] + detours[j] - position <= reach:
+            # Cheaper fuel within reach: buy only what gets us there
+            miles = float(positions[j] + detours[j] - position + detours[i])
+        elif total_distance - position <= reach:
+            # No cheaper station before the end: buy what finishes the route
+            miles, j = float(total_distance - position + detours[i]), None
+        else:
+            # Fill up and move on to the cheapest station in range, skipping
+            # ones so close that the next purchase would be a token top-up
+            after = max(i + 1, int(np.searchsorted(positions, position + min_hop, side='left')))
+            j = cheapest_reachable(after, position, reach)
+            if j is None:
+                j = cheapest_reachable(i + 1, position, reach)
+            if j is None:
+                raise NoFuelStopError("Could not find any suitable fuel stops along the route")
+            miles = None
+
+        if miles is None:
+            gallons = capacity - fuel
+        else:
+            gallons = max(0.0, miles / mpg - fuel)
+        if gallons > 1e-9:
+            plan.append((int(candidates[i]), float(gallons)))
+        fuel += gallons
+
+        if j is None:
+            return merge_small_purchases(
+                plan, positions_all, prices_all, start_fuel, capacity, mpg,
+                min_gallons=min_purchase * capacity, max_extra_cost=price_tolerance * capacity,
+                detours=detours_all
+            )
+        fuel -= (positions[j] + detours[j] - position + detours[i]) / mpg
+        i = j
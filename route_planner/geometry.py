@@ -0,0 +1,149 @@
+# route_planner/geometry.py
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .distance import MILES_PER_DEGREE, coordinates_array, coordinates_to_arrays, cumulative_distances
+
+# Longest segment a simplified route may have, in miles. Downstream code
+# interpolates linearly in lat/lon, which drifts from the great circle the
+# simplifier measures against by ~L^2/8R; at 10 miles that is a few meters.
+DEFAULT_MAX_SEGMENT_MILES = 10.0
+
+# Google's format packs each coordinate delta into 5-bit chunks; 7 chunks
+# cover any longitude at precision 6
+_MAX_CHUNKS = 7
+
+
+def _py2_round(values: np.ndarray) -> np.ndarray:
+    # Round half away from zero, like the reference implementation (and the polyline package)
+    return (np.copysign(np.floor(np.abs(values) + 0.5), values)).astype(np.int64)
+
+
+def encode_polyline(coordinates: Sequence[Sequence[float]], precision: int = 5) -> str:
+    """
+    Google encoded polyline for a GeoJSON [lon, lat] coordinate list.
+    Same output as ``polyline.encode(coordinates, precision, geojson=True)``,
+    but vectorized, so a coast-to-coast route encodes in milliseconds.
+    """
+    lats, lons = coordinates_to_arrays(coordinates)
+    if len(lats) == 0:
+        return ''
+    factor = 10 ** precision
+    values = _py2_round(np.column_stack((lats, lons)) * factor)
+    deltas = np.diff(values, axis=0, prepend=0).ravel()
+
+    encoded = deltas << 1
+    encoded = np.where(deltas < 0, ~encoded, encoded)
+    shifted = encoded[:, None] >> (5 * np.arange(_MAX_CHUNKS, dtype=np.int64))
+    chunks = shifted & 0x1f
+    # Every value takes at least one chunk, even a zero delta
+    lengths = 1 + (shifted[:, 1:] > 0).sum(axis=1)
+    used = np.arange(_MAX_CHUNKS) < lengths[:, None]
+    continued = np.arange(_MAX_CHUNKS) < (lengths - 1)[:, None]
+    chars = (chunks | np.where(continued, 0x20, 0)) + 63
+    return chars[used].astype(np.uint8).tobytes().decode('ascii')
+
+
+def _offsets_squared(latitudes: np.ndarray, longitudes: np.ndarray, vertex: np.ndarray, owner: np.ndarray,
+                     first: np.ndarray, last: np.ndarray) -> np.ndarray:
+    """
+    Squared distance (in degrees of latitude) from each ``vertex`` to the
+    segment first[owner]-last[owner], in an equirectangular frame centred on
+    the segment's first vertex. Over the few miles between anchors the frame
+    is accurate to a fraction of a percent.
+    """
+    origin_lat, origin_lon = latitudes[first], longitudes[first]
+    scale = np.cos(np.radians(origin_lat))
+    dx = (longitudes[last] - origin_lon) * scale
+    dy = latitudes[last] - origin_lat
+    length2 = dx * dx + dy * dy
+
+    px = (longitudes[vertex] - origin_lon[owner]) * scale[owner]
+    py = latitudes[vertex] - origin_lat[owner]
+    dx, dy, length2 = dx[owner], dy[owner], length2[owner]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.where(length2 > 0, (px * dx + py * dy) / length2, 0.0)
+    # Points past either end are measured to the nearer end
+    np.clip(t, 0.0, 1.0, out=t)
+    px -= t * dx
+    py -= t * dy
+    return px * px + py * py
+
+
+def simplify_indices(latitudes: np.ndarray, longitudes: np.ndarray, tolerance: float,
+                     max_segment: Optional[float] = DEFAULT_MAX_SEGMENT_MILES,
+                     cumulative: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Indices of the vertices Douglas-Peucker keeps at ``tolerance`` miles.
+    The first and last vertex are always kept; no dropped vertex is farther
+    than ``tolerance`` from the simplified line. The first vertex at or past
+    every multiple of ``max_segment`` miles along the line is kept too
+    (``cumulative`` distances are computed if not given), which keeps the
+    local frame the distances are measured in accurate.
+
+    Splits a whole level of the recursion at once, so the cost is a handful
+    of array passes per level rather than per segment.
+    """
+    n = len(latitudes)
+    if n <= 2 or tolerance <= 0:
+        return np.arange(n)
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    limit2 = (tolerance / MILES_PER_DEGREE) ** 2
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    if max_segment:
+        if cumulative is None:
+            cumulative = cumulative_distances(np.column_stack((longitudes, latitudes)))
+        keep[np.searchsorted(cumulative, np.arange(0.0, cumulative[-1], max_segment))] = True
+    anchors = np.flatnonzero(keep)
+    first, last = anchors[:-1], anchors[1:]
+    open_ranges = last - first >= 2
+    first, last = first[open_ranges], last[open_ranges]
+    while len(first):
+        counts = last - first - 1
+        # Every interior vertex of every open range, tagged with its range
+        owner = np.repeat(np.arange(len(first)), counts)
+        offsets = np.cumsum(counts) - counts
+        vertex = np.arange(counts.sum()) - offsets[owner] + first[owner] + 1
+        distances = _offsets_squared(latitudes, longitudes, vertex, owner, first, last)
+
+        farthest = np.maximum.reduceat(distances, offsets)
+        # First vertex reaching its range's maximum (owner is sorted)
+        at_max = np.flatnonzero(distances == farthest[owner])
+        leading = np.ones(len(at_max), dtype=bool)
+        leading[1:] = owner[at_max[1:]] != owner[at_max[:-1]]
+        split_range = farthest > limit2
+        split = vertex[at_max[leading]][split_range]
+        keep[split] = True
+
+        first = np.concatenate((first[split_range], split))
+        last = np.concatenate((split, last[split_range]))
+        open_ranges = last - first >= 2
+        first, last = first[open_ranges], last[open_ranges]
+    return np.flatnonzero(keep)
+
+
+def simplify_coordinates(coordinates: Sequence[Sequence[float]], tolerance: float,
+                         max_segment: Optional[float] = DEFAULT_MAX_SEGMENT_MILES) -> List[List[float]]:
+    """Douglas-Peucker simplification of a GeoJSON [lon, lat] polyline at ``tolerance`` miles"""
+    lats, lons = coordinates_to_arrays(coordinates)
+    kept = simplify_indices(lats, lons, tolerance, max_segment)
+    return np.column_stack((lons[kept], lats[kept])).tolist()
+
+
+def simplify_route(coordinates: Sequence[Sequence[float]], tolerance: float,
+                   cumulative: Optional[np.ndarray] = None,
+                   max_segment: float = DEFAULT_MAX_SEGMENT_MILES) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Simplified (n, 2) [lon, lat] array for a route, plus each kept vertex's
+    distance along the original polyline. Keeping the original distances
+    means positions along the route stay exact even though the simplified
+    line cuts corners.
+    """
+    coords = coordinates_array(coordinates)
+    if cumulative is None:
+        cumulative = cumulative_distances(coords)
+    kept = simplify_indices(coords[:, 1], coords[:, 0], tolerance, max_segment, cumulative)
+    return coords[kept], cumulative[kept]
@@ -0,0 +1,260 @@
+# route_planner/instrumentation.py
+import asyncio
+import contextvars
+import cProfile
+import logging
+import os
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the histogram buckets; spans range from a few
+# microseconds (station lookup) to seconds (a slow OSRM call)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Prometheus-style histogram with one series per label set; thread-safe"""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str],
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def expose(self) -> Iterator[str]:
+        """Lines of the Prometheus text exposition format"""
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in sorted(self._series.items())]
+        for labels, counts, total in series:
+            label_text = ','.join(f'{key}="{_escape(value)}"' for key, value in zip(self.label_names, labels))
+            prefix = f'{label_text},' if label_text else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}'
+            yield f'{self.name}_sum{{{label_text}}} {total}'
+            yield f'{self.name}_count{{{label_text}}} {cumulative}'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+SPAN_SECONDS = Histogram('route_planner_span_seconds', 'Time spent in each step of request handling', ['span'])
+REQUEST_SECONDS = Histogram('route_planner_request_seconds', 'Request handling time by view',
+                            ['view', 'method', 'status'])
+METRICS = (SPAN_SECONDS, REQUEST_SECONDS)
+
+
+def render_metrics() -> str:
+    return '\n'.join(line for metric in METRICS for line in metric.expose()) + '\n'
+
+
+class RequestTimings:
+    """Span durations of one request, in the order they were first seen; repeated spans add up"""
+
+    def __init__(self):
+        self.spans: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def header(self, total: Optional[float] = None) -> str:
+        """Server-Timing header value, durations in milliseconds"""
+        with self._lock:
+            items = list(self.spans.items())
+        if total is not None:
+            items.append(('total', total))
+        return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in items)
+
+
+_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar('route_planner_timings',
+                                                                                     default=None)
+
+
+@contextmanager
+def span(name: str):
+    """
+    Time a step of request handling. Every span feeds the
+    route_planner_span_seconds histogram, and the Server-Timing header of the
+    request it runs under.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        SPAN_SECONDS.observe(elapsed, name)
+        timings = _timings.get()
+        if timings is not None:
+            timings.add(name, elapsed)
+
+
+def _options() -> Dict:
+    return getattr(settings, 'INSTRUMENTATION', {})
+
+
+class SampledProfiler:
+    """
+    Profiles a random PROFILE_SAMPLE_RATE fraction of requests and writes one
+    file per request to PROFILE_DIR: a .prof for cProfile (open with
+    snakeviz or pstats), or an .html report when PROFILER is 'pyinstrument'.
+    Only one request is profiled at a time per process; others are skipped.
+    """
+
+    def __init__(self, rate: float, directory: str, kind: str = 'cprofile'):
+        self.rate = rate
+        self.directory = directory
+        self.kind = kind
+        self._busy = threading.Lock()
+
+    def wanted(self) -> bool:
+        return self.rate > 0 and random.random() < self.rate
+
+    @contextmanager
+    def profile(self, label: str):
+        if not self._busy.acquire(blocking=False):
+            yield
+            return
+        try:
+            profiler = self._start()
+            try:
+                yield
+            finally:
+                self._stop(profiler, label)
+        finally:
+            self._busy.release()
+
+    def _start(self):
+        if self.kind == 'pyinstrument':
+            from pyinstrument import Profiler
+            profiler = Profiler(async_mode='enabled')
+            profiler.start()
+            return profiler
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _stop(self, profiler, label: str):
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', label).strip('-')
+        name = f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{time.perf_counter_ns() % 10 ** 6:06d}-{slug}'
+        os.makedirs(self.directory, exist_ok=True)
+        if self.kind == 'pyinstrument':
+            profiler.stop()
+            path = os.path.join(self.directory, f'{name}.html')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.disable()
+            path = os.path.join(self.directory, f'{name}.prof')
+            profiler.dump_stats(path)
+        logger.info('Profiled %s to %s', label, path)
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> Optional[SampledProfiler]:
+    """The process-wide SampledProfiler from settings.INSTRUMENTATION, or None when sampling is off"""
+    global _profiler
+    options = _options()
+    rate = float(options.get('PROFILE_SAMPLE_RATE', 0.0))
+    if rate <= 0:
+        return None
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                kind = options.get('PROFILER', 'cprofile')
+                if kind == 'pyinstrument':
+                    try:
+                        import pyinstrument  # noqa: F401
+                    except ImportError:
+                        logger.warning('pyinstrument is not installed; sampling requests with cProfile')
+                        kind = 'cprofile'
+                _profiler = SampledProfiler(rate, options.get('PROFILE_DIR', 'profiles'), kind)
+    return _profiler
+
+
+def _view_name(request) -> str:
+    match = getattr(request, 'resolver_match', None)
+    return (match.url_name or match.view_name) if match is not None else 'unmatched'
+
+
+def ServerTimingMiddleware(get_response):
+    """
+    Collects the spans of each request into a Server-Timing header, records
+    request durations for /metrics/, and profiles a sample of requests when
+    INSTRUMENTATION['PROFILE_SAMPLE_RATE'] is set. Handles sync and async views.
+    """
+    header_enabled = _options().get('SERVER_TIMING', True)
+
+    def finish(request, response, timings: RequestTimings, start: float):
+        elapsed = time.perf_counter() - start
+        REQUEST_SECONDS.observe(elapsed, _view_name(request), request.method, str(response.status_code))
+        if header_enabled:
+            response['Server-Timing'] = timings.header(elapsed)
+        return response
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            timings = RequestTimings()
+            token = _timings.set(timings)
+            start = time.perf_counter()
+            try:
+                profiler = get_profiler()
+                if profiler is not None and profiler.wanted():
+                    with profiler.profile(f'{request.method} {request.path}'):
+                        response = await get_response(request)
+                else:
+                    response = await get_response(request)
+                return finish(request, response, timings, start)
+            finally:
+                _timings.reset(token)
+    else:
+        def middleware(request):
+            timings = RequestTimings()
+            token = _timings.set(timings)
+            start = time.perf_counter()
+            try:
+                profiler = get_profiler()
+                if profiler is not None and profiler.wanted():
+                    with profiler.profile(f'{request.method} {request.path}'):
+                        response = get_response(request)
+                else:
+                    response = get_response(request)
+                return finish(request, response, timings, start)
+            finally:
+                _timings.reset(token)
+    return middleware
+
+
+ServerTimingMiddleware.sync_capable = True
+ServerTimingMiddleware.async_capable = True
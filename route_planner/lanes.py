@@ -0,0 +1,342 @@
+# route_planner/lanes.py
+"""
+Precomputed fuel plans for the busiest lanes.
+
+``manage.py precompute_lanes`` runs the normal pipeline (route, fuel stops,
+cost) for each lane and stores the result as a PrecomputedLane row. Each
+worker keeps every row in memory, keyed by the trip's coordinates snapped to
+PRECISION decimal places and the vehicle, so a precomputed /route/ request is
+a hash and a dict lookup.
+
+A lane depends on the stations inside the corridor its plan was chosen from:
+their prices, their positions (which set the detours) and which stations
+there are. Each lane stores the CELL_DEGREES grid cells that cover the
+corridor, and the OPIS IDs, prices and positions of every station in those
+cells. Whenever the station table changes (price feed, import or a new price
+file), a lane is dropped until the next run recomputes it if any of these
+holds:
+- one of its stations was repriced, moved or removed;
+- a station it doesn't list now sits in one of its cells.
+Lanes for unrelated parts of the country keep being served.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Count, Max
+
+from .corridor import resample_polyline
+from .distance import MILES_PER_DEGREE, coordinates_to_arrays, cumulative_distances
+from .instrumentation import span
+from .models import PrecomputedLane
+from .renderers import dumps
+from .stations import StationTable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRECOMPUTED_LANES = {
+    'ENABLED': True,
+    'PRECISION': 4,
+    'RECHECK_SECONDS': 30.0,
+    'DATABASE': 'default',
+    'CELL_DEGREES': 0.25,
+}
+
+
+def lanes_config() -> Dict:
+    return dict(DEFAULT_PRECOMPUTED_LANES, **getattr(settings, 'PRECOMPUTED_LANES', {}))
+
+
+def lane_key(planner, start_coords: Tuple[float, float], end_coords: Tuple[float, float],
+             waypoints: Sequence[Tuple[float, float]] = (), precision: Optional[int] = None) -> str:
+    """Digest of a trip's snapped (lon, lat) points, the vehicle and the planning settings"""
+    if precision is None:
+        precision = lanes_config()['PRECISION']
+    points = ';'.join(f'{round(float(lon), precision)},{round(float(lat), precision)}'
+                      for lon, lat in (start_coords, *waypoints, end_coords))
+    parts = (points, planner.vehicle_key, planner.corridor_radii, planner.search_tolerance,
+             planner.scoring.key if planner.scoring is not None else None)
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def station_rows(table: StationTable, opis_ids: np.ndarray) -> np.ndarray:
+    """The table row of each OPIS ID, -1 for IDs it no longer lists"""
+    order, sorted_ids = table.id_lookup()
+    first = np.searchsorted(sorted_ids, opis_ids, side='left')
+    known = np.searchsorted(sorted_ids, opis_ids, side='right') > first
+    rows = np.full(len(opis_ids), -1, dtype=np.int64)
+    # Stations listed more than once are repriced together, so the first row stands for all of them
+    rows[known] = order[first[known]]
+    return rows
+
+
+def station_prices(table: StationTable, opis_ids: np.ndarray) -> np.ndarray:
+    """Current price of each OPIS ID in the table; NaN for IDs it no longer lists"""
+    rows = station_rows(table, opis_ids)
+    prices = np.full(len(opis_ids), np.nan)
+    prices[rows >= 0] = table.price[rows[rows >= 0]]
+    return prices
+
+
+def station_positions(table: StationTable, opis_ids: np.ndarray) -> np.ndarray:
+    """(lat, lon) of each OPIS ID in the table, shape (n, 2); NaN for IDs it no longer lists"""
+    rows = station_rows(table, opis_ids)
+    positions = np.full((len(opis_ids), 2), np.nan)
+    positions[rows >= 0, 0] = table.latitude[rows[rows >= 0]]
+    positions[rows >= 0, 1] = table.longitude[rows[rows >= 0]]
+    return positions
+
+
+def _cell_index(degrees: np.ndarray, offset: float, cell_degrees: float) -> np.ndarray:
+    return np.floor((np.asarray(degrees, dtype=np.float64) + offset) / cell_degrees).astype(np.int64)
+
+
+def _cell_key(rows: np.ndarray, cols: np.ndarray, cell_degrees: float) -> np.ndarray:
+    """Keys of grid cells by row (from the south pole) and column (from the antimeridian, wrapping)"""
+    row_count, column_count = int(np.ceil(180.0 / cell_degrees)), int(np.ceil(360.0 / cell_degrees))
+    return np.clip(rows, 0, row_count - 1) * column_count + cols % column_count
+
+
+def cell_keys(latitude: np.ndarray, longitude: np.ndarray, cell_degrees: float) -> np.ndarray:
+    """Key of the ``cell_degrees`` grid cell holding each point"""
+    return _cell_key(_cell_index(latitude, 90.0, cell_degrees), _cell_index(longitude, 180.0, cell_degrees),
+                     cell_degrees)
+
+
+def corridor_cells(coordinates, radius: float, cell_degrees: float) -> np.ndarray:
+    """
+    Sorted keys of grid cells covering every point within ``radius`` miles
+    of a GeoJSON [lon, lat] polyline. The route is sampled every half cell
+    and each sample contributes the cells of a lat/lon box that contains its
+    radius, so the cover errs on the side of too many cells.
+    """
+    lats, lons = coordinates_to_arrays(coordinates)
+    step = cell_degrees * MILES_PER_DEGREE / 2
+    _, lats, lons = resample_polyline(lats, lons, cumulative_distances(coordinates), step)
+    reach = (radius + step) / MILES_PER_DEGREE
+    # Degrees of longitude shrink towards the poles, so size the box at its poleward edge
+    cos = np.cos(np.radians(np.minimum(np.abs(lats) + reach, 89.0)))
+    lon_reach = np.minimum(reach / cos, 180.0)
+    row_lo, row_hi = _cell_index(lats - reach, 90.0, cell_degrees), _cell_index(lats + reach, 90.0, cell_degrees)
+    col_lo = _cell_index(lons - lon_reach, 180.0, cell_degrees)
+    col_hi = _cell_index(lons + lon_reach, 180.0, cell_degrees)
+    # Every sample's box at once: offsets up to the largest box, masked to each sample's own
+    row_offsets = np.arange(int((row_hi - row_lo).max()) + 1)
+    col_offsets = np.arange(int((col_hi - col_lo).max()) + 1)
+    cell_rows = row_lo[:, None, None] + row_offsets[None, :, None]
+    cell_cols = col_lo[:, None, None] + col_offsets[None, None, :]
+    inside = (cell_rows <= row_hi[:, None, None]) & (cell_cols <= col_hi[:, None, None])
+    cell_rows, cell_cols = np.broadcast_arrays(cell_rows, cell_cols)
+    return np.unique(_cell_key(cell_rows[inside], cell_cols[inside], cell_degrees))
+
+
+def pack_plan(plan: Dict) -> bytes:
+    return zlib.compress(dumps(plan))
+
+
+def unpack_plan(blob: bytes) -> Dict:
+    return json.loads(zlib.decompress(blob))
+
+
+class Lane:
+    """One PrecomputedLane in memory; the plan is decompressed on its first hit"""
+
+    __slots__ = ('key', 'station_ids', 'station_prices', 'station_positions', 'cells', '_blob', '_plan')
+
+    def __init__(self, key: str, station_ids: np.ndarray, station_prices: np.ndarray,
+                 station_positions: np.ndarray, cells: np.ndarray, blob: bytes):
+        self.key = key
+        self.station_ids = station_ids
+        self.station_prices = station_prices
+        self.station_positions = station_positions
+        self.cells = cells
+        self._blob = blob
+        self._plan = None
+
+    @classmethod
+    def from_row(cls, row) -> 'Lane':
+        ids = np.frombuffer(bytes(row['station_ids']), dtype=np.int64)
+        positions = np.frombuffer(bytes(row['station_positions']), dtype=np.float64).reshape(-1, 2)
+        if len(positions) != len(ids):
+            # Computed before positions were stored; NaN never matches, so the lane is stale
+            positions = np.full((len(ids), 2), np.nan)
+        return cls(row['key'], ids, np.frombuffer(bytes(row['station_prices']), dtype=np.float64), positions,
+                   np.frombuffer(bytes(row['cells']), dtype=np.int64), bytes(row.get('plan', b'')))
+
+    @property
+    def plan(self) -> Dict:
+        if self._plan is None:
+            self._plan = unpack_plan(self._blob)
+        return self._plan
+
+
+def stale_lanes(lanes: Iterable[Lane], table: StationTable, cell_degrees: Optional[float] = None) -> set:
+    """
+    Keys of the lanes whose corridor has changed since they were computed: a
+    station repriced, moved or removed, or a station added in one of its cells
+    """
+    lanes = list(lanes)
+    if not lanes:
+        return set()
+    if cell_degrees is None:
+        cell_degrees = lanes_config()['CELL_DEGREES']
+    counts = [len(lane.station_ids) for lane in lanes]
+    ids = np.concatenate([lane.station_ids for lane in lanes])
+    prices = np.concatenate([lane.station_prices for lane in lanes])
+    positions = np.concatenate([lane.station_positions for lane in lanes])
+    # One lookup for every lane's stations at once, then count the changes per lane
+    changed = ~(station_prices(table, ids) == prices) | ~np.all(station_positions(table, ids) == positions, axis=1)
+    per_lane = np.bincount(np.repeat(np.arange(len(lanes)), counts), weights=changed, minlength=len(lanes))
+    stale = {lane.key for lane, count in zip(lanes, per_lane.tolist()) if count}
+
+    # Stations by cell, to find the ones inside each lane's cells
+    cells = cell_keys(table.latitude, table.longitude, cell_degrees)
+    order = np.argsort(cells, kind='stable')
+    cells = cells[order]
+    for lane in lanes:
+        if lane.key in stale:
+            continue
+        if len(lane.cells) == 0:
+            # Computed before cells were stored, so there is nothing to check new stations against
+            stale.add(lane.key)
+            continue
+        first = np.searchsorted(cells, lane.cells, side='left')
+        counts = np.searchsorted(cells, lane.cells, side='right') - first
+        total = int(counts.sum())
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        nearby = table.opis_id[order[np.repeat(first, counts) + offsets]]
+        if not np.all(np.isin(nearby, lane.station_ids)):
+            stale.add(lane.key)
+    return stale
+
+
+class LaneStore:
+    """
+    Process-wide copy of the PrecomputedLane table. At most every
+    ``recheck_seconds`` it asks the database for the lane count and the
+    newest ``computed_at`` and reloads when either has moved; lanes are
+    revalidated whenever the station table they are served against changes.
+    """
+
+    def __init__(self, using: str = 'default', recheck_seconds: float = 30.0):
+        self.using = using
+        self.recheck_seconds = recheck_seconds
+        self._loaded: Dict[str, Lane] = {}
+        self._lanes: Dict[str, Lane] = {}
+        self._stamp = None
+        self._checked_at = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def stamp(self) -> Tuple[int, Optional[str]]:
+        stats = PrecomputedLane.objects.using(self.using).aggregate(count=Count('id'), computed=Max('computed_at'))
+        return stats['count'], stats['computed'].isoformat() if stats['computed'] else None
+
+    def lanes(self, table: StationTable) -> Dict[str, Lane]:
+        """The lanes still valid against ``table``, by key"""
+        checked_at = self._checked_at
+        if (checked_at is not None and time.monotonic() - checked_at < self.recheck_seconds
+                and self._version == table.version):
+            return self._lanes
+        with self._lock:
+            if self._checked_at is None or time.monotonic() - self._checked_at >= self.recheck_seconds:
+                if self._reload():
+                    self._version = None
+                self._checked_at = time.monotonic()
+            if self._version != table.version:
+                stale = stale_lanes(self._loaded.values(), table)
+                if stale:
+                    logger.info('%d precomputed lanes dropped after station changes', len(stale))
+                self._lanes = {key: lane for key, lane in self._loaded.items() if key not in stale}
+                self._version = table.version
+        return self._lanes
+
+    def _reload(self) -> bool:
+        """Call with the lock held; True when the lanes were reloaded"""
+        try:
+            stamp = self.stamp()
+            if stamp == self._stamp:
+                return False
+            rows = (PrecomputedLane.objects.using(self.using)
+                    .values('key', 'station_ids', 'station_prices', 'station_positions', 'cells', 'plan'))
+            self._loaded = {lane.key: lane for lane in map(Lane.from_row, rows.iterator())}
+            self._stamp = stamp
+            return True
+        except DatabaseError as e:
+            # Missing migration or a database hiccup: keep serving what we have
+            logger.warning('Precomputed lanes not loaded from %r: %s', self.using, e)
+            return False
+
+    def get(self, planner, start_coords: Tuple[float, float], end_coords: Tuple[float, float],
+            waypoints: Sequence[Tuple[float, float]] = ()) -> Optional[Dict]:
+        lanes = self.lanes(planner.fuel_stations)
+        if not lanes:
+            return None
+        lane = lanes.get(lane_key(planner, start_coords, end_coords, waypoints))
+        return lane.plan if lane is not None else None
+
+
+_store: Optional[LaneStore] = None
+_store_lock = threading.Lock()
+
+
+def get_lane_store() -> Optional[LaneStore]:
+    """The worker's LaneStore as configured by ``settings.PRECOMPUTED_LANES``, or None if disabled"""
+    global _store
+    config = lanes_config()
+    if not config['ENABLED']:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = LaneStore(config['DATABASE'], config['RECHECK_SECONDS'])
+    return _store
+
+
+def precomputed_plan(planner, start_coords: Tuple[float, float], end_coords: Tuple[float, float],
+                     waypoints: Sequence[Tuple[float, float]] = (), annotations: bool = False) -> Optional[Dict]:
+    """
+    The stored {'route', 'fuel_stops', 'total_cost'} response for a trip, or
+    None when it isn't a precomputed lane. Stored routes have steps but no
+    annotations, so requests for annotations always plan afresh.
+    """
+    store = get_lane_store()
+    if store is None or annotations:
+        return None
+    with span('lanes'):
+        return store.get(planner, start_coords, end_coords, waypoints)
+
+
+def plan_lane(planner, start_coords: Tuple[float, float], end_coords: Tuple[float, float],
+              waypoints: Sequence[Tuple[float, float]] = ()) -> Tuple[Dict, Dict]:
+    """
+    (plan, PrecomputedLane fields describing its corridor) for a lane, through
+    the same pipeline as /route/. Raises ValueError when there is no route and
+    NoFuelStopError when it can't be fuelled.
+    """
+    route = planner.get_route(start_coords, end_coords, waypoints=waypoints)
+    if 'routes' not in route:
+        raise ValueError(route.get('error', 'No route found'))
+    fuel_stops = planner.find_optimal_fuel_stops(route)
+    total_cost = planner.calculate_total_cost(route, fuel_stops)
+    table = planner.fuel_stations
+    cell_degrees = lanes_config()['CELL_DEGREES']
+    cells = corridor_cells(route['routes'][0]['geometry']['coordinates'], planner.corridor_radius, cell_degrees)
+    # Every station in the cells, not just the corridor's, so one moving into the corridor is noticed
+    nearby = np.isin(cell_keys(table.latitude, table.longitude, cell_degrees), cells)
+    nearby[planner.corridor_stations] = True
+    ids = np.unique(table.opis_id[nearby]).astype(np.int64)
+    plan = {'route': route, 'fuel_stops': fuel_stops, 'total_cost': total_cost}
+    return plan, {
+        'station_ids': ids.tobytes(),
+        'station_prices': station_prices(table, ids).tobytes(),
+        'station_positions': station_positions(table, ids).tobytes(),
+        'cells': cells.tobytes(),
+    }
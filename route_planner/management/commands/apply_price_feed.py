@@ -0,0 +1,38 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from route_planner.price_feed import read_price_updates, write_price_updates
+from route_planner.stations import get_station_store
+
+
+class Command(BaseCommand):
+    help = ('Check a price delta file against the current stations and publish it as FUEL_PRICE_FEED, '
+            'which every worker patches onto its station table without rebuilding the index')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV with OPIS Truckstop ID and Retail Price columns, or .jsonl')
+        parser.add_argument('--feed', default=getattr(settings, 'FUEL_PRICE_FEED', None),
+                            help='feed file the workers watch (default: FUEL_PRICE_FEED)')
+        parser.add_argument('--check', action='store_true', help='only report what the file would change')
+
+    def handle(self, *args, **options):
+        feed = options['feed']
+        if not feed and not options['check']:
+            raise CommandError('No --feed given and FUEL_PRICE_FEED is not set')
+        try:
+            updates = list(read_price_updates(options['path']))
+            # Patching this process's table validates every price and counts the matches
+            repriced, unknown = get_station_store().apply_prices(updates, f'check:{options["path"]}')
+        except (OSError, ValueError) as e:
+            raise CommandError(f'{options["path"]}: {e}')
+        summary = f'{repriced} station rows repriced, {unknown} unknown OPIS IDs'
+        if options['check']:
+            self.stdout.write(summary)
+            return
+        try:
+            rows = write_price_updates(updates, os.fspath(feed))
+        except OSError as e:
+            raise CommandError(f'{feed}: {e}')
+        self.stdout.write(self.style.SUCCESS(f'{rows} prices published to {feed}: {summary}'))
@@ -0,0 +1,89 @@
+import csv
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from route_planner.road_graph import DEFAULT_SPEED_MPH, RoadGraph
+
+CSV_COLUMNS = ('from_lat', 'from_lon', 'to_lat', 'to_lon')
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 't')
+
+
+def parse_bool(value) -> bool:
+    return value if isinstance(value, bool) else str(value or '').strip().lower() in TRUE_VALUES
+
+
+def parse_speed(value):
+    return float(value) if value not in (None, '') else None
+
+
+def read_csv_edges(path: str):
+    """One segment per row: from_lat, from_lon, to_lat, to_lon and optional name, speed_mph, oneway"""
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        missing = set(CSV_COLUMNS) - set(reader.fieldnames or ())
+        if missing:
+            raise CommandError(f'{path} is missing columns: {", ".join(sorted(missing))}')
+        for line, row in enumerate(reader, start=2):
+            try:
+                yield (float(row['from_lat']), float(row['from_lon']), float(row['to_lat']), float(row['to_lon']),
+                       (row.get('name') or '').strip(), parse_speed(row.get('speed_mph')),
+                       parse_bool(row.get('oneway')))
+            except ValueError as e:
+                raise CommandError(f'{path}, line {line}: {e}')
+
+
+def read_geojson_edges(path: str, name_field: str, speed_field: str, oneway_field: str):
+    """Every pair of consecutive vertices of the LineString and MultiLineString features"""
+    with open(path, encoding='utf-8') as f:
+        collection = json.load(f)
+    for feature in collection.get('features', []):
+        geometry = feature.get('geometry') or {}
+        properties = feature.get('properties') or {}
+        if geometry.get('type') == 'LineString':
+            lines = [geometry['coordinates']]
+        elif geometry.get('type') == 'MultiLineString':
+            lines = geometry['coordinates']
+        else:
+            continue
+        name = str(properties.get(name_field) or '').strip()
+        speed = parse_speed(properties.get(speed_field))
+        oneway = parse_bool(properties.get(oneway_field))
+        for line in lines:
+            for (lon1, lat1, *_), (lon2, lat2, *_) in zip(line[:-1], line[1:]):
+                yield lat1, lon1, lat2, lon2, name, speed, oneway
+
+
+class Command(BaseCommand):
+    help = 'Build the road graph used by the local routing backend (ROUTING["BACKEND"] = "local")'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='road segments: .csv (from_lat, from_lon, to_lat, to_lon[, name, '
+                                         'speed_mph, oneway]) or .geojson (LineString features)')
+        parser.add_argument('--output', default=getattr(settings, 'ROUTING', {}).get('GRAPH'),
+                            help='graph file (default: ROUTING["GRAPH"])')
+        parser.add_argument('--default-speed', type=float, default=DEFAULT_SPEED_MPH,
+                            help='mph for segments without a speed')
+        parser.add_argument('--name-field', default='name', help='GeoJSON property holding the road name')
+        parser.add_argument('--speed-field', default='speed_mph', help='GeoJSON property holding the speed in mph')
+        parser.add_argument('--oneway-field', default='oneway', help='GeoJSON property marking one-way segments')
+        parser.add_argument('--keep-all-components', action='store_true',
+                            help='keep road pieces that are not connected to the main network')
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError('No --output given and ROUTING["GRAPH"] is not set')
+        path = options['path']
+        if path.endswith(('.geojson', '.json')):
+            edges = read_geojson_edges(path, options['name_field'], options['speed_field'], options['oneway_field'])
+        else:
+            edges = read_csv_edges(path)
+        try:
+            graph = RoadGraph.from_edges(edges, default_speed=options['default_speed'],
+                                         largest_component=not options['keep_all_components'], source=path)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        graph.save(options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(graph)} nodes and {graph.edge_count} edges from {path} written to {options["output"]}'))
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from route_planner.snapshot import write_snapshot
+from route_planner.stations import get_source_store
+
+
+class Command(BaseCommand):
+    help = 'Write the configured station source (CSV or database) to a memory-mappable snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=getattr(settings, 'FUEL_STATIONS_SNAPSHOT', None),
+                            help='snapshot path (default: FUEL_STATIONS_SNAPSHOT)')
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError('No --output given and FUEL_STATIONS_SNAPSHOT is not set')
+        # Always from the source, never from an older snapshot
+        table = get_source_store().get()
+        size = write_snapshot(table, options['output'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(table)} stations from {table.version} written to {options["output"]} ({size:,} bytes)'))
@@ -0,0 +1,110 @@
+import csv
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from route_planner.models import FuelStation
+
+# Price file column for each model field
+COLUMNS = {
+    'opis_id': 'OPIS Truckstop ID',
+    'name': 'Truckstop Name',
+    'address': 'Address',
+    'city': 'City',
+    'state': 'State',
+    'rack_id': 'Rack ID',
+    'price': 'Retail Price',
+    'latitude': 'Latitude',
+    'longitude': 'Longitude',
+}
+FIELDS = [field for field in COLUMNS if field != 'opis_id']
+
+
+def parse_row(row) -> dict:
+    rack_id = row['Rack ID'].strip()
+    return {
+        'opis_id': int(row['OPIS Truckstop ID']),
+        'name': row['Truckstop Name'].strip(),
+        'address': row['Address'].strip(),
+        'city': row['City'].strip(),
+        'state': row['State'].strip(),
+        'rack_id': int(rack_id) if rack_id else None,
+        'price': float(row['Retail Price']),
+        'latitude': float(row['Latitude']),
+        'longitude': float(row['Longitude']),
+    }
+
+
+def read_price_file(path: str):
+    """
+    Station rows keyed by OPIS ID, plus how many duplicate rows were folded in.
+    The file lists some stations more than once (e.g. PILOT #1243 under two
+    names); the last row for an ID wins, as it would in a later import.
+    """
+    stations, rows = {}, 0
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        missing = set(COLUMNS.values()) - set(reader.fieldnames or ())
+        if missing:
+            raise CommandError(f'{path} is missing columns: {", ".join(sorted(missing))}')
+        for line, row in enumerate(reader, start=2):
+            try:
+                station = parse_row(row)
+            except ValueError as e:
+                raise CommandError(f'{path}, line {line}: {e}')
+            stations[station['opis_id']] = station
+            rows += 1
+    return stations, rows - len(stations)
+
+
+class Command(BaseCommand):
+    help = 'Load or update fuel stations from an OPIS price file, one row per OPIS ID'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=getattr(settings, 'FUEL_STATIONS_CSV', None))
+        parser.add_argument('--chunk-size', type=int, default=500, help='stations written per query')
+        parser.add_argument('--truncate', action='store_true', help='delete every station before loading')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        if not options['path']:
+            raise CommandError('No price file given and FUEL_STATIONS_CSV is not set')
+        if options['chunk_size'] <= 0:
+            raise CommandError('--chunk-size must be positive')
+        stations, duplicates = read_price_file(options['path'])
+        using, chunk_size = options['database'], options['chunk_size']
+        now = timezone.now()
+        created = updated = 0
+
+        with transaction.atomic(using=using):
+            queryset = FuelStation.objects.using(using)
+            if options['truncate']:
+                queryset.all().delete()
+            opis_ids = sorted(stations)
+            for start in range(0, len(opis_ids), chunk_size):
+                chunk = opis_ids[start:start + chunk_size]
+                existing = {
+                    row[0]: row[1:]
+                    for row in queryset.filter(opis_id__in=chunk).values_list('opis_id', 'pk', *FIELDS)
+                }
+                new, changed = [], []
+                for opis_id in chunk:
+                    station = stations[opis_id]
+                    if opis_id not in existing:
+                        new.append(FuelStation(updated_at=now, **station))
+                        continue
+                    pk, *current = existing[opis_id]
+                    # Unchanged rows are left alone so updated_at only moves on real changes
+                    if current != [station[field] for field in FIELDS]:
+                        changed.append(FuelStation(pk=pk, updated_at=now, **station))
+                queryset.bulk_create(new, batch_size=chunk_size)
+                queryset.bulk_update(changed, FIELDS + ['updated_at'], batch_size=chunk_size)
+                created += len(new)
+                updated += len(changed)
+
+        unchanged = len(stations) - created - updated
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(stations)} stations: {created} created, {updated} updated, {unchanged} unchanged '
+            f'({duplicates} duplicate rows skipped)'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from route_planner.osrm_stub import StubOSRMServer
+
+
+class Command(BaseCommand):
+    help = 'Run a local OSRM stub server (point settings.OSRM BASE_URL at it)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=5000)
+        parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+        parser.add_argument('--spacing', type=float, default=0.25, help='miles between geometry vertices')
+
+    def handle(self, *args, **options):
+        server = StubOSRMServer(options['host'], options['port'], options['latency'], options['spacing'])
+        self.stdout.write(f'OSRM stub listening on {server.url}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
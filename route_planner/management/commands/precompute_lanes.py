@@ -0,0 +1,178 @@
+import csv
+import json
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from route_planner.fuel_solver import NoFuelStopError
+from route_planner.lanes import Lane, lane_key, lanes_config, pack_plan, plan_lane, stale_lanes
+from route_planner.models import PrecomputedLane
+from route_planner.routing_client import RoutingError
+from route_planner.stations import get_station_table
+from route_planner.utils import RoutePlanner, parse_waypoints
+from route_planner.vehicles import get_vehicle_profile
+
+
+def read_trips(path: str):
+    """
+    Trip objects (start_lat, start_lon, end_lat, end_lon and optional
+    waypoints, max_range, mpg, vehicle_profile) from a CSV file or from JSON lines, such as a
+    log of /route/ request bodies or a load-replay workload
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(f)
+            return
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise CommandError(f'{path}, line {line_number}: {e}')
+
+
+def parse_trip(trip) -> tuple:
+    """(start, end, waypoints, max_range, mpg, vehicle) with points as (lon, lat); raises ValueError"""
+    if not isinstance(trip, dict):
+        raise ValueError('Each trip must be an object')
+    start = (float(trip.get('start_lon')), float(trip.get('start_lat')))
+    end = (float(trip.get('end_lon')), float(trip.get('end_lat')))
+    waypoints = parse_waypoints(trip.get('waypoints'))
+    max_range = float(trip['max_range']) if trip.get('max_range') not in (None, '') else None
+    mpg = float(trip['mpg']) if trip.get('mpg') not in (None, '') else None
+    return start, end, tuple(waypoints), max_range, mpg, get_vehicle_profile(trip.get('vehicle_profile'))
+
+
+class Command(BaseCommand):
+    help = ('Precompute the route, fuel stops and cost of busy lanes so the route views can serve them '
+            'without routing (run on a schedule, e.g. after each price update)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lanes', nargs='+', default=[], metavar='FILE',
+                            help='lanes to precompute, as CSV or JSON lines of trips')
+        parser.add_argument('--from-log', nargs='+', default=[], metavar='FILE',
+                            help='JSON lines of /route/ request bodies to mine for the busiest lanes')
+        parser.add_argument('--top', type=int, default=100, help='busiest lanes taken from the logs')
+        parser.add_argument('--min-requests', type=int, default=2,
+                            help='requests a logged lane needs to be precomputed')
+        parser.add_argument('--refresh', action='store_true',
+                            help='also recompute stored lanes invalidated by station changes')
+        parser.add_argument('--force', action='store_true', help='recompute lanes that are still valid')
+        parser.add_argument('--prune', action='store_true', help='delete stored lanes not selected by this run')
+
+    def handle(self, *args, **options):
+        if not (options['lanes'] or options['from_log'] or options['refresh']):
+            raise CommandError('Give --lanes, --from-log or --refresh')
+        if options['top'] <= 0:
+            raise CommandError('--top must be positive')
+        using = lanes_config()['DATABASE']
+        lanes = PrecomputedLane.objects.using(using)
+        table = get_station_table()
+
+        # {key: (trip, requests)} for every lane this run selects
+        selected = {}
+        for path in options['lanes']:
+            for key, trip in self.trips(path, table):
+                selected.setdefault(key, (trip, 0))
+        counts, examples = Counter(), {}
+        for path in options['from_log']:
+            for key, trip in self.trips(path, table):
+                counts[key] += 1
+                examples.setdefault(key, trip)
+        for key, requests in counts.most_common(options['top']):
+            if requests < options['min_requests']:
+                break
+            trip = selected.get(key, (examples[key],))[0]
+            selected[key] = (trip, requests)
+
+        stored = {row['key']: row for row in lanes.values('key', 'station_ids', 'station_prices',
+                                                          'station_positions', 'cells', 'start_lat',
+                                                          'start_lon', 'end_lat', 'end_lon', 'waypoints',
+                                                          'max_range', 'mpg', 'vehicle_profile',
+                                                          'requests')}
+        stale = stale_lanes((Lane.from_row(row) for row in stored.values()), table)
+        if options['refresh']:
+            for key in stale:
+                if key in selected:
+                    continue
+                trip = self.stored_trip(stored[key], table)
+                if trip is None:
+                    self.stderr.write(f'Lane {key} not refreshed: its vehicle profile has changed or gone')
+                    continue
+                selected[key] = (trip, stored[key]['requests'])
+
+        computed = fresh = failed = 0
+        for key, (trip, requests) in selected.items():
+            if key in stored and key not in stale and not options['force']:
+                fresh += 1
+                if requests and requests != stored[key]['requests']:
+                    lanes.filter(key=key).update(requests=requests)
+                continue
+            start, end, waypoints, max_range, mpg, vehicle = trip
+            try:
+                planner = RoutePlanner(max_range, mpg, fuel_stations=table, vehicle=vehicle)
+                plan, corridor = plan_lane(planner, start, end, waypoints)
+            except (RoutingError, NoFuelStopError, ValueError) as e:
+                failed += 1
+                self.stderr.write(f'{start[1]},{start[0]} -> {end[1]},{end[0]}: {e}')
+                continue
+            lanes.update_or_create(key=key, defaults={
+                'start_lat': start[1], 'start_lon': start[0], 'end_lat': end[1], 'end_lon': end[0],
+                'waypoints': [[lat, lon] for lon, lat in waypoints],
+                'max_range': planner.max_range, 'mpg': planner.mpg,
+                'vehicle_profile': vehicle.slug if vehicle is not None else '',
+                'plan': pack_plan(plan), **corridor,
+                'requests': requests or stored.get(key, {}).get('requests', 0),
+                'computed_at': timezone.now(),
+            })
+            computed += 1
+
+        pruned = 0
+        if options['prune']:
+            pruned, _ = lanes.exclude(key__in=list(selected)).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f'{computed} lanes precomputed, {fresh} still valid, {failed} failed, {pruned} pruned; '
+            f'{len(stale)} stored lanes had station changes in their corridor'))
+
+    def trips(self, path: str, table):
+        """(key, trip) for the trips in a file; unparseable entries are reported and skipped"""
+        try:
+            for trip in read_trips(path):
+                try:
+                    parsed = parse_trip(trip)
+                    yield self.key(parsed, table), parsed
+                except (KeyError, TypeError, ValueError) as e:
+                    self.stderr.write(f'{path}: skipping {trip!r}: {e}')
+        except OSError as e:
+            raise CommandError(str(e))
+
+    @staticmethod
+    def key(trip, table) -> str:
+        start, end, waypoints, max_range, mpg, vehicle = trip
+        return lane_key(RoutePlanner(max_range, mpg, fuel_stations=table, vehicle=vehicle), start, end, waypoints)
+
+    @classmethod
+    def stored_trip(cls, row, table):
+        """
+        The trip a stored lane was computed for, or None when that can't be
+        rebuilt. A profile lane was planned either on the profile's own range
+        and mpg or on explicit overrides, so both are tried against its key.
+        """
+        start, end = (row['start_lon'], row['start_lat']), (row['end_lon'], row['end_lat'])
+        waypoints = tuple((lon, lat) for lat, lon in row['waypoints'])
+        if not row['vehicle_profile']:
+            return start, end, waypoints, row['max_range'], row['mpg'], None
+        try:
+            vehicle = get_vehicle_profile(row['vehicle_profile'])
+        except ValueError:
+            return None
+        for max_range, mpg in ((None, None), (row['max_range'], row['mpg'])):
+            trip = start, end, waypoints, max_range, mpg, vehicle
+            try:
+                if cls.key(trip, table) == row['key']:
+                    return trip
+            except ValueError:
+                return None
+        return None
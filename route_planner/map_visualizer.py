@@ -1,12 +1,24 @@
-import folium
-from folium import plugins
-from typing import List, Dict
+from typing import TYPE_CHECKING, List, Dict
+
+from .geometry import DEFAULT_MAX_SEGMENT_MILES, simplify_coordinates
+
+# folium (and the pandas it imports) costs about half a second at import, so it
+# is only loaded by the first map a worker renders, never by /route/ workers
+if TYPE_CHECKING:
+    import folium
 # import branca.colormap as cm
 
-def create_route_map(real_route_coordinates: List[List[float]], fuel_stops: List[Dict]) -> folium.Map:
+def create_route_map(real_route_coordinates: List[List[float]], fuel_stops: List[Dict],
+                     tolerance: float = 0.0) -> 'folium.Map':
     """
     Create a basic route map with markers
+    The line is simplified to ``tolerance`` miles first; every vertex ends up in the page
     """
+    import folium
+    from folium import plugins
+
+    if tolerance > 0:
+        real_route_coordinates = simplify_coordinates(real_route_coordinates, tolerance, max_segment=DEFAULT_MAX_SEGMENT_MILES)
     route_coordinates= list(map(lambda x: list(reversed(x)), real_route_coordinates))
     # Calculate center of the route
     center_lat = sum(coord[0] for coord in route_coordinates) / len(route_coordinates)
@@ -71,10 +83,13 @@ def create_detailed_route_map(
     route_coordinates: List[List[float]],
     fuel_stops: List[Dict],
     route_segments: List[Dict] = None
-) -> folium.Map:
+) -> 'folium.Map':
     """
     Create a detailed route map with additional features
     """
+    import folium
+    from folium import plugins
+
     # Calculate center of the route
     center_lat = sum(coord[0] for coord in route_coordinates) / len(route_coordinates)
     center_lon = sum(coord[1] for coord in route_coordinates) / len(route_coordinates)
@@ -217,7 +232,7 @@ def get_color_for_fuel_level(fuel_level: float, max_fuel: float = 50.0) -> str:
     else:
         return 'red'
 
-def save_map(map_obj: folium.Map, filename: str = 'route_map.html') -> str:
+def save_map(map_obj: 'folium.Map', filename: str = 'route_map.html') -> str:
     """Save map to HTML file"""
     map_obj.save(filename)
     return filename
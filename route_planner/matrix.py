@@ -0,0 +1,116 @@
+# route_planner/matrix.py
+"""
+Many-to-many distances and durations between trip points, either from the
+routing backend's table service (road distances) or estimated from
+great-circle distances (no routing calls at all).
+
+Road matrices are split into blocks of at most CHUNK_SIZE sources by
+CHUNK_SIZE destinations, one table call each, so a request never exceeds
+OSRM's table size limit. Blocks are fetched CONCURRENCY at a time and kept in
+the route cache, keyed like routes but with service=table, so overlapping
+matrices only fetch the blocks they don't share.
+"""
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .distance import METERS_PER_MILE
+from .instrumentation import span
+from .route_cache import RouteCache
+from .routing_client import get_routing_client
+
+DEFAULT_MATRIX = {
+    'CHUNK_SIZE': 50,
+    'CONCURRENCY': 4,
+    'MAX_LOCATIONS': 1000,
+    'CIRCUITY': 1.2,
+    'AVERAGE_SPEED_MPH': 55.0,
+}
+
+
+def matrix_config() -> Dict:
+    return dict(DEFAULT_MATRIX, **getattr(settings, 'MATRIX', {}))
+
+
+def _chunks(count: int, size: int) -> List[range]:
+    return [range(start, min(start + size, count)) for start in range(0, count, size)]
+
+
+def _fetch_block(sources: Sequence[Tuple[float, float]], destinations: Sequence[Tuple[float, float]],
+                 cache: Optional[RouteCache], profile: str) -> Tuple[Dict, bool]:
+    """(table response, whether it came from the cache) for one block"""
+    coordinates = [*sources, *destinations]
+    params = {
+        'sources': ';'.join(str(i) for i in range(len(sources))),
+        'destinations': ';'.join(str(i) for i in range(len(sources), len(coordinates))),
+        'annotations': 'duration,distance',
+    }
+    cache_key = None
+    if cache is not None:
+        with span('route-cache'):
+            cache_key = cache.make_key(profile, coordinates, dict(params, service='table'))
+            cached = cache.get(cache_key)
+        if cached is not None:
+            return cached, True
+    with span('osrm'):
+        data = get_routing_client().table(coordinates, params, profile)
+    if data.get('code') != 'Ok':
+        raise ValueError(data.get('message') or f'Table request failed: {data.get("code")}')
+    if cache is not None:
+        cache.set(cache_key, data)
+    return data, False
+
+
+def road_matrix(sources: Sequence[Tuple[float, float]], destinations: Sequence[Tuple[float, float]],
+                cache: Optional[RouteCache] = None, profile: str = 'driving') -> Tuple[np.ndarray, np.ndarray, Dict]:
+    """
+    (durations in seconds, distances in meters, stats) between (lon, lat)
+    points along the road network, NaN where there is no route. ``stats``
+    counts the blocks fetched and how many came from the cache.
+    """
+    config = matrix_config()
+    size = max(1, int(config['CHUNK_SIZE']))
+    durations = np.full((len(sources), len(destinations)), np.nan)
+    distances = np.full((len(sources), len(destinations)), np.nan)
+    blocks = [(rows, columns) for rows in _chunks(len(sources), size)
+              for columns in _chunks(len(destinations), size)]
+    stats = {'chunks': len(blocks), 'cached': 0}
+    if not blocks:
+        return durations, distances, stats
+
+    def fetch(block):
+        rows, columns = block
+        return _fetch_block([sources[i] for i in rows], [destinations[j] for j in columns], cache, profile)
+
+    concurrency = max(1, min(int(config['CONCURRENCY']), len(blocks)))
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='matrix') as executor:
+        # Each block runs in a copy of the caller's context so its spans reach the request's Server-Timing
+        futures = [executor.submit(contextvars.copy_context().run, fetch, block) for block in blocks]
+        for (rows, columns), future in zip(blocks, futures):
+            data, cached = future.result()
+            block = np.s_[rows.start:rows.stop, columns.start:columns.stop]
+            # OSRM sends null for pairs it can't connect, which become NaN here
+            durations[block] = np.array(data['durations'], dtype=np.float64)
+            if data.get('distances') is not None:
+                distances[block] = np.array(data['distances'], dtype=np.float64)
+            stats['cached'] += cached
+    return durations, distances, stats
+
+
+def estimate_matrix(miles: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (durations in seconds, distances in meters) estimated from great-circle
+    miles (RoutePlanner.calculate_distances): stretched by CIRCUITY for the
+    detours roads take and driven at AVERAGE_SPEED_MPH.
+    """
+    config = matrix_config()
+    road_miles = np.asarray(miles, dtype=np.float64) * config['CIRCUITY']
+    return road_miles / config['AVERAGE_SPEED_MPH'] * 3600, road_miles * METERS_PER_MILE
+
+
+def fuel_costs(distances: np.ndarray, mpg: float, price: float) -> np.ndarray:
+    """Dollars of fuel to drive each distance (meters) at ``mpg`` and ``price`` per gallon"""
+    return distances / METERS_PER_MILE / mpg * price
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.23 on 2026-10-18 05:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('route_planner', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrecomputedLane',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=40, unique=True)),
+                ('start_lat', models.FloatField()),
+                ('start_lon', models.FloatField()),
+                ('end_lat', models.FloatField()),
+                ('end_lon', models.FloatField()),
+                ('waypoints', models.JSONField(blank=True, default=list)),
+                ('max_range', models.FloatField()),
+                ('mpg', models.FloatField()),
+                ('plan', models.BinaryField()),
+                ('station_ids', models.BinaryField()),
+                ('station_prices', models.BinaryField()),
+                ('requests', models.PositiveIntegerField(default=0)),
+                ('computed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'precomputed_lanes',
+            },
+        ),
+    ]
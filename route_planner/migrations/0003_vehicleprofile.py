@@ -0,0 +1,36 @@
+# Generated by Django 3.2.23 on 2026-10-18 05:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('route_planner', '0002_precomputedlane'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehicleProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(unique=True)),
+                ('name', models.CharField(max_length=100)),
+                ('fuel_type', models.CharField(choices=[('diesel', 'Diesel'), ('gasoline', 'Gasoline')], default='diesel', max_length=20)),
+                ('tank_gallons', models.FloatField()),
+                ('mpg', models.FloatField()),
+                ('mpg_curve', models.JSONField(blank=True, default=list)),
+                ('reserve_fraction', models.FloatField(default=0.0)),
+                ('starting_fuel_fraction', models.FloatField(default=1.0)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+            options={
+                'db_table': 'vehicle_profiles',
+            },
+        ),
+        migrations.AddField(
+            model_name='precomputedlane',
+            name='vehicle_profile',
+            field=models.SlugField(blank=True),
+        ),
+    ]
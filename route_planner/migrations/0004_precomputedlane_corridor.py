@@ -0,0 +1,23 @@
+# Generated by Django 3.2.23 on 2026-10-18 05:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('route_planner', '0003_vehicleprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='precomputedlane',
+            name='cells',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='precomputedlane',
+            name='station_positions',
+            field=models.BinaryField(default=b''),
+        ),
+    ]
@@ -1,11 +1,117 @@
 # route_planner/models.py
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
+
+
+class FuelStationQuerySet(models.QuerySet):
+    def within_bounds(self, south: float, west: float, north: float, east: float):
+        """Stations inside a lat/lon box; served by the composite (latitude, longitude) index"""
+        return self.filter(latitude__range=(south, north), longitude__range=(west, east))
+
 
 class FuelStation(models.Model):
-    name = str
+    """
+    One truck stop from the OPIS price file, stored once per OPIS ID.
+    Loaded and refreshed with ``manage.py import_stations``.
+    """
+    opis_id = models.PositiveIntegerField(unique=True)
+    name = models.CharField(max_length=255)
+    address = models.CharField(max_length=255, blank=True)
+    city = models.CharField(max_length=100, blank=True)
+    state = models.CharField(max_length=2, blank=True)
+    rack_id = models.PositiveIntegerField(null=True, blank=True)
+    # Retail price in dollars per gallon
+    price = models.FloatField()
     latitude = models.FloatField()
     longitude = models.FloatField()
-    price = models.FloatField()
+    # Bumped whenever the import changes the row; the station store reloads on it
+    updated_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    objects = FuelStationQuerySet.as_manager()
 
     class Meta:
         db_table = 'fuel_stations'
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'], name='fuel_stations_lat_lon'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.opis_id})'
+
+
+class VehicleProfile(models.Model):
+    """
+    One kind of truck in the fleet, selected on /route/ and the other
+    planning endpoints with ``vehicle_profile=<slug>``. Served from memory by
+    route_planner.vehicles; edits are picked up within
+    VEHICLE_PROFILES_RECHECK_SECONDS.
+    """
+    FUEL_TYPES = [('diesel', 'Diesel'), ('gasoline', 'Gasoline')]
+
+    slug = models.SlugField(unique=True)
+    name = models.CharField(max_length=100)
+    fuel_type = models.CharField(max_length=20, choices=FUEL_TYPES, default='diesel')
+    tank_gallons = models.FloatField()
+    # Fuel economy at highway cruise; used wherever the trip's speed is unknown
+    mpg = models.FloatField()
+    # [[average speed in mph, mpg], ...]; the trip's average speed picks a point on it
+    mpg_curve = models.JSONField(default=list, blank=True)
+    # Share of the tank kept in reserve and never planned on
+    reserve_fraction = models.FloatField(default=0.0)
+    # Share of the tank full at the start of the trip
+    starting_fuel_fraction = models.FloatField(default=1.0)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        db_table = 'vehicle_profiles'
+
+    def clean(self):
+        from .vehicles import Vehicle
+        try:
+            Vehicle.from_model(self)
+        except ValueError as e:
+            raise ValidationError(str(e))
+
+    def __str__(self):
+        return f'{self.name} ({self.slug})'
+
+
+class PrecomputedLane(models.Model):
+    """
+    The fuel plan of a busy lane, computed ahead of time by
+    ``manage.py precompute_lanes`` and served by the route views without
+    routing or searching (see route_planner.lanes). ``key`` is lanes.lane_key
+    of the trip and vehicle. ``cells`` are the keys (int64) of the grid cells
+    covering the corridor the plan was chosen from, and ``station_ids``,
+    ``station_prices`` and ``station_positions`` the OPIS IDs (int64), prices
+    (float64) and (lat, lon) pairs (float64) of every station in them, so the
+    plan can be dropped as soon as a station there is repriced, moved, removed
+    or added.
+    """
+    key = models.CharField(max_length=40, unique=True)
+    start_lat = models.FloatField()
+    start_lon = models.FloatField()
+    end_lat = models.FloatField()
+    end_lon = models.FloatField()
+    # [[lat, lon], ...] between start and end
+    waypoints = models.JSONField(default=list, blank=True)
+    max_range = models.FloatField()
+    mpg = models.FloatField()
+    # Slug of the VehicleProfile the lane was planned for, if any
+    vehicle_profile = models.SlugField(blank=True)
+    # zlib-compressed JSON of the {'route', 'fuel_stops', 'total_cost'} response
+    plan = models.BinaryField()
+    station_ids = models.BinaryField()
+    station_prices = models.BinaryField()
+    station_positions = models.BinaryField(default=b'')
+    cells = models.BinaryField(default=b'')
+    # Requests seen for the lane in the log it was mined from, if any
+    requests = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        db_table = 'precomputed_lanes'
+
+    def __str__(self):
+        return f'{self.start_lat},{self.start_lon} -> {self.end_lat},{self.end_lon} ({self.key[:8]})'
@@ -0,0 +1,225 @@
+# route_planner/osrm_stub.py
+"""
+Minimal stand-in for an OSRM server, for exercising the routing client,
+benchmarks and load tests without touching the public demo server.
+
+Routes are great-circle lines between the requested coordinates with a vertex
+every ``spacing`` miles, wrapped in OSRM's response format, and tables hold
+great-circle distances. Recorded responses (see benchmarks/osrm_fixtures.py)
+are replayed for the coordinates they were recorded for.
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from .distance import EARTH_RADIUS_MILES, METERS_PER_MILE, haversine_pairwise
+from .routing_client import parse_indices
+from .spatial import to_unit_vectors
+
+# Average speed used for durations, 60 mph
+SPEED_METERS_PER_SECOND = 26.8224
+
+
+def great_circle_points(start: Tuple[float, float], end: Tuple[float, float], spacing: float) -> Tuple[List[List[float]], float]:
+    """[lon, lat] vertices from start to end every ``spacing`` miles, plus the length in miles"""
+    (lon1, lat1), (lon2, lat2) = start, end
+    a, b = to_unit_vectors([lat1, lat2], [lon1, lon2])
+    angle = float(np.arccos(np.clip(np.dot(a, b), -1.0, 1.0)))
+    miles = angle * EARTH_RADIUS_MILES
+    n = max(int(np.ceil(miles / spacing)), 1)
+    t = np.linspace(0.0, 1.0, n + 1)[:, None]
+    if angle < 1e-12:
+        points = np.repeat(a[None, :], n + 1, axis=0)
+    else:
+        points = (np.sin((1 - t) * angle) * a + np.sin(t * angle) * b) / np.sin(angle)
+    lats = np.degrees(np.arcsin(np.clip(points[:, 2], -1.0, 1.0)))
+    lons = np.degrees(np.arctan2(points[:, 1], points[:, 0]))
+    return np.column_stack((lons, lats)).round(6).tolist(), miles
+
+
+def build_route_response(coordinates: List[Tuple[float, float]], spacing: float = 0.25,
+                         steps: bool = True, annotations: bool = False) -> Dict:
+    """An OSRM /route response for the given [lon, lat] coordinates"""
+    geometry, legs = [], []
+    for start, end in zip(coordinates[:-1], coordinates[1:]):
+        points, miles = great_circle_points(start, end, spacing)
+        meters = miles * METERS_PER_MILE
+        leg = {'distance': meters, 'duration': meters / SPEED_METERS_PER_SECOND, 'summary': '', 'weight': meters}
+        if annotations:
+            count = len(points) - 1
+            segment = meters / count
+            leg['annotation'] = {
+                'distance': [segment] * count,
+                'duration': [segment / SPEED_METERS_PER_SECOND] * count,
+                'speed': [SPEED_METERS_PER_SECOND] * count,
+                'nodes': list(range(len(points))),
+            }
+        if steps:
+            leg['steps'] = [
+                {
+                    'distance': meters, 'duration': leg['duration'], 'name': 'Stub Highway',
+                    'maneuver': {'type': 'depart', 'instruction': 'Head out', 'location': list(start)},
+                    'geometry': {'type': 'LineString', 'coordinates': points},
+                },
+                {
+                    'distance': 0.0, 'duration': 0.0, 'name': 'Stub Highway',
+                    'maneuver': {'type': 'arrive', 'instruction': 'You have arrived', 'location': list(end)},
+                    'geometry': {'type': 'LineString', 'coordinates': [points[-1], points[-1]]},
+                },
+            ]
+        legs.append(leg)
+        geometry.extend(points if not geometry else points[1:])
+    distance = sum(leg['distance'] for leg in legs)
+    return {
+        'code': 'Ok',
+        'routes': [{
+            'distance': distance,
+            'duration': distance / SPEED_METERS_PER_SECOND,
+            'weight': distance,
+            'weight_name': 'routability',
+            'geometry': {'type': 'LineString', 'coordinates': geometry},
+            'legs': legs,
+        }],
+        'waypoints': [{'name': '', 'location': list(c), 'distance': 0.0} for c in coordinates],
+    }
+
+
+def build_table_response(coordinates: List[Tuple[float, float]], sources: List[int], destinations: List[int]) -> Dict:
+    """An OSRM /table response: great-circle distances between the chosen coordinates at 60 mph"""
+    points = np.asarray(coordinates, dtype=np.float64)
+    src, dst = points[sources], points[destinations]
+    meters = haversine_pairwise(src[:, 1], src[:, 0], dst[:, 1], dst[:, 0]) * METERS_PER_MILE
+    return {
+        'code': 'Ok',
+        'distances': meters.tolist(),
+        'durations': (meters / SPEED_METERS_PER_SECOND).tolist(),
+        'sources': [{'name': '', 'location': list(coordinates[i]), 'distance': 0.0} for i in sources],
+        'destinations': [{'name': '', 'location': list(coordinates[i]), 'distance': 0.0} for i in destinations],
+    }
+
+
+def recording_key(coordinates) -> Tuple[Tuple[float, float], ...]:
+    """[lon, lat] pairs rounded to about a metre, to match requests to recordings"""
+    return tuple((round(float(lon), 5), round(float(lat), 5)) for lon, lat in coordinates)
+
+
+def parse_coordinates(segment: str) -> List[Tuple[float, float]]:
+    coordinates = []
+    for pair in segment.split(';'):
+        lon, lat = pair.split(',')
+        coordinates.append((float(lon), float(lat)))
+    return coordinates
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: 'StubOSRMServer'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: Dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        stub = self.server
+        stub.record_request()
+        if stub.latency:
+            time.sleep(stub.latency)
+        failure = stub.next_failure()
+        if failure:
+            return self._send(failure, {'code': 'Error', 'message': f'Injected HTTP {failure}'})
+
+        url = urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) != 4 or parts[1] != 'v1':
+            return self._send(400, {'code': 'InvalidUrl', 'message': f'URL string malformed: {url.path}'})
+        try:
+            coordinates = parse_coordinates(parts[3])
+        except ValueError:
+            return self._send(400, {'code': 'InvalidQuery', 'message': 'Query string malformed'})
+        if len(coordinates) < 2:
+            return self._send(400, {'code': 'InvalidQuery', 'message': 'At least two coordinates required'})
+
+        query = parse_qs(url.query)
+        if parts[0] == 'route':
+            recorded = stub.recordings.get(recording_key(coordinates))
+            if recorded is not None:
+                return self._send(200, recorded)
+            steps = query.get('steps', ['false'])[0] == 'true'
+            annotations = query.get('annotations', ['false'])[0] == 'true'
+            return self._send(200, build_route_response(coordinates, stub.spacing, steps, annotations))
+        if parts[0] == 'table':
+            try:
+                sources = parse_indices(query.get('sources', ['all'])[0], len(coordinates))
+                destinations = parse_indices(query.get('destinations', ['all'])[0], len(coordinates))
+            except ValueError as e:
+                return self._send(400, {'code': 'InvalidOptions', 'message': str(e)})
+            return self._send(200, build_table_response(coordinates, sources, destinations))
+        return self._send(400, {'code': 'InvalidService', 'message': f'Service {parts[0]} not found!'})
+
+
+class StubOSRMServer(ThreadingHTTPServer):
+    """
+    Threaded OSRM stub. ``latency`` seconds are added to every response and
+    ``fail_next`` makes the next requests return an HTTP error status.
+    ``recordings`` maps recording_key(coordinates) to a /route response to
+    serve as is.
+    """
+
+    daemon_threads = True
+    # The socketserver default of 5 drops connections under load-test concurrency
+    request_queue_size = 1024
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, spacing: float = 0.25,
+                 recordings: Optional[Dict[Tuple, Dict]] = None):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.spacing = spacing
+        self.recordings = dict(recordings or {})
+        self.request_count = 0
+        self._failures: List[int] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def record_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def fail_next(self, count: int = 1, status: int = 503):
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def next_failure(self) -> Optional[int]:
+        with self._lock:
+            return self._failures.pop(0) if self._failures else None
+
+    def handle_error(self, request, client_address):
+        # Clients that time out hang up mid-response; that is expected here
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self) -> 'StubOSRMServer':
+        """Serve from a daemon thread and return self"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
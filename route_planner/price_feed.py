@@ -0,0 +1,100 @@
+# route_planner/price_feed.py
+import csv
+import json
+import os
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def _chunks(pairs, chunk_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    opis_ids, prices = [], []
+    for opis_id, price in pairs:
+        opis_ids.append(opis_id)
+        prices.append(price)
+        if len(opis_ids) == chunk_size:
+            yield np.array(opis_ids, dtype=np.int64), np.array(prices, dtype=np.float64)
+            opis_ids, prices = [], []
+    if opis_ids:
+        yield np.array(opis_ids, dtype=np.int64), np.array(prices, dtype=np.float64)
+
+
+def _csv_pairs(f):
+    # Same column names as the full OPIS price file, so a trimmed copy of it works too
+    for line, row in enumerate(csv.DictReader(f), start=2):
+        try:
+            yield int(row['OPIS Truckstop ID']), float(row['Retail Price'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f'line {line}: bad price row ({e})')
+
+
+def _jsonl_pairs(f):
+    for line, text in enumerate(f, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+            yield int(row['opis_id']), float(row['price'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f'line {line}: bad price row ({e})')
+
+
+def read_price_updates(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Stream a price delta feed as (opis_id, price) array chunks.
+    ``.jsonl`` files hold one {"opis_id": ..., "price": ...} object per line;
+    anything else is read as CSV with OPIS Truckstop ID and Retail Price columns.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        pairs = _jsonl_pairs(f) if path.endswith('.jsonl') else _csv_pairs(f)
+        yield from _chunks(pairs, chunk_size)
+
+
+def write_price_updates(updates: Iterable[Tuple[np.ndarray, np.ndarray]], path: str) -> int:
+    """
+    Write (opis_id, price) chunks as a feed file in the format its extension
+    selects, replacing ``path`` atomically so a watching worker never reads a
+    half-written feed. Returns the number of rows written.
+    """
+    rows = 0
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    try:
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            jsonl = path.endswith('.jsonl')
+            writer = None if jsonl else csv.writer(f)
+            if writer is not None:
+                writer.writerow(['OPIS Truckstop ID', 'Retail Price'])
+            for opis_ids, prices in updates:
+                for opis_id, price in zip(opis_ids.tolist(), prices.tolist()):
+                    if jsonl:
+                        f.write(json.dumps({'opis_id': opis_id, 'price': price}) + '\n')
+                    else:
+                        writer.writerow([opis_id, repr(price)])
+                rows += len(opis_ids)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return rows
+
+
+class PriceFeed:
+    """
+    A delta feed file watched by the station stores. Its prices are applied on
+    top of the station data whenever the feed is newer than that data.
+    """
+
+    def __init__(self, path: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+
+    def mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def updates(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        return read_price_updates(self.path, self.chunk_size)
@@ -0,0 +1,49 @@
+# route_planner/renderers.py
+import json
+
+from django.http import HttpResponse
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+
+from .instrumentation import span
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+def dumps(data) -> bytes:
+    """Compact JSON; several times faster with orjson installed, plain json otherwise"""
+    with span('serialize'):
+        if orjson is not None:
+            return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+        return json.dumps(data, separators=(',', ':')).encode()
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    DRF JSON renderer backed by orjson. Route responses are mostly long lists
+    of floats, which is where the stdlib encoder is slowest. Falls back to
+    DRF's JSONRenderer when orjson isn't installed or for indented output.
+
+    Unlike DRF's renderer, which rejects NaN and infinity, orjson writes them
+    as null. That suits the route payloads, so it is set per view (see
+    ROUTE_RENDERERS) rather than as the project default.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            with span('serialize'):
+                return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+# renderer_classes of the views that return routes, stops and matrices
+ROUTE_RENDERERS = (ORJSONRenderer, BrowsableAPIRenderer)
+
+
+def json_response(data, status: int = 200) -> HttpResponse:
+    """JsonResponse for plain Django views, serialized with ``dumps``"""
+    return HttpResponse(dumps(data), status=status, content_type='application/json')
@@ -0,0 +1,410 @@
+# route_planner/road_graph.py
+"""
+In-process routing over a preprocessed road graph, for running without an
+OSRM server (ROUTING['BACKEND'] = 'local').
+
+The graph is directed and stored in CSR form as NumPy arrays: edges leaving
+node n are ``indptr[n]:indptr[n + 1]`` of ``indices`` (head node),
+``distance`` (meters), ``duration`` (seconds) and ``name_codes``. Routes are
+the fastest paths found with A*. The heuristic is the great-circle distance at
+the graph's top speed, so it never overestimates and paths are optimal.
+Tables run one Dijkstra per source. Answers use OSRM's /route and /table
+response formats, so RoutePlanner.map_osrm_response and everything after it
+work unchanged.
+
+Build a graph with ``manage.py build_road_graph`` from a CSV of edges or
+GeoJSON road lines, for example an interstate/highway extract.
+"""
+import asyncio
+import heapq
+import json
+import math
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+from scipy.spatial import cKDTree
+
+from .distance import EARTH_RADIUS_MILES, METERS_PER_MILE, haversine
+from .routing_client import parse_indices
+from .spatial import to_unit_vectors
+
+GRAPH_FORMAT = 1
+DEFAULT_SPEED_MPH = 55.0
+METERS_PER_SECOND_PER_MPH = METERS_PER_MILE / 3600.0
+EARTH_RADIUS_METERS = EARTH_RADIUS_MILES * METERS_PER_MILE
+
+# (from_lat, from_lon, to_lat, to_lon, name, speed_mph, oneway)
+Edge = Tuple[float, float, float, float, str, Optional[float], bool]
+
+
+class RoadGraph:
+    def __init__(self, latitude: np.ndarray, longitude: np.ndarray, indptr: np.ndarray, indices: np.ndarray,
+                 distance: np.ndarray, duration: np.ndarray, name_codes: np.ndarray, names: Sequence[str],
+                 source: str = ''):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.indptr = indptr
+        self.indices = indices
+        self.distance = distance
+        self.duration = duration
+        self.name_codes = name_codes
+        self.names = list(names)
+        self.source = source
+        self.tree = cKDTree(to_unit_vectors(latitude, longitude))
+        # Top speed in m/s, for the A* heuristic
+        self.max_speed = float((distance / duration).max()) if len(distance) else 1.0
+        self._search = None
+        self._matrix = None
+        self._edge_keys = None
+        self._search_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.latitude)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.indices)
+
+    @classmethod
+    def from_edges(cls, edges: Iterable[Edge], default_speed: float = DEFAULT_SPEED_MPH,
+                   largest_component: bool = True, precision: int = 6, source: str = '') -> 'RoadGraph':
+        """
+        Build a graph from road segments. Endpoints equal to ``precision``
+        decimal places are one node. Two-way segments get an edge each way,
+        and the fastest of parallel edges is kept. By default only the
+        largest strongly connected component is kept, so every node can
+        reach every other.
+        """
+        nodes: Dict[Tuple[float, float], int] = {}
+        names: Dict[str, int] = {}
+        tails, heads, speeds, codes = [], [], [], []
+        for from_lat, from_lon, to_lat, to_lon, name, speed, oneway in edges:
+            tail = nodes.setdefault((round(from_lat, precision), round(from_lon, precision)), len(nodes))
+            head = nodes.setdefault((round(to_lat, precision), round(to_lon, precision)), len(nodes))
+            if tail == head:
+                continue
+            code = names.setdefault(name or '', len(names))
+            speed = float(speed or default_speed)
+            if speed <= 0:
+                raise ValueError(f'Speed must be positive, got {speed} for {name!r}')
+            pairs = [(tail, head)] if oneway else [(tail, head), (head, tail)]
+            for a, b in pairs:
+                tails.append(a)
+                heads.append(b)
+                speeds.append(speed)
+                codes.append(code)
+        if not tails:
+            raise ValueError('No road segments')
+
+        coordinates = np.array(list(nodes), dtype=np.float64)
+        latitude, longitude = coordinates[:, 0], coordinates[:, 1]
+        tails, heads = np.array(tails, dtype=np.int64), np.array(heads, dtype=np.int64)
+        distance = haversine(latitude[tails], longitude[tails], latitude[heads], longitude[heads]) * METERS_PER_MILE
+        duration = distance / (np.array(speeds) * METERS_PER_SECOND_PER_MPH)
+        codes = np.array(codes, dtype=np.int32)
+
+        # Fastest of parallel edges: sort by (tail, head, duration) and keep the first of each pair
+        order = np.lexsort((duration, heads, tails))
+        tails, heads, distance, duration, codes = (a[order] for a in (tails, heads, distance, duration, codes))
+        first = np.ones(len(tails), dtype=bool)
+        first[1:] = (tails[1:] != tails[:-1]) | (heads[1:] != heads[:-1])
+        tails, heads, distance, duration, codes = (a[first] for a in (tails, heads, distance, duration, codes))
+
+        if largest_component:
+            adjacency = csr_matrix((np.ones(len(tails)), (tails, heads)), shape=(len(nodes), len(nodes)))
+            _, labels = connected_components(adjacency, directed=True, connection='strong')
+            keep_nodes = labels == np.bincount(labels).argmax()
+            renumber = np.cumsum(keep_nodes) - 1
+            keep = keep_nodes[tails] & keep_nodes[heads]
+            tails, heads = renumber[tails[keep]], renumber[heads[keep]]
+            distance, duration, codes = distance[keep], duration[keep], codes[keep]
+            latitude, longitude = latitude[keep_nodes], longitude[keep_nodes]
+
+        indptr = np.zeros(len(latitude) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tails, minlength=len(latitude)), out=indptr[1:])
+        return cls(latitude, longitude, indptr, heads.astype(np.int32), distance, duration, codes,
+                   list(names), source=source)
+
+    def save(self, path: str):
+        """Write the graph as .npz, through a temporary file so readers never see half of it"""
+        tmp_path = f'{path}.tmp-{os.getpid()}.npz'
+        try:
+            np.savez(tmp_path, format=np.array(GRAPH_FORMAT), latitude=self.latitude, longitude=self.longitude,
+                     indptr=self.indptr, indices=self.indices, distance=self.distance, duration=self.duration,
+                     name_codes=self.name_codes, names=np.array(json.dumps(self.names)))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @classmethod
+    def load(cls, path: str) -> 'RoadGraph':
+        with np.load(path) as data:
+            if int(data['format']) != GRAPH_FORMAT:
+                raise ValueError(f'{path} has graph format {int(data["format"])}, expected {GRAPH_FORMAT}')
+            return cls(data['latitude'], data['longitude'], data['indptr'], data['indices'], data['distance'],
+                       data['duration'], data['name_codes'], json.loads(str(data['names'])), source=path)
+
+    def nearest(self, lat: float, lon: float) -> Tuple[int, float]:
+        """(node, distance in miles) of the node closest to a point"""
+        chord, node = self.tree.query(to_unit_vectors([lat], [lon])[0])
+        return int(node), 2.0 * math.asin(min(1.0, chord / 2.0)) * EARTH_RADIUS_MILES
+
+    def _search_arrays(self):
+        # Plain lists index several times faster than NumPy arrays in the search loop
+        if self._search is None:
+            with self._search_lock:
+                if self._search is None:
+                    xyz = to_unit_vectors(self.latitude, self.longitude)
+                    self._search = (self.indptr.tolist(), self.indices.tolist(), self.duration.tolist(),
+                                    xyz[:, 0].tolist(), xyz[:, 1].tolist(), xyz[:, 2].tolist())
+        return self._search
+
+    def shortest_path(self, source: int, target: int) -> Optional[List[int]]:
+        """Edge ids of the fastest path from ``source`` to ``target``, or None when there is none"""
+        if source == target:
+            return []
+        indptr, indices, duration, xs, ys, zs = self._search_arrays()
+        tx, ty, tz = xs[target], ys[target], zs[target]
+        # Seconds to cover the great-circle distance at top speed, from the chord through the unit sphere
+        scale = 2.0 * EARTH_RADIUS_METERS / self.max_speed
+        asin, sqrt = math.asin, math.sqrt
+
+        def heuristic(node: int) -> float:
+            dx, dy, dz = xs[node] - tx, ys[node] - ty, zs[node] - tz
+            return scale * asin(min(1.0, sqrt(dx * dx + dy * dy + dz * dz) / 2.0))
+
+        best = {source: 0.0}
+        # node -> (edge it was reached by, previous node)
+        via: Dict[int, Tuple[int, int]] = {}
+        done = set()
+        heap = [(heuristic(source), 0.0, source)]
+        while heap:
+            _, cost, node = heapq.heappop(heap)
+            if node == target:
+                break
+            if node in done:
+                continue
+            done.add(node)
+            for edge in range(indptr[node], indptr[node + 1]):
+                head = indices[edge]
+                new_cost = cost + duration[edge]
+                if new_cost < best.get(head, math.inf):
+                    best[head] = new_cost
+                    via[head] = (edge, node)
+                    heapq.heappush(heap, (new_cost + heuristic(head), new_cost, head))
+        else:
+            return None
+
+        path = []
+        node = target
+        while node != source:
+            edge, node = via[node]
+            path.append(edge)
+        path.reverse()
+        return path
+
+    def _tree_distances(self, predecessors: np.ndarray) -> np.ndarray:
+        """
+        Meters from the root of a shortest-path tree to every node it
+        reaches, by pointer jumping. Each round adds the distance up to a
+        node's ancestor and then skips to that ancestor's ancestor, so depth
+        d takes log2(d) vectorized rounds instead of a walk per node.
+        """
+        count = len(predecessors)
+        nodes = np.nonzero(predecessors >= 0)[0]
+        parents = predecessors[nodes].astype(np.int64)
+        # Edges are sorted by (tail, head), so tail * count + head is sorted too
+        edges = np.searchsorted(self._edge_keys, parents * count + nodes)
+        total = np.zeros(count)
+        total[nodes] = self.distance[edges]
+        up = np.arange(count)
+        up[nodes] = parents
+        while True:
+            above = up[up]
+            if np.array_equal(above, up):
+                return total
+            total = total + total[up]
+            up = above
+
+    def table(self, coordinates: Sequence[Tuple[float, float]], sources: Sequence[int],
+              destinations: Sequence[int], max_snap_miles: float = 50.0) -> Dict:
+        """An OSRM /table response with durations and distances of the fastest paths; null where unreachable"""
+        if self._matrix is None:
+            with self._search_lock:
+                if self._matrix is None:
+                    tails = np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.indptr))
+                    self._edge_keys = tails * len(self) + self.indices
+                    self._matrix = csr_matrix((self.duration, self.indices, self.indptr), shape=(len(self), len(self)))
+        snapped = [self.nearest(lat, lon) for lon, lat in coordinates]
+        usable = np.array([miles <= max_snap_miles for _, miles in snapped])
+        targets = np.array([snapped[j][0] for j in destinations], dtype=np.int64)
+        durations = np.full((len(sources), len(destinations)), np.nan)
+        distances = np.full((len(sources), len(destinations)), np.nan)
+        for row, i in enumerate(sources):
+            if not usable[i]:
+                continue
+            cost, predecessors = dijkstra(self._matrix, indices=snapped[i][0], return_predecessors=True)
+            durations[row] = cost[targets]
+            distances[row] = self._tree_distances(predecessors)[targets]
+        unreachable = ~np.isfinite(durations) | ~usable[list(destinations)][None, :]
+        durations[unreachable] = np.nan
+        distances[unreachable] = np.nan
+
+        def cells(matrix):
+            return [[None if np.isnan(value) else value for value in row] for row in matrix.tolist()]
+
+        def waypoints(indices):
+            return [{'name': '', 'location': self._location(snapped[i][0]), 'distance': snapped[i][1] * METERS_PER_MILE}
+                    for i in indices]
+
+        return {'code': 'Ok', 'durations': cells(durations), 'distances': cells(distances),
+                'sources': waypoints(sources), 'destinations': waypoints(destinations)}
+
+    def _location(self, node: int) -> List[float]:
+        return [round(float(self.longitude[node]), 6), round(float(self.latitude[node]), 6)]
+
+    def route(self, coordinates: Sequence[Tuple[float, float]], steps: bool = True, annotations: bool = False,
+              max_snap_miles: float = 50.0) -> Dict:
+        """An OSRM /route response for [lon, lat] coordinates, one leg between each consecutive pair"""
+        snapped = []
+        for i, (lon, lat) in enumerate(coordinates):
+            node, miles = self.nearest(lat, lon)
+            if miles > max_snap_miles:
+                return {'code': 'NoSegment', 'message': f'Could not find a matching segment for coordinate {i}'}
+            snapped.append((node, miles))
+
+        legs, geometry = [], []
+        for (source, _), (target, _) in zip(snapped[:-1], snapped[1:]):
+            path = self.shortest_path(source, target)
+            if path is None:
+                return {'code': 'NoRoute', 'message': 'Impossible route between points'}
+            nodes = [source] + [int(self.indices[edge]) for edge in path]
+            points = [self._location(node) for node in nodes]
+            legs.append(self._leg(path, points, steps, annotations))
+            geometry.extend(points if not geometry else points[1:])
+        if len(geometry) == 1:
+            geometry.append(geometry[0])
+
+        distance = sum(leg['distance'] for leg in legs)
+        duration = sum(leg['duration'] for leg in legs)
+        return {
+            'code': 'Ok',
+            'routes': [{
+                'distance': distance,
+                'duration': duration,
+                'weight': duration,
+                'weight_name': 'duration',
+                'geometry': {'type': 'LineString', 'coordinates': geometry},
+                'legs': legs,
+            }],
+            'waypoints': [
+                {'name': '', 'location': self._location(node), 'distance': miles * METERS_PER_MILE}
+                for node, miles in snapped
+            ],
+        }
+
+    def _leg(self, path: List[int], points: List[List[float]], steps: bool, annotations: bool) -> Dict:
+        distances = self.distance[path].tolist()
+        durations = self.duration[path].tolist()
+        codes = self.name_codes[path].tolist()
+        leg = {'distance': sum(distances), 'duration': sum(durations), 'weight': sum(durations), 'summary': ''}
+        # Road names in order of distance driven on them, as OSRM's leg summary
+        driven: Dict[int, float] = {}
+        for code, meters in zip(codes, distances):
+            driven[code] = driven.get(code, 0.0) + meters
+        leg['summary'] = ', '.join(self.names[code] for code in sorted(driven, key=driven.get, reverse=True)[:2]
+                                   if self.names[code])
+        if annotations:
+            leg['annotation'] = {
+                'distance': distances,
+                'duration': durations,
+                'speed': [d / t if t else 0.0 for d, t in zip(distances, durations)],
+            }
+        if steps:
+            leg['steps'] = self._steps(points, distances, durations, codes)
+        return leg
+
+    def _steps(self, points, distances, durations, codes) -> List[Dict]:
+        """One step per stretch on the same road, then the arrival"""
+        result = []
+        start = 0
+        for end in range(1, len(codes) + 1):
+            if end < len(codes) and codes[end] == codes[start]:
+                continue
+            name = self.names[codes[start]]
+            first = not result
+            result.append({
+                'distance': sum(distances[start:end]),
+                'duration': sum(durations[start:end]),
+                'name': name,
+                'maneuver': {
+                    'type': 'depart' if first else 'new name',
+                    'modifier': None if first else 'straight',
+                    'instruction': f'Head out on {name}' if first else f'Continue onto {name}',
+                    'location': points[start],
+                },
+                'geometry': {'type': 'LineString', 'coordinates': points[start:end + 1]},
+            })
+            start = end
+        result.append({
+            'distance': 0.0, 'duration': 0.0, 'name': self.names[codes[-1]] if codes else '',
+            'maneuver': {'type': 'arrive', 'instruction': 'You have arrived', 'location': points[-1]},
+            'geometry': {'type': 'LineString', 'coordinates': [points[-1], points[-1]]},
+        })
+        return result
+
+
+class LocalRoutingClient:
+    """Drop-in for OSRMClient that answers from a RoadGraph in this process; no network involved"""
+
+    def __init__(self, graph: RoadGraph, max_snap_miles: float = 50.0):
+        self.graph = graph
+        self.max_snap_miles = max_snap_miles
+
+    def request(self, service: str, coordinates: Sequence[Tuple[float, float]], params: Dict,
+                profile: str = 'driving') -> Dict:
+        if service not in ('route', 'table'):
+            return {'code': 'InvalidService', 'message': f'Service {service} not found!'}
+        if len(coordinates) < 2 and service == 'route':
+            return {'code': 'InvalidQuery', 'message': 'At least two coordinates required'}
+        if service == 'table':
+            try:
+                sources = parse_indices(params.get('sources'), len(coordinates))
+                destinations = parse_indices(params.get('destinations'), len(coordinates))
+            except ValueError as e:
+                return {'code': 'InvalidOptions', 'message': str(e)}
+            return self.graph.table(coordinates, sources, destinations, self.max_snap_miles)
+        return self.graph.route(
+            coordinates,
+            steps=str(params.get('steps', 'false')).lower() == 'true',
+            annotations=str(params.get('annotations', 'false')).lower() not in ('false', ''),
+            max_snap_miles=self.max_snap_miles,
+        )
+
+    def route(self, coordinates: Sequence[Tuple[float, float]], params: Dict, profile: str = 'driving') -> Dict:
+        return self.request('route', coordinates, params, profile)
+
+    def table(self, coordinates: Sequence[Tuple[float, float]], params: Dict, profile: str = 'driving') -> Dict:
+        return self.request('table', coordinates, params, profile)
+
+
+class AsyncLocalRoutingClient:
+    """LocalRoutingClient for the async views; the search runs on a worker thread, off the event loop"""
+
+    def __init__(self, client: LocalRoutingClient):
+        self.client = client
+
+    async def request(self, service: str, coordinates: Sequence[Tuple[float, float]], params: Dict,
+                      profile: str = 'driving') -> Dict:
+        return await asyncio.to_thread(self.client.request, service, coordinates, params, profile)
+
+    async def route(self, coordinates: Sequence[Tuple[float, float]], params: Dict, profile: str = 'driving') -> Dict:
+        return await self.request('route', coordinates, params, profile)
+
+    async def table(self, coordinates: Sequence[Tuple[float, float]], params: Dict, profile: str = 'driving') -> Dict:
+        return await self.request('table', coordinates, params, profile)
@@ -0,0 +1,249 @@
+# route_planner/route_cache.py
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROUTE_CACHE = {
+    'BACKEND': 'route_planner.route_cache.MemoryBackend',
+    'PRECISION': 4,
+    'TIMEOUT': 24 * 60 * 60,
+    'OPTIONS': {},
+}
+
+DEFAULT_MAP_CACHE = {
+    'BACKEND': 'route_planner.route_cache.MemoryBackend',
+    'TIMEOUT': 60 * 60,
+    'OPTIONS': {'max_entries': 128},
+}
+
+
+class MemoryBackend:
+    """In-process LRU with a per-entry TTL. Cached routes are shared, never copy-on-read."""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, timeout: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoCacheBackend:
+    """Store routes in one of the project's CACHES, e.g. a shared Redis or memcached"""
+
+    def __init__(self, alias: str = 'default'):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+
+    def get(self, key: str):
+        return self.cache.get(key)
+
+    def set(self, key: str, value, timeout: float):
+        self.cache.set(key, value, timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class SQLiteBackend:
+    """
+    On-disk store that survives restarts and is shared by every worker on the
+    host. Expired rows are deleted when read and, at most every
+    ``purge_interval`` seconds, all at once on a write, so the file doesn't grow
+    with routes nobody asks for again.
+    """
+
+    def __init__(self, path: str = 'route_cache.sqlite3', purge_interval: float = 600.0):
+        self.path = str(path)
+        self.purge_interval = purge_interval
+        self._purged_at = time.monotonic()
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS route_cache '
+                '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)'
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str):
+        row = self._connection().execute(
+            'SELECT value, expires FROM route_cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if row[1] < now:
+            with self._connection() as conn:
+                # Another worker may have rewritten the key since it was read
+                conn.execute('DELETE FROM route_cache WHERE key = ? AND expires < ?', (key, now))
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    def set(self, key: str, value, timeout: float):
+        blob = zlib.compress(json.dumps(value, separators=(',', ':')).encode())
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO route_cache (key, value, expires) VALUES (?, ?, ?)',
+                (key, blob, time.time() + timeout)
+            )
+            if time.monotonic() - self._purged_at >= self.purge_interval:
+                self._purged_at = time.monotonic()
+                conn.execute('DELETE FROM route_cache WHERE expires < ?', (time.time(),))
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM route_cache')
+
+
+class RouteCache:
+    """
+    Cache of mapped routes keyed by profile, coordinates snapped to
+    ``precision`` decimal places and the routing options. Also used, with
+    keys built by the caller, for rendered maps.
+    """
+
+    def __init__(self, backend, precision: int = 4, timeout: float = 24 * 60 * 60):
+        self.backend = backend
+        self.precision = precision
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def snap(self, coordinates: Sequence[Tuple[float, float]]) -> Tuple[Tuple[float, float], ...]:
+        return tuple((round(float(lon), self.precision), round(float(lat), self.precision))
+                     for lon, lat in coordinates)
+
+    def make_key(self, profile: str, coordinates: Sequence[Tuple[float, float]], options: Dict) -> str:
+        coords = ';'.join(f'{lon},{lat}' for lon, lat in self.snap(coordinates))
+        opts = '&'.join(f'{k}={options[k]}' for k in sorted(options))
+        digest = hashlib.sha1(f'{profile}|{coords}|{opts}'.encode()).hexdigest()
+        return f'route:{digest}'
+
+    def get(self, key: str):
+        try:
+            value = self.backend.get(key)
+        except Exception:
+            # A broken cache must never take routing down with it
+            logger.exception('Route cache read failed')
+            self.errors += 1
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value):
+        try:
+            self.backend.set(key, value, self.timeout)
+        except Exception:
+            logger.exception('Route cache write failed')
+            self.errors += 1
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+_caches: Dict[str, Optional[RouteCache]] = {}
+_caches_lock = threading.Lock()
+
+
+def _configured_cache(setting: str, defaults: Dict) -> Optional[RouteCache]:
+    if setting not in _caches:
+        with _caches_lock:
+            if setting not in _caches:
+                config = dict(defaults, **getattr(settings, setting, {}))
+                cache = None
+                if config['BACKEND']:
+                    backend = import_string(config['BACKEND'])(**config['OPTIONS'])
+                    cache = RouteCache(backend, config.get('PRECISION', 4), config['TIMEOUT'])
+                _caches[setting] = cache
+    return _caches[setting]
+
+
+def get_route_cache() -> Optional[RouteCache]:
+    """The worker's route cache as configured by ``settings.ROUTE_CACHE``, or None if disabled"""
+    return _configured_cache('ROUTE_CACHE', DEFAULT_ROUTE_CACHE)
+
+
+def get_map_cache() -> Optional[RouteCache]:
+    """The worker's cache of rendered maps (``settings.MAP_CACHE``), or None if disabled"""
+    return _configured_cache('MAP_CACHE', DEFAULT_MAP_CACHE)
+
+
+def cache_metrics() -> Iterator[str]:
+    """Lookup counters of the caches this worker has opened, in the Prometheus text format"""
+    with _caches_lock:
+        caches = [(setting.split('_')[0].lower(), cache) for setting, cache in sorted(_caches.items())
+                  if cache is not None]
+    metrics = (
+        ('hits', 'counter', 'Cache lookups answered from the cache'),
+        ('misses', 'counter', 'Cache lookups that found nothing'),
+        ('errors', 'counter', 'Cache reads and writes that failed'),
+        ('hit_ratio', 'gauge', 'Hits over lookups since the worker started'),
+    )
+    stats = [(name, cache.stats()) for name, cache in caches]
+    for field, kind, documentation in metrics:
+        metric = f'route_planner_cache_{field}' + ('_total' if kind == 'counter' else '')
+        yield f'# HELP {metric} {documentation}'
+        yield f'# TYPE {metric} {kind}'
+        for name, values in stats:
+            yield f'{metric}{{cache="{name}"}} {values[field]}'
+
+
+def cache_bypassed(request, data=None) -> bool:
+    """True when the client asked to skip the route cache (``?cache=false`` or ``Cache-Control: no-cache``)"""
+    value = getattr(request, 'query_params', request.GET).get('cache')
+    if data is None:
+        data = getattr(request, 'data', None)
+    if value is None and hasattr(data, 'get'):
+        value = data.get('cache')
+    if value is not None and str(value).lower() in ('0', 'false', 'no', 'off'):
+        return True
+    return 'no-cache' in request.headers.get('Cache-Control', '')
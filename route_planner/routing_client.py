@@ -0,0 +1,363 @@
+# route_planner/routing_client.py
+import asyncio
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OSRM = {
+    'BASE_URL': 'http://router.project-osrm.org',
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 15.0,
+    'RETRIES': 2,
+    'BACKOFF_FACTOR': 0.3,
+    'POOL_SIZE': 10,
+    'ASYNC_POOL_SIZE': 200,
+    'CIRCUIT_FAILURE_THRESHOLD': 5,
+    'CIRCUIT_RESET_TIMEOUT': 30.0,
+}
+
+DEFAULT_ROUTING = {
+    'BACKEND': 'osrm',
+    'GRAPH': None,
+    'MAX_SNAP_MILES': 50.0,
+}
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RoutingError(Exception):
+    """The routing backend could not produce a response"""
+
+
+class RoutingUnavailable(RoutingError):
+    """The circuit breaker is open; the backend is not being called"""
+
+
+class CircuitBreaker:
+    """
+    Stop calling a failing upstream for ``reset_timeout`` seconds after
+    ``failure_threshold`` consecutive failures, then let one trial call through.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """End a call without a verdict on the upstream (e.g. it was cancelled) so a half-open trial isn't held"""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+def format_coordinates(coordinates: Sequence[Tuple[float, float]]) -> str:
+    """OSRM's ``lon,lat;lon,lat`` path segment"""
+    return ';'.join(f'{lon},{lat}' for lon, lat in coordinates)
+
+
+def parse_indices(value: Optional[str], count: int) -> List[int]:
+    """OSRM's ``sources``/``destinations`` parameter ('all' or '0;2;5') as coordinate indices"""
+    if value is None or value == 'all':
+        return list(range(count))
+    indices = [int(index) for index in str(value).split(';')]
+    if any(not 0 <= index < count for index in indices):
+        raise ValueError(f'Index out of range in {value}')
+    return indices
+
+
+class OSRMClient:
+    """
+    HTTP client for an OSRM server. Keeps a keep-alive connection pool, retries
+    connection errors and 429/5xx responses with exponential backoff, and sits
+    behind a circuit breaker so a dead upstream fails fast.
+    """
+
+    def __init__(self, base_url: str, connect_timeout: float = 3.05, read_timeout: float = 15.0,
+                 retries: int = 2, backoff_factor: float = 0.3, pool_size: int = 10,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = breaker or CircuitBreaker()
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(['GET']),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, service: str, coordinates: Sequence[Tuple[float, float]], params: Dict,
+                profile: str = 'driving') -> Dict:
+        """Call ``/{service}/v1/{profile}/{coordinates}`` and return the decoded JSON body"""
+        if not self.breaker.allow():
+            raise RoutingUnavailable('Routing service is temporarily unavailable')
+        try:
+            return self._request(service, coordinates, params, profile)
+        except RoutingError:
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+
+    def _request(self, service: str, coordinates: Sequence[Tuple[float, float]], params: Dict,
+                 profile: str) -> Dict:
+        """The call itself; every RoutingError it raises has been recorded on the breaker"""
+        url = f'{self.base_url}/{service}/v1/{profile}/{format_coordinates(coordinates)}'
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            logger.warning('OSRM %s failed after %.1f ms: %s', service, (time.perf_counter() - start) * 1000, e)
+            raise RoutingError(f'Routing service request failed: {e}') from e
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        logger.info('OSRM %s %s in %.1f ms', service, response.status_code, elapsed_ms)
+
+        if response.status_code in RETRY_STATUSES:
+            self.breaker.record_failure()
+            raise RoutingError(f'Routing service returned HTTP {response.status_code}')
+        try:
+            data = response.json()
+        except ValueError as e:
+            self.breaker.record_failure()
+            raise RoutingError('Routing service returned an invalid response') from e
+        # 4xx bodies such as NoRoute are answers, not upstream failures
+        self.breaker.record_success()
+        return data
+
+    def route(self, coordinates: Sequence[Tuple[float, float]], params: Dict, profile: str = 'driving') -> Dict:
+        return self.request('route', coordinates, params, profile)
+
+    def table(self, coordinates: Sequence[Tuple[float, float]], params: Dict, profile: str = 'driving') -> Dict:
+        """OSRM's many-to-many table service; ``params`` pick the sources and destinations"""
+        return self.request('table', coordinates, params, profile)
+
+
+class AsyncOSRMClient:
+    """
+    Non-blocking counterpart of OSRMClient for the ASGI views, built on
+    httpx.AsyncClient. Same timeouts, retry policy and circuit breaker.
+    """
+
+    def __init__(self, base_url: str, connect_timeout: float = 3.05, read_timeout: float = 15.0,
+                 retries: int = 2, backoff_factor: float = 0.3, pool_size: int = 200,
+                 breaker: Optional[CircuitBreaker] = None):
+        import httpx
+
+        self.base_url = base_url.rstrip('/')
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.breaker = breaker or CircuitBreaker()
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+        self._transport_error = httpx.TransportError
+
+    async def request(self, service: str, coordinates: Sequence[Tuple[float, float]], params: Dict,
+                      profile: str = 'driving') -> Dict:
+        if not self.breaker.allow():
+            raise RoutingUnavailable('Routing service is temporarily unavailable')
+        try:
+            return await self._request(service, coordinates, params, profile)
+        except RoutingError:
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancelled by a client disconnect or a timeout: no verdict, but free the half-open trial
+            self.breaker.release()
+            raise
+
+    async def _request(self, service: str, coordinates: Sequence[Tuple[float, float]], params: Dict,
+                       profile: str) -> Dict:
+        """The call and its retries; every RoutingError it raises has been recorded on the breaker"""
+        url = f'{self.base_url}/{service}/v1/{profile}/{format_coordinates(coordinates)}'
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.get(url, params=params)
+                failure = f'HTTP {response.status_code}' if response.status_code in RETRY_STATUSES else None
+            except self._transport_error as e:
+                response, failure = None, str(e) or type(e).__name__
+            if failure is None or attempt >= self.retries:
+                break
+            retry_after = response.headers.get('Retry-After') if response is not None else None
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else self.backoff_factor * (2 ** attempt)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if failure is not None:
+            self.breaker.record_failure()
+            logger.warning('OSRM %s failed after %.1f ms: %s', service, elapsed_ms, failure)
+            raise RoutingError(f'Routing service request failed: {failure}')
+        logger.info('OSRM %s %s in %.1f ms', service, response.status_code, elapsed_ms)
+        try:
+            data = response.json()
+        except ValueError as e:
+            self.breaker.record_failure()
+            raise RoutingError('Routing service returned an invalid response') from e
+        self.breaker.record_success()
+        return data
+
+    async def route(self, coordinates: Sequence[Tuple[float, float]], params: Dict, profile: str = 'driving') -> Dict:
+        return await self.request('route', coordinates, params, profile)
+
+    async def table(self, coordinates: Sequence[Tuple[float, float]], params: Dict, profile: str = 'driving') -> Dict:
+        return await self.request('table', coordinates, params, profile)
+
+
+def _osrm_config() -> Dict:
+    return dict(DEFAULT_OSRM, **getattr(settings, 'OSRM', {}))
+
+
+def _routing_config() -> Dict:
+    config = dict(DEFAULT_ROUTING, **getattr(settings, 'ROUTING', {}))
+    if config['BACKEND'] not in ('osrm', 'local'):
+        raise ImproperlyConfigured(f"ROUTING['BACKEND'] must be 'osrm' or 'local', not {config['BACKEND']!r}")
+    return config
+
+
+_breaker: Optional[CircuitBreaker] = None
+_client = None
+_local_client = None
+_async_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOSRMClient]' = weakref.WeakKeyDictionary()
+_client_lock = threading.Lock()
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """One breaker per worker, shared by the sync and async clients"""
+    global _breaker
+    if _breaker is None:
+        with _client_lock:
+            if _breaker is None:
+                config = _osrm_config()
+                _breaker = CircuitBreaker(config['CIRCUIT_FAILURE_THRESHOLD'], config['CIRCUIT_RESET_TIMEOUT'])
+    return _breaker
+
+
+def get_local_routing_client():
+    """The worker's in-process router over the road graph in ROUTING['GRAPH'], loaded on first use"""
+    global _local_client
+    if _local_client is None:
+        with _client_lock:
+            if _local_client is None:
+                from .road_graph import LocalRoutingClient, RoadGraph
+
+                config = _routing_config()
+                path = config['GRAPH']
+                if not path or not os.path.exists(path):
+                    raise ImproperlyConfigured(
+                        f'Road graph {path!r} not found; build it with `manage.py build_road_graph`')
+                graph = RoadGraph.load(os.fspath(path))
+                logger.info('Loaded road graph %s: %d nodes, %d edges', path, len(graph), graph.edge_count)
+                _local_client = LocalRoutingClient(graph, config['MAX_SNAP_MILES'])
+    return _local_client
+
+
+def get_routing_client():
+    """
+    The worker's shared routing client: the OSRM client built from
+    ``settings.OSRM``, or the local road-graph router when ROUTING['BACKEND']
+    is 'local'. Both answer ``route()`` in OSRM's response format.
+    """
+    global _client
+    if _routing_config()['BACKEND'] == 'local':
+        return get_local_routing_client()
+    if _client is None:
+        breaker = get_circuit_breaker()
+        with _client_lock:
+            if _client is None:
+                config = _osrm_config()
+                _client = OSRMClient(
+                    config['BASE_URL'],
+                    connect_timeout=config['CONNECT_TIMEOUT'],
+                    read_timeout=config['READ_TIMEOUT'],
+                    retries=config['RETRIES'],
+                    backoff_factor=config['BACKOFF_FACTOR'],
+                    pool_size=config['POOL_SIZE'],
+                    breaker=breaker,
+                )
+    return _client
+
+
+def get_async_routing_client():
+    """The async routing client for the running event loop (httpx clients are bound to one loop)"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None and _routing_config()['BACKEND'] == 'local':
+        from .road_graph import AsyncLocalRoutingClient
+
+        client = _async_clients[loop] = AsyncLocalRoutingClient(get_local_routing_client())
+    if client is None:
+        config = _osrm_config()
+        client = AsyncOSRMClient(
+            config['BASE_URL'],
+            connect_timeout=config['CONNECT_TIMEOUT'],
+            read_timeout=config['READ_TIMEOUT'],
+            retries=config['RETRIES'],
+            backoff_factor=config['BACKOFF_FACTOR'],
+            pool_size=config['ASYNC_POOL_SIZE'],
+            breaker=get_circuit_breaker(),
+        )
+        _async_clients[loop] = client
+    return client
@@ -0,0 +1,136 @@
+# route_planner/shaping.py
+from typing import Dict, Optional, Sequence
+
+from .geometry import encode_polyline, simplify_coordinates
+
+GEOMETRY_FORMATS = ('geojson', 'polyline', 'polyline6', 'simplified', 'none')
+
+# Default tolerance (miles) for geometry=simplified; about 16 m
+DEFAULT_SIMPLIFY_TOLERANCE_MILES = 0.01
+
+RESPONSE_FIELDS = ('route', 'fuel_stops', 'total_cost')
+
+_TRUE = ('1', 'true', 'yes', 'on')
+_FALSE = ('0', 'false', 'no', 'off')
+
+
+def parse_flag(value, default: bool) -> bool:
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    text = str(value).lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise ValueError(f'Expected true or false, got {value!r}')
+
+
+class ResponseShape:
+    """
+    What a route response carries. The default is the full mapped OSRM route
+    with GeoJSON geometry and turn-by-turn steps, as the API has always
+    returned; clients that only need the line and the fuel plan can ask for
+    an encoded polyline and no steps, which is a fraction of the size.
+
+    Request parameters:
+      geometry     geojson (default), polyline, polyline6, simplified or none
+      tolerance    miles, for geometry=simplified
+      steps        include turn-by-turn steps (default true)
+      annotations  include OSRM per-segment annotations (default false)
+      fields       comma-separated subset of route, fuel_stops, total_cost
+    """
+
+    def __init__(self, geometry: str = 'geojson', tolerance: float = DEFAULT_SIMPLIFY_TOLERANCE_MILES,
+                 steps: bool = True, annotations: bool = False, fields: Optional[Sequence[str]] = None):
+        if geometry not in GEOMETRY_FORMATS:
+            raise ValueError(f'geometry must be one of {", ".join(GEOMETRY_FORMATS)}')
+        if tolerance <= 0:
+            raise ValueError('tolerance must be positive')
+        unknown = set(fields or ()) - set(RESPONSE_FIELDS)
+        if unknown:
+            raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}')
+        self.geometry = geometry
+        self.tolerance = tolerance
+        self.steps = steps
+        self.annotations = annotations
+        self.fields = tuple(fields) if fields else RESPONSE_FIELDS
+
+    @classmethod
+    def from_params(cls, params) -> 'ResponseShape':
+        """Build from request.data / query_params; raises ValueError on bad values"""
+        fields = params.get('fields')
+        if isinstance(fields, str):
+            fields = [f.strip() for f in fields.split(',') if f.strip()]
+        tolerance = params.get('tolerance')
+        return cls(
+            geometry=params.get('geometry') or 'geojson',
+            tolerance=float(tolerance) if tolerance not in (None, '') else DEFAULT_SIMPLIFY_TOLERANCE_MILES,
+            steps=parse_flag(params.get('steps'), True),
+            annotations=parse_flag(params.get('annotations'), False),
+            fields=fields,
+        )
+
+    @property
+    def is_default(self) -> bool:
+        return (self.geometry == 'geojson' and self.steps and not self.annotations
+                and self.fields == RESPONSE_FIELDS)
+
+    def route_options(self) -> Dict:
+        """Keyword arguments for RoutePlanner.get_route, so OSRM only sends what we return"""
+        return {'steps': self.steps, 'annotations': self.annotations}
+
+    def encode_geometry(self, geometry: Optional[Dict]):
+        if geometry is None or self.geometry == 'geojson':
+            return geometry
+        coordinates = geometry.get('coordinates', [])
+        if self.geometry == 'polyline':
+            return encode_polyline(coordinates, 5)
+        if self.geometry == 'polyline6':
+            return encode_polyline(coordinates, 6)
+        return {'type': geometry.get('type', 'LineString'),
+                'coordinates': simplify_coordinates(coordinates, self.tolerance)}
+
+    def shape_route(self, route: Dict) -> Dict:
+        """
+        A shaped copy of a mapped route. The input is never modified since it
+        may be shared with the route cache.
+        """
+        if 'routes' not in route:
+            return route
+        routes = []
+        for mapped in route['routes']:
+            shaped = {'summary': mapped.get('summary')}
+            if self.geometry != 'none':
+                shaped['geometry'] = self.encode_geometry(mapped.get('geometry'))
+            segments = []
+            for segment in mapped.get('segments', []):
+                shaped_segment = {'distance': segment.get('distance'), 'duration': segment.get('duration')}
+                if self.steps:
+                    shaped_segment['steps'] = [self.shape_step(step) for step in segment.get('steps', [])]
+                if self.annotations and 'annotation' in segment:
+                    shaped_segment['annotation'] = segment['annotation']
+                segments.append(shaped_segment)
+            shaped['segments'] = segments
+            routes.append(shaped)
+        return dict(route, routes=routes)
+
+    def shape_step(self, step: Dict) -> Dict:
+        if self.geometry == 'geojson':
+            return step
+        step = dict(step)
+        if self.geometry == 'none':
+            step.pop('geometry', None)
+        else:
+            step['geometry'] = self.encode_geometry(step.get('geometry'))
+        return step
+
+    def shape_response(self, payload: Dict) -> Dict:
+        """Apply the shape to a {'route', 'fuel_stops', 'total_cost'} response body"""
+        if self.is_default:
+            return payload
+        shaped = {key: payload[key] for key in self.fields if key in payload}
+        if 'route' in shaped:
+            shaped['route'] = self.shape_route(shaped['route'])
+        return shaped
@@ -0,0 +1,123 @@
+# route_planner/snapshot.py
+import json
+import os
+import pickle
+import struct
+from typing import Dict, Optional
+
+import numpy as np
+
+from .spatial import StationIndex
+from .stations import StationTable
+
+# File layout: MAGIC, header length (little-endian uint64), JSON header, then
+# each column's raw bytes at the offset the header gives, 64-byte aligned so
+# the columns can be memory-mapped in place.
+MAGIC = b'FRSNAP1\n'
+_ALIGN = 64
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // _ALIGN) * _ALIGN
+
+
+def write_snapshot(table: StationTable, path: str) -> int:
+    """
+    Write ``table`` and its k-d tree to a snapshot file; returns its size in
+    bytes. The file is written next to ``path`` and renamed into place, so
+    readers only ever see a complete snapshot.
+    """
+    # Names are stored once each (chains repeat them) and referenced by code
+    codes: Dict[str, int] = {}
+    name_codes = np.array([codes.setdefault(name, len(codes)) for name in table.name], dtype=np.int32)
+    encoded = [name.encode('utf-8') for name in codes]
+    name_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(name) for name in encoded], out=name_offsets[1:])
+    columns: Dict[str, np.ndarray] = {
+        'opis_id': np.ascontiguousarray(table.opis_id, dtype=np.int64),
+        'latitude': np.ascontiguousarray(table.latitude, dtype=np.float64),
+        'longitude': np.ascontiguousarray(table.longitude, dtype=np.float64),
+        'price': np.ascontiguousarray(table.price, dtype=np.float64),
+        'name_codes': name_codes,
+        'name_offsets': name_offsets,
+        'name_bytes': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+        # Unpickling the tree takes a fraction of the time of building it
+        'tree': np.frombuffer(pickle.dumps(table.index.tree, protocol=pickle.HIGHEST_PROTOCOL), dtype=np.uint8),
+    }
+
+    header = {'version': 1, 'count': len(table), 'built_from': table.version, 'columns': {}}
+    # The column offsets are in the header, so grow the space left for it until it fits
+    data_start = 0
+    while True:
+        offset = data_start
+        for key, column in columns.items():
+            header['columns'][key] = {'dtype': column.dtype.str, 'shape': list(column.shape), 'offset': offset}
+            offset = _aligned(offset + column.nbytes)
+        header_bytes = json.dumps(header).encode()
+        needed = _aligned(len(MAGIC) + 8 + len(header_bytes))
+        if needed <= data_start:
+            break
+        data_start = needed
+
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(header_bytes)))
+            f.write(header_bytes)
+            for key, column in columns.items():
+                f.seek(header['columns'][key]['offset'])
+                f.write(column.tobytes())
+            f.truncate(offset)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return offset
+
+
+def read_header(path: str) -> Dict:
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a station snapshot')
+        (length,) = struct.unpack('<Q', f.read(8))
+        return json.loads(f.read(length))
+
+
+def load_snapshot(path: str, mtime: Optional[int] = None) -> StationTable:
+    """
+    Open a snapshot with the numeric columns memory-mapped read-only, so
+    every worker shares one copy through the OS page cache. Only the
+    distinct names and the k-d tree are read into the process.
+
+    The tree is unpickled, so only load snapshots this service wrote.
+    """
+    header = read_header(path)
+    raw = np.memmap(path, dtype=np.uint8, mode='r')
+    columns = {}
+    for key, spec in header['columns'].items():
+        dtype = np.dtype(spec['dtype'])
+        size = int(np.prod(spec['shape'])) * dtype.itemsize
+        columns[key] = raw[spec['offset']:spec['offset'] + size].view(dtype).reshape(spec['shape'])
+    data = columns['name_bytes'].tobytes()
+    offsets = columns['name_offsets'].tolist()
+    text = data.decode('utf-8')
+    if len(text) != len(data):
+        # Byte offsets only line up with str offsets for ASCII, so split before decoding
+        text = None
+    names = np.empty(len(offsets) - 1, dtype=object)
+    names[:] = [text[start:end] if text is not None else data[start:end].decode('utf-8')
+                for start, end in zip(offsets, offsets[1:])]
+    name = names[columns['name_codes']]
+    tree = pickle.loads(columns['tree'].tobytes())
+    latitude, longitude = columns['latitude'], columns['longitude']
+    return StationTable(
+        opis_id=columns['opis_id'],
+        name=name,
+        latitude=latitude,
+        longitude=longitude,
+        price=columns['price'],
+        source=path,
+        mtime=mtime,
+        index=StationIndex(latitude, longitude, tree=tree),
+    )
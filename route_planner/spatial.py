@@ -0,0 +1,55 @@
+# route_planner/spatial.py
+from typing import Optional, Tuple
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from .distance import EARTH_RADIUS_MILES, haversine_one_to_many
+
+
+def to_unit_vectors(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """Convert lat/lon degrees to points on the unit sphere, shape (n, 3)"""
+    lat = np.radians(np.asarray(latitude, dtype=np.float64))
+    lon = np.radians(np.asarray(longitude, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def chord_length(radius_miles: float) -> float:
+    """Straight-line distance through the unit sphere for a great-circle distance in miles"""
+    angle = min(radius_miles / EARTH_RADIUS_MILES, np.pi)
+    return 2.0 * np.sin(angle / 2.0)
+
+
+class StationIndex:
+    """
+    k-d tree over station positions as 3D unit vectors.
+    Radius queries use the tree to collect candidates by chord length and then
+    filter them with the exact haversine distance, so results are identical to a
+    full scan.
+    """
+
+    # Slack on the chord so rounding never drops a station sitting on the boundary
+    _CHORD_SLACK = 1e-9
+
+    def __init__(self, latitude: np.ndarray, longitude: np.ndarray, tree: Optional[cKDTree] = None):
+        self.latitude = latitude
+        self.longitude = longitude
+        # A tree built ahead of time (e.g. from a station snapshot) must be over these positions
+        self.tree = tree if tree is not None else cKDTree(to_unit_vectors(latitude, longitude))
+
+    def __len__(self) -> int:
+        return self.tree.n
+
+    def query_radius(self, position: Tuple[float, float], radius_miles: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return (indices, distances in miles) of stations within ``radius_miles``.
+        Indices are in ascending (file) order.
+        """
+        lat, lon = position
+        point = to_unit_vectors([lat], [lon])[0]
+        candidates = self.tree.query_ball_point(point, chord_length(radius_miles) + self._CHORD_SLACK)
+        candidates = np.array(sorted(candidates), dtype=np.intp)
+        distances = haversine_one_to_many(position, self.latitude[candidates], self.longitude[candidates])
+        keep = distances <= radius_miles
+        return candidates[keep], distances[keep]
@@ -0,0 +1,448 @@
+# route_planner/stations.py
+import csv
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Count, Max
+
+from .models import FuelStation
+from .price_feed import PriceFeed
+from .spatial import StationIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATIONS_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'no_nan.csv')
+
+
+class StationTable:
+    """
+    Read-only column store of fuel stations.
+    A table is never mutated after it is built, so a request can hold on to one
+    for its whole lifetime while the store swaps in a newer table.
+    """
+
+    def __init__(self, opis_id: np.ndarray, name: np.ndarray, latitude: np.ndarray,
+                 longitude: np.ndarray, price: np.ndarray, source: Optional[str] = None,
+                 mtime: Optional[int] = None, index: Optional[StationIndex] = None,
+                 price_stamp: Optional[str] = None):
+        self.opis_id = opis_id
+        self.name = name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.price = price
+        self.source = source
+        self.mtime = mtime
+        # Set when prices were patched after loading (see with_prices)
+        self.price_stamp = price_stamp
+        self._id_lookup: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        for column in (opis_id, name, latitude, longitude, price):
+            column.flags.writeable = False
+        # Built with the table so every request sees an index that matches its rows
+        self.index = index if index is not None else StationIndex(latitude, longitude)
+
+    def __len__(self) -> int:
+        return len(self.latitude)
+
+    @property
+    def version(self) -> str:
+        """Identifies the data the table was built from; changes whenever it is reloaded or repriced"""
+        if self.price_stamp is not None:
+            return f'{self.source}:{self.mtime}+prices:{self.price_stamp}'
+        return f'{self.source}:{self.mtime}'
+
+    def id_lookup(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(row order sorting opis_id, the sorted ids), for finding rows by OPIS ID"""
+        if self._id_lookup is None:
+            order = np.argsort(self.opis_id, kind='stable')
+            self._id_lookup = (order, self.opis_id[order])
+        return self._id_lookup
+
+    def with_prices(self, updates: Iterable[Tuple[np.ndarray, np.ndarray]],
+                    stamp: str) -> Tuple['StationTable', int, int]:
+        """
+        Copy of the table with new prices for the given OPIS IDs; returns
+        (table, rows repriced, unknown IDs). Only the price column is copied:
+        names, positions and the spatial index are shared with this table.
+        ``updates`` yields (opis_id, price) array chunks; later prices win.
+        Raises ValueError on a non-positive or non-finite price, in which case
+        nothing has been published.
+        """
+        price = self.price.copy()
+        order, sorted_ids = self.id_lookup()
+        repriced = unknown = 0
+        for opis_ids, prices in updates:
+            if not np.all(np.isfinite(prices) & (prices > 0)):
+                raise ValueError('Prices must be positive numbers')
+            # Stations listed more than once in the source file get every row repriced
+            first = np.searchsorted(sorted_ids, opis_ids, side='left')
+            counts = np.searchsorted(sorted_ids, opis_ids, side='right') - first
+            unknown += int(np.count_nonzero(counts == 0))
+            total = int(counts.sum())
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            rows = order[np.repeat(first, counts) + offsets]
+            price[rows] = np.repeat(prices, counts)
+            repriced += total
+        if self.price_stamp is not None:
+            # Keep the version short however many times a table is repriced
+            stamp = hashlib.sha1(f'{self.price_stamp}+{stamp}'.encode()).hexdigest()[:16]
+        table = StationTable(self.opis_id, self.name, self.latitude, self.longitude, price,
+                             source=self.source, mtime=self.mtime, index=self.index, price_stamp=stamp)
+        table._id_lookup = self._id_lookup
+        return table, repriced, unknown
+
+    def station(self, i: int) -> Dict:
+        """Return station ``i`` in the dict shape used by the API responses"""
+        return {
+            'name': self.name[i],
+            'latitude': float(self.latitude[i]),
+            'longitude': float(self.longitude[i]),
+            'price': float(self.price[i]),
+        }
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple], source: Optional[str] = None, mtime: Optional[int] = None,
+                  previous: Optional['StationTable'] = None) -> 'StationTable':
+        """
+        Build from (opis_id, name, latitude, longitude, price) tuples. The
+        spatial index of ``previous`` is reused if the positions haven't changed.
+        """
+        opis_ids, names, lats, lons, prices = [], [], [], [], []
+        for opis_id, station_name, lat, lon, price in rows:
+            opis_ids.append(opis_id)
+            names.append(sys.intern(station_name))
+            lats.append(lat)
+            lons.append(lon)
+            prices.append(price)
+        name = np.empty(len(names), dtype=object)
+        name[:] = names
+        latitude = np.array(lats, dtype=np.float64)
+        longitude = np.array(lons, dtype=np.float64)
+        index = None
+        if (previous is not None and np.array_equal(previous.latitude, latitude)
+                and np.array_equal(previous.longitude, longitude)):
+            index = previous.index
+        return cls(
+            opis_id=np.array(opis_ids, dtype=np.int64),
+            name=name,
+            latitude=latitude,
+            longitude=longitude,
+            price=np.array(prices, dtype=np.float64),
+            source=source,
+            mtime=mtime,
+            index=index,
+        )
+
+    @classmethod
+    def from_csv(cls, path: str, mtime: Optional[int] = None,
+                 previous: Optional['StationTable'] = None) -> 'StationTable':
+        """Parse an OPIS price file straight into typed columns"""
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = [
+                (int(row['OPIS Truckstop ID']), row['Truckstop Name'].strip(), float(row['Latitude']),
+                 float(row['Longitude']), float(row['Retail Price']))
+                for row in csv.DictReader(f)
+            ]
+        return cls.from_rows(rows, source=path, mtime=mtime, previous=previous)
+
+    @classmethod
+    def from_db(cls, using: str = 'default', source: Optional[str] = None,
+                mtime: Optional[int] = None, previous: Optional['StationTable'] = None) -> 'StationTable':
+        """
+        Load the FuelStation table. values_list hands back plain tuples, so no
+        model instance is built per row.
+        """
+        rows = (FuelStation.objects.using(using).order_by('opis_id')
+                .values_list('opis_id', 'name', 'latitude', 'longitude', 'price'))
+        return cls.from_rows(rows.iterator(chunk_size=5000), source=source or f'db:{using}', mtime=mtime,
+                             previous=previous)
+
+
+class BaseStationStore:
+    """
+    Process-wide holder of the current StationTable. New tables are built off
+    to the side and published with a single reference swap, so a request
+    never sees a half-updated table.
+
+    With a price feed configured, its prices are patched onto the table
+    (copy-on-write, see StationTable.with_prices) whenever the feed file is
+    newer than the station data.
+    """
+
+    def __init__(self, feed: Optional[PriceFeed] = None):
+        self.feed = feed
+        self._table: Optional[StationTable] = None
+        self._feed_mtime: Optional[int] = None
+        # (source, mtime, feed mtime) of the last feed application
+        self._feed_applied: Optional[Tuple] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> StationTable:
+        raise NotImplementedError
+
+    def source_version(self) -> str:
+        """The version a table freshly loaded from the source would have, before any price patches"""
+        raise NotImplementedError
+
+    def apply_prices(self, updates: Iterable[Tuple[np.ndarray, np.ndarray]], stamp: str) -> Tuple[int, int]:
+        """
+        Patch prices into the table being served; returns (rows repriced,
+        unknown IDs). They last until the station data itself is reloaded.
+        """
+        updates = list(updates)
+        while True:
+            table = self.get()
+            patched, repriced, unknown = table.with_prices(updates, stamp)
+            # A reload in the meantime has newer data, so patch that instead
+            if self._publish(table, patched):
+                return repriced, unknown
+
+    def _publish(self, table: StationTable, patched: StationTable) -> bool:
+        """Swap ``patched`` in for ``table``; False if ``table`` is no longer the live one"""
+        with self._lock:
+            if self._table is not table:
+                return False
+            self._table = patched
+        return True
+
+    def _feed_changed(self) -> bool:
+        return self.feed is not None and self.feed.mtime() != self._feed_mtime
+
+    def _with_feed(self, table: StationTable) -> StationTable:
+        """Call with the lock held"""
+        if self.feed is None:
+            return table
+        mtime = self.feed.mtime()
+        self._feed_mtime = mtime
+        applied = (table.source, table.mtime, mtime)
+        if mtime is None or mtime <= (table.mtime or 0) or applied == self._feed_applied:
+            return table
+        try:
+            table, repriced, unknown = table.with_prices(self.feed.updates(), f'feed@{mtime}')
+        except (OSError, ValueError):
+            # A bad or half-written feed leaves the current prices in place
+            logger.exception('Price feed %s not applied', self.feed.path)
+            return table
+        finally:
+            self._feed_applied = applied
+        logger.info('Price feed %s: %d rows repriced, %d unknown OPIS IDs', self.feed.path, repriced, unknown)
+        return table
+
+
+class StationStore(BaseStationStore):
+    """
+    Stations from an OPIS price file, loaded once and reloaded when its mtime
+    changes.
+    """
+
+    def __init__(self, path: str, feed: Optional[PriceFeed] = None):
+        super().__init__(feed)
+        self.path = path
+
+    def get(self) -> StationTable:
+        table = self._table
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            # Keep serving the last good table if the file is briefly missing (e.g. mid-replace)
+            if table is not None:
+                return table
+            raise
+        if table is not None and table.mtime == mtime and not self._feed_changed():
+            return table
+        with self._lock:
+            table = self._table
+            if table is None or table.mtime != mtime:
+                table = self._load(mtime, table)
+            table = self._with_feed(table)
+            self._table = table
+        return table
+
+    def source_version(self) -> str:
+        return f'{self.path}:{os.stat(self.path).st_mtime_ns}'
+
+    def _load(self, mtime: int, previous: Optional[StationTable]) -> StationTable:
+        return StationTable.from_csv(self.path, mtime=mtime, previous=previous)
+
+
+class SnapshotStationStore(StationStore):
+    """
+    Stations from a snapshot written by ``manage.py build_station_snapshot``:
+    memory-mapped columns and a prebuilt k-d tree, so a worker is ready in
+    milliseconds. Reloaded when the snapshot file is replaced.
+
+    The snapshot is only served while it matches ``source``: the version it
+    was built from is compared with the source's current one (a file stat,
+    or a database stamp at most every ``recheck_seconds``), and stations are
+    read from ``source`` instead once a new CSV or import has moved it on.
+    """
+
+    def __init__(self, path: str, source: BaseStationStore, feed: Optional[PriceFeed] = None,
+                 recheck_seconds: float = 0.0):
+        super().__init__(path, feed)
+        self.source = source
+        self.recheck_seconds = recheck_seconds
+        # (snapshot mtime, source version) -> whether the snapshot is current
+        self._verdict: Optional[Tuple[Tuple, bool]] = None
+        self._checked_at = 0.0
+
+    def get(self) -> StationTable:
+        if not self.current():
+            return self.source.get()
+        return super().get()
+
+    def apply_prices(self, updates: Iterable[Tuple[np.ndarray, np.ndarray]], stamp: str) -> Tuple[int, int]:
+        if not self.current():
+            # Stations are being served from the source, so its table is the one to patch
+            return self.source.apply_prices(updates, stamp)
+        return super().apply_prices(updates, stamp)
+
+    def _publish(self, table: StationTable, patched: StationTable) -> bool:
+        # The snapshot can go stale between get() and here, in which case ``table`` came from the source
+        if table is not self._table:
+            return self.source._publish(table, patched)
+        return super()._publish(table, patched)
+
+    def current(self) -> bool:
+        """True while the snapshot was built from the source's current data"""
+        verdict = self._verdict
+        if verdict is not None and time.monotonic() - self._checked_at < self.recheck_seconds:
+            return verdict[1]
+        from .snapshot import read_header
+        try:
+            key = (os.stat(self.path).st_mtime_ns, self.source.source_version())
+        except Exception as e:
+            # Without the source to compare against, the snapshot is the best data there is
+            logger.warning('Station source not checked against snapshot %s: %s', self.path, e)
+            return True
+        if verdict is None or verdict[0] != key:
+            try:
+                built_from = read_header(self.path)['built_from'].split('+prices:')[0]
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning('Station snapshot %s unreadable, using the source: %s', self.path, e)
+                built_from = None
+            fresh = built_from == key[1]
+            if not fresh and built_from is not None:
+                logger.warning('Station snapshot %s was built from %s but the source is now %s; '
+                               'using the source until the snapshot is rebuilt', self.path, built_from, key[1])
+            verdict = self._verdict = (key, fresh)
+        self._checked_at = time.monotonic()
+        return verdict[1]
+
+    def _load(self, mtime: int, previous: Optional[StationTable]) -> StationTable:
+        from .snapshot import load_snapshot
+        return load_snapshot(self.path, mtime=mtime)
+
+
+class DatabaseStationStore(BaseStationStore):
+    """
+    Stations from the FuelStation model. At most every ``recheck_seconds`` it
+    asks the database for the station count and the newest ``updated_at``,
+    and reloads when either has moved.
+    """
+
+    def __init__(self, using: str = 'default', recheck_seconds: float = 30.0, feed: Optional[PriceFeed] = None):
+        super().__init__(feed)
+        self.using = using
+        self.recheck_seconds = recheck_seconds
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+
+    def stamp(self) -> Tuple[int, int]:
+        """(station count, newest updated_at in ns); changes whenever an import writes"""
+        stats = FuelStation.objects.using(self.using).aggregate(count=Count('id'), updated=Max('updated_at'))
+        updated = stats['updated']
+        return stats['count'], int(updated.timestamp() * 1e9) if updated is not None else 0
+
+    def source_version(self) -> str:
+        count, updated = self.stamp()
+        return f'db:{self.using}:{count}:{updated}'
+
+    def get(self) -> StationTable:
+        table = self._table
+        if table is not None and time.monotonic() - self._checked_at < self.recheck_seconds:
+            return table
+        with self._lock:
+            table = self._table
+            if table is not None and time.monotonic() - self._checked_at < self.recheck_seconds:
+                return table
+            try:
+                stamp = self.stamp()
+            except Exception:
+                # Keep serving the last good table through a database hiccup
+                if table is not None:
+                    return table
+                raise
+            if table is None or stamp != self._stamp:
+                count, updated = stamp
+                if count == 0:
+                    raise ImproperlyConfigured(
+                        f'No fuel stations in database {self.using!r}; run manage.py import_stations')
+                # The count goes into the version too, so deletes also invalidate cached plans
+                table = StationTable.from_db(self.using, source=f'db:{self.using}:{count}', mtime=updated,
+                                             previous=table)
+                self._stamp = stamp
+            table = self._with_feed(table)
+            self._table = table
+            self._checked_at = time.monotonic()
+        return table
+
+
+_stores: Dict[str, BaseStationStore] = {}
+_stores_lock = threading.Lock()
+
+
+def _configured_feed() -> Optional[PriceFeed]:
+    path = getattr(settings, 'FUEL_PRICE_FEED', None)
+    return PriceFeed(os.fspath(path)) if path else None
+
+
+def _store(key: str, factory) -> BaseStationStore:
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = _stores[key] = factory()
+    return store
+
+
+def get_source_store(path: Optional[str] = None) -> BaseStationStore:
+    """
+    The store for a price file, or by default the one configured by
+    FUEL_STATIONS_SOURCE: 'csv' reads FUEL_STATIONS_CSV, 'db' the FuelStation table.
+    Configured stores also follow FUEL_PRICE_FEED.
+    """
+    if path is None and getattr(settings, 'FUEL_STATIONS_SOURCE', 'csv') == 'db':
+        using = getattr(settings, 'FUEL_STATIONS_DATABASE', 'default')
+        return _store(f'db:{using}', lambda: DatabaseStationStore(
+            using, getattr(settings, 'FUEL_STATIONS_DB_RECHECK_SECONDS', 30), _configured_feed()))
+    configured = os.fspath(getattr(settings, 'FUEL_STATIONS_CSV', DEFAULT_STATIONS_CSV))
+    path = os.fspath(path or configured)
+    return _store(path, lambda: StationStore(path, _configured_feed() if path == configured else None))
+
+
+def get_station_store(path: Optional[str] = None) -> BaseStationStore:
+    """
+    Like get_source_store, but prefers FUEL_STATIONS_SNAPSHOT while that file
+    exists and was built from the source's current data.
+    """
+    snapshot = getattr(settings, 'FUEL_STATIONS_SNAPSHOT', None)
+    if path is None and snapshot and os.path.exists(snapshot):
+        snapshot = os.fspath(snapshot)
+        source = get_source_store()
+        return _store(f'snapshot:{snapshot}', lambda: SnapshotStationStore(
+            snapshot, source, _configured_feed(), getattr(source, 'recheck_seconds', 0.0)))
+    return get_source_store(path)
+
+
+def get_station_table(path: Optional[str] = None) -> StationTable:
+    """Return the current station table for this worker process"""
+    return get_station_store(path).get()
@@ -0,0 +1,1561 @@
+import asyncio
+import gzip
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+from urllib.parse import urlencode
+
+import numpy as np
+import polyline
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.views import APIView
+from scipy.optimize import linprog
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from .corridor import build_corridor, resample_polyline
+from .distance import (EARTH_RADIUS_MILES, METERS_PER_MILE, coordinates_array, cumulative_distances, haversine,
+                       haversine_one_to_many, haversine_pairwise)
+from .fuel_solver import NoFuelStopError, solve_fuel_stops
+from .geometry import encode_polyline
+from .lanes import Lane, cell_keys, corridor_cells, stale_lanes, station_positions, station_prices
+from .models import FuelStation, PrecomputedLane
+from .osrm_stub import StubOSRMServer, build_route_response, build_table_response, recording_key
+from .price_feed import PriceFeed
+from .renderers import ORJSONRenderer
+from .road_graph import RoadGraph
+from .route_cache import RouteCache, SQLiteBackend
+from .scoring import DetourScoring, top_k
+from .routing_client import AsyncOSRMClient, CircuitBreaker, OSRMClient, RoutingError, RoutingUnavailable
+from .snapshot import write_snapshot
+from .spatial import StationIndex
+from .stations import (DEFAULT_STATIONS_CSV, DatabaseStationStore, SnapshotStationStore, StationStore, StationTable,
+                       get_station_table)
+from .utils import RoutePlanner
+from .vehicles import Vehicle
+from .views.route_views import RouteAPIView
+
+LANE = [(-74.006, 40.7128), (-75.1652, 39.9526)]
+
+
+class StubServerTestCase(SimpleTestCase):
+    """Runs one StubOSRMServer for the class; each test starts with no latency or injected failures"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = StubOSRMServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.latency = 0.0
+        while self.server.next_failure():
+            pass
+        self.server.request_count = 0
+
+
+class OSRMClientTests(StubServerTestCase):
+    def osrm_client(self, **kwargs):
+        kwargs.setdefault('backoff_factor', 0)
+        return OSRMClient(self.server.url, **kwargs)
+
+    def test_retries_5xx_and_429(self):
+        for status in (503, 429):
+            with self.subTest(status=status):
+                self.server.request_count = 0
+                self.server.fail_next(2, status)
+                data = self.osrm_client(retries=2).route(LANE, {'overview': 'false'})
+                self.assertEqual(data['code'], 'Ok')
+                self.assertEqual(self.server.request_count, 3)
+
+    def test_gives_up_after_retries(self):
+        client = self.osrm_client(retries=1)
+        self.server.fail_next(2)
+        with self.assertRaises(RoutingError):
+            client.route(LANE, {})
+        self.assertEqual(self.server.request_count, 2)
+        self.assertEqual(client.breaker.failures, 1)
+
+    def test_4xx_answers_are_not_failures(self):
+        client = self.osrm_client()
+        data = client.request('nearest', LANE, {})
+        self.assertEqual(data['code'], 'InvalidService')
+        self.assertEqual(client.breaker.state, 'closed')
+
+    def test_breaker_opens_half_opens_and_closes(self):
+        client = self.osrm_client(retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.2))
+        self.server.fail_next(2)
+        for _ in range(2):
+            with self.assertRaises(RoutingError):
+                client.route(LANE, {})
+        self.assertEqual(client.breaker.state, 'open')
+        with self.assertRaises(RoutingUnavailable):
+            client.route(LANE, {})
+        self.assertEqual(self.server.request_count, 2)
+
+        time.sleep(0.25)
+        self.assertEqual(client.breaker.state, 'half-open')
+        self.assertEqual(client.route(LANE, {})['code'], 'Ok')
+        self.assertEqual(client.breaker.state, 'closed')
+
+    def test_failed_trial_reopens(self):
+        client = self.osrm_client(retries=0, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.2))
+        self.server.fail_next(2)
+        with self.assertRaises(RoutingError):
+            client.route(LANE, {})
+        time.sleep(0.25)
+        with self.assertRaises(RoutingError):
+            client.route(LANE, {})
+        self.assertEqual(client.breaker.state, 'open')
+
+    def test_interrupted_trial_frees_the_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        client = self.osrm_client(breaker=breaker)
+        with mock.patch.object(client.session, 'get', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                client.route(LANE, {})
+        self.assertTrue(breaker.allow())
+
+    def test_unexpected_errors_count_as_failures(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        client = self.osrm_client(breaker=breaker)
+        with mock.patch.object(client.session, 'get', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                client.route(LANE, {})
+        self.assertEqual(breaker.failures, 2)
+        self.assertTrue(breaker.allow())
+
+
+class AsyncOSRMClientTests(StubServerTestCase):
+    def run_client(self, call, **kwargs):
+        """Run ``call(client)`` on a fresh AsyncOSRMClient and return (result or exception, client)"""
+        kwargs.setdefault('backoff_factor', 0)
+
+        async def main():
+            client = AsyncOSRMClient(self.server.url, **kwargs)
+            try:
+                return await call(client), client
+            except BaseException as e:
+                return e, client
+            finally:
+                await client.client.aclose()
+
+        return asyncio.run(main())
+
+    def test_retries_5xx_and_429(self):
+        for status in (503, 429):
+            with self.subTest(status=status):
+                self.server.request_count = 0
+                self.server.fail_next(2, status)
+                data, _ = self.run_client(lambda client: client.route(LANE, {}), retries=2)
+                self.assertEqual(data['code'], 'Ok')
+                self.assertEqual(self.server.request_count, 3)
+
+    def test_breaker_opens_half_opens_and_closes(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+        self.server.fail_next(2)
+        for _ in range(2):
+            error, _ = self.run_client(lambda client: client.route(LANE, {}), retries=0, breaker=breaker)
+            self.assertIsInstance(error, RoutingError)
+        error, _ = self.run_client(lambda client: client.route(LANE, {}), retries=0, breaker=breaker)
+        self.assertIsInstance(error, RoutingUnavailable)
+
+        time.sleep(0.25)
+        data, _ = self.run_client(lambda client: client.route(LANE, {}), breaker=breaker)
+        self.assertEqual(data['code'], 'Ok')
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_cancelled_trial_frees_the_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'half-open')
+        self.server.latency = 1.0
+        error, _ = self.run_client(lambda client: asyncio.wait_for(client.route(LANE, {}), 0.1), breaker=breaker)
+        self.assertIsInstance(error, asyncio.TimeoutError)
+        # The cancelled call is no verdict, so the next call gets to be the trial
+        self.server.latency = 0.0
+        data, _ = self.run_client(lambda client: client.route(LANE, {}), breaker=breaker)
+        self.assertEqual(data['code'], 'Ok')
+        self.assertEqual(breaker.state, 'closed')
+
+
+class StationIndexTests(SimpleTestCase):
+    def assert_matches_full_scan(self, index, position, radius):
+        expected_distances = haversine_one_to_many(position, index.latitude, index.longitude)
+        expected = np.flatnonzero(expected_distances <= radius)
+        indices, distances = index.query_radius(position, radius)
+        np.testing.assert_array_equal(indices, expected)
+        np.testing.assert_array_equal(distances, expected_distances[expected])
+
+    def test_random_points_match_full_scan(self):
+        rng = np.random.default_rng(7)
+        latitude = rng.uniform(-89, 89, 5000)
+        longitude = rng.uniform(-180, 180, 5000)
+        index = StationIndex(latitude, longitude)
+        for lat, lon, radius in zip(rng.uniform(-89, 89, 50), rng.uniform(-180, 180, 50), rng.uniform(0, 800, 50)):
+            with self.subTest(lat=lat, lon=lon, radius=radius):
+                self.assert_matches_full_scan(index, (lat, lon), radius)
+
+    def test_station_table_matches_full_scan(self):
+        table = StationTable.from_csv(DEFAULT_STATIONS_CSV)
+        for i in range(0, len(table), max(len(table) // 25, 1)):
+            for radius in (0, 10, 50, 100):
+                with self.subTest(station=i, radius=radius):
+                    self.assert_matches_full_scan(table.index, (table.latitude[i], table.longitude[i]), radius)
+
+    def test_station_on_the_boundary_is_included(self):
+        latitude, longitude = np.array([40.0, 40.0, 41.0]), np.array([-100.0, -99.0, -100.0])
+        index = StationIndex(latitude, longitude)
+        radius = float(haversine_one_to_many((40.0, -100.0), latitude[1:2], longitude[1:2])[0])
+        indices, _ = index.query_radius((40.0, -100.0), radius)
+        self.assertEqual(indices.tolist(), [0, 1])
+        self.assert_matches_full_scan(index, (40.0, -100.0), radius)
+
+
+class DistanceTests(SimpleTestCase):
+    def setUp(self):
+        self.planner = RoutePlanner(fuel_stations=small_table())
+        rng = np.random.default_rng(11)
+        self.points = list(zip(rng.uniform(-89, 89, 60).tolist(), rng.uniform(-180, 180, 60).tolist()))
+
+    def test_haversine_matches_the_scalar_formula(self):
+        (lat1, lon1), (lat2, lon2) = np.array(self.points[:30]).T, np.array(self.points[30:]).T
+        expected = [self.planner.calculate_distance(a, b) for a, b in zip(self.points[:30], self.points[30:])]
+        np.testing.assert_allclose(haversine(lat1, lon1, lat2, lon2), expected, rtol=1e-12)
+
+    def test_distance_matrix(self):
+        matrix = self.planner.calculate_distances(self.points[:5], self.points[5:12])
+        self.assertEqual(matrix.shape, (5, 7))
+        for i, a in enumerate(self.points[:5]):
+            for j, b in enumerate(self.points[5:12]):
+                self.assertAlmostEqual(matrix[i, j], self.planner.calculate_distance(a, b), places=9)
+        self.assertEqual(self.planner.calculate_distances([self.points[0]], [self.points[0]]).tolist(), [[0.0]])
+
+    def test_cumulative_distances_match_a_loop(self):
+        coordinates = [[lon, lat] for lat, lon in self.points[:20]]
+        expected, total = [0.0], 0.0
+        for (lon1, lat1), (lon2, lat2) in zip(coordinates[:-1], coordinates[1:]):
+            total += self.planner.calculate_distance((lat1, lon1), (lat2, lon2))
+            expected.append(total)
+        np.testing.assert_allclose(cumulative_distances(coordinates), expected, rtol=1e-12)
+        # GeoJSON lists and (n, 2) arrays give the same result
+        np.testing.assert_array_equal(cumulative_distances(np.array(coordinates)), cumulative_distances(coordinates))
+
+    def test_antipodes_and_single_points(self):
+        self.assertAlmostEqual(float(haversine(0.0, 0.0, 0.0, 180.0)), np.pi * EARTH_RADIUS_MILES, places=6)
+        self.assertEqual(cumulative_distances([[-100.0, 40.0]]).tolist(), [0.0])
+
+
+class CorridorTests(SimpleTestCase):
+    # Chicago - Indianapolis - Louisville, with a bend in the middle
+    ROUTE = [[-87.6298, 41.8781], [-86.1581, 39.7684], [-85.7585, 38.2527]]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.table = StationTable.from_csv(DEFAULT_STATIONS_CSV)
+        # Every station's distance from the route, from a 0.1-mile resample of it
+        lats, lons = np.array(cls.ROUTE)[:, 1], np.array(cls.ROUTE)[:, 0]
+        along, sample_lats, sample_lons = resample_polyline(lats, lons, cumulative_distances(cls.ROUTE), 0.1)
+        cls.route_distance, cls.route_along = np.empty(len(cls.table)), np.empty(len(cls.table))
+        for start in range(0, len(cls.table), 500):
+            rows = slice(start, start + 500)
+            distances = haversine_pairwise(cls.table.latitude[rows], cls.table.longitude[rows], sample_lats, sample_lons)
+            nearest = distances.argmin(axis=1)
+            cls.route_distance[rows] = distances[np.arange(len(nearest)), nearest]
+            cls.route_along[rows] = along[nearest]
+
+    def test_matches_a_full_scan(self):
+        for radius in (10, 50, 100):
+            with self.subTest(radius=radius):
+                corridor = build_corridor(self.ROUTE, self.table, radius)
+                # The check's resampling is good to 0.05 miles, the corridor's local projection to about 0.5%
+                margin = 0.1 + 0.006 * radius
+                inside = set(np.flatnonzero(self.route_distance <= radius - margin).tolist())
+                outside = set(np.flatnonzero(self.route_distance > radius + margin).tolist())
+                found = set(corridor.stations.tolist())
+                self.assertTrue(inside <= found, f'{len(inside - found)} stations missed')
+                self.assertFalse(found & outside)
+                self.assertGreater(len(found), 10)
+                np.testing.assert_allclose(corridor.detour, self.route_distance[corridor.stations], atol=margin)
+                self.assertTrue(np.all(np.diff(corridor.along) >= 0))
+                # Position along the route; the nearest sample is only well defined away from the bend
+                straight = corridor.detour < 5
+                np.testing.assert_allclose(corridor.along[straight],
+                                           self.route_along[corridor.stations[straight]], atol=0.5)
+                self.assertAlmostEqual(corridor.total_distance, cumulative_distances(self.ROUTE)[-1])
+
+    def test_vertex_count_does_not_change_the_corridor(self):
+        lats, lons = np.array(self.ROUTE)[:, 1], np.array(self.ROUTE)[:, 0]
+        _, dense_lats, dense_lons = resample_polyline(lats, lons, cumulative_distances(self.ROUTE), 0.3)
+        dense = np.column_stack((dense_lons, dense_lats))
+        sparse = build_corridor(self.ROUTE, self.table, 25)
+        np.testing.assert_array_equal(build_corridor(dense, self.table, 25).stations, sparse.stations)
+
+    def test_route_with_no_stations_nearby(self):
+        corridor = build_corridor([[-140.0, 30.0], [-139.0, 30.5]], self.table, 50)
+        self.assertEqual(len(corridor), 0)
+        self.assertGreater(corridor.total_distance, 50)
+
+
+EXACT = {'price_tolerance': 0, 'exit_miles': 0, 'min_purchase': 0}
+
+
+def lp_optimum(positions, prices, total_distance, max_range, mpg, start_fuel=None):
+    """Cheapest plan's cost as a linear program over gallons bought per station; None if infeasible"""
+    capacity = max_range / mpg
+    start = capacity if start_fuel is None else min(start_fuel, capacity)
+    keep = positions <= total_distance
+    positions, prices = positions[keep], prices[keep]
+    n = len(positions)
+    if start * mpg >= total_distance:
+        return 0.0
+    if n == 0:
+        return None
+    bought_before = np.tril(np.ones((n, n)), -1)
+    # Fuel arriving at each station is >= 0, after buying <= capacity, and enough is left at the end
+    a_ub = np.vstack([-bought_before, bought_before + np.eye(n), -np.ones((1, n))])
+    b_ub = np.concatenate([start - positions / mpg, capacity - start + positions / mpg,
+                           [start - total_distance / mpg]])
+    result = linprog(prices, A_ub=a_ub, b_ub=b_ub, bounds=(0, None), method='highs')
+    return result.fun if result.status == 0 else None
+
+
+class FuelSolverTests(SimpleTestCase):
+    def random_instances(self, count, seed=0):
+        rng = np.random.default_rng(seed)
+        for _ in range(count):
+            total_distance = rng.uniform(300, 2500)
+            n = int(rng.integers(3, 60))
+            positions = np.sort(rng.uniform(0, total_distance * 1.05, n))
+            prices = rng.uniform(3, 5, n).round(3)
+            yield positions, prices, total_distance, rng.uniform(200, 600), rng.uniform(6, 12)
+
+    def assert_feasible(self, plan, positions, total_distance, max_range, mpg, start_fuel=None, detours=None):
+        """Walk the route, detours included: the tank never runs dry, never overflows and the trip is finished"""
+        capacity = max_range / mpg
+        fuel = capacity if start_fuel is None else min(start_fuel, capacity)
+        detours = np.zeros(len(positions)) if detours is None else detours
+        position = back = 0.0
+        self.assertEqual([i for i, _ in plan], sorted({i for i, _ in plan}))
+        for i, gallons in plan:
+            fuel -= (positions[i] - position + back + detours[i]) / mpg
+            self.assertGreaterEqual(fuel, -1e-9)
+            self.assertGreater(gallons, 0)
+            fuel += gallons
+            self.assertLessEqual(fuel, capacity + 1e-9)
+            position, back = positions[i], detours[i]
+        self.assertGreaterEqual(fuel - (total_distance - position + back) / mpg, -1e-9)
+
+    def test_exact_mode_matches_lp_optimum(self):
+        for case, (positions, prices, total_distance, max_range, mpg) in enumerate(self.random_instances(300)):
+            with self.subTest(case=case):
+                optimum = lp_optimum(positions, prices, total_distance, max_range, mpg)
+                if optimum is None:
+                    with self.assertRaises(NoFuelStopError):
+                        solve_fuel_stops(positions, prices, total_distance, max_range, mpg, **EXACT)
+                    continue
+                plan = solve_fuel_stops(positions, prices, total_distance, max_range, mpg, **EXACT)
+                self.assert_feasible(plan, positions, total_distance, max_range, mpg)
+                self.assertAlmostEqual(sum(prices[i] * gallons for i, gallons in plan), optimum, places=6)
+
+    def test_default_tolerances_stay_near_optimum(self):
+        for case, (positions, prices, total_distance, max_range, mpg) in enumerate(self.random_instances(300, 1)):
+            optimum = lp_optimum(positions, prices, total_distance, max_range, mpg)
+            if not optimum:
+                continue
+            with self.subTest(case=case):
+                plan = solve_fuel_stops(positions, prices, total_distance, max_range, mpg)
+                self.assert_feasible(plan, positions, total_distance, max_range, mpg)
+                self.assertLessEqual(sum(prices[i] * gallons for i, gallons in plan), optimum * 1.05)
+
+    def test_start_fuel(self):
+        rng = np.random.default_rng(2)
+        for case, (positions, prices, total_distance, max_range, mpg) in enumerate(self.random_instances(100, 3)):
+            start_fuel = rng.uniform(0, 1.2) * max_range / mpg
+            with self.subTest(case=case, start_fuel=start_fuel):
+                optimum = lp_optimum(positions, prices, total_distance, max_range, mpg, start_fuel)
+                if optimum is None:
+                    with self.assertRaises(NoFuelStopError):
+                        solve_fuel_stops(positions, prices, total_distance, max_range, mpg, start_fuel, **EXACT)
+                    continue
+                plan = solve_fuel_stops(positions, prices, total_distance, max_range, mpg, start_fuel, **EXACT)
+                self.assert_feasible(plan, positions, total_distance, max_range, mpg, start_fuel)
+                self.assertAlmostEqual(sum(prices[i] * gallons for i, gallons in plan), optimum, places=6)
+
+    def test_fills_up_before_a_long_expensive_stretch(self):
+        positions, prices = np.array([100.0, 400.0, 700.0]), np.array([3.0, 5.0, 5.0])
+        plan = solve_fuel_stops(positions, prices, 900, 500, 10, **EXACT)
+        # Arriving with 40 of 50 gallons: fill up on cheap fuel, then buy only the 30 still needed
+        self.assertEqual(plan[0], (0, 10.0))
+        self.assertAlmostEqual(sum(gallons for _, gallons in plan[1:]), 30.0)
+        self.assert_feasible(plan, positions, 900, 500, 10)
+
+    def test_short_trip_needs_no_stops(self):
+        self.assertEqual(solve_fuel_stops(np.array([10.0]), np.array([3.0]), 450, 500, 10), [])
+        self.assertEqual(solve_fuel_stops(np.array([]), np.array([]), 450, 500, 10), [])
+
+    def test_budgets_detours(self):
+        positions, prices, detours = np.array([50.0, 90.0]), np.array([3.0, 2.0]), np.array([0.0, 30.0])
+        # On the route alone the cheap station is in range of the start tank...
+        self.assertEqual(solve_fuel_stops(positions, prices, 150, 100, 10, **EXACT), [(1, 5.0)])
+        # ...but not 30 miles off it, so stop on the route first and buy the fuel for both detour legs there
+        plan = solve_fuel_stops(positions, prices, 150, 100, 10, detours=detours, **EXACT)
+        self.assertEqual([i for i, _ in plan], [0, 1])
+        np.testing.assert_allclose([gallons for _, gallons in plan], [2.0, 9.0])
+        self.assert_feasible(plan, positions, 150, 100, 10, detours=detours)
+
+    def test_plans_with_detours_are_feasible(self):
+        rng = np.random.default_rng(4)
+        solved = 0
+        for case, (positions, prices, total_distance, max_range, mpg) in enumerate(self.random_instances(300, 5)):
+            detours = rng.uniform(0, 30, len(positions))
+            with self.subTest(case=case):
+                try:
+                    plan = solve_fuel_stops(positions, prices, total_distance, max_range, mpg, detours=detours)
+                except NoFuelStopError:
+                    continue
+                self.assert_feasible(plan, positions, total_distance, max_range, mpg, detours=detours)
+                solved += 1
+        self.assertGreater(solved, 50)
+
+    def test_gaps_raise(self):
+        cases = {
+            'gap between stations': (np.array([300.0, 900.0]), np.array([3.0, 3.0]), 1000),
+            'nothing within the first tank': (np.array([600.0]), np.array([3.0]), 800),
+            'no stations': (np.array([]), np.array([]), 800),
+            'not enough fuel to start': (np.array([300.0]), np.array([3.0]), 400),
+        }
+        for name, (positions, prices, total_distance) in cases.items():
+            start_fuel = 10 if name == 'not enough fuel to start' else None
+            with self.subTest(name):
+                with self.assertRaises(NoFuelStopError):
+                    solve_fuel_stops(positions, prices, total_distance, 500, 10, start_fuel)
+
+
+CHICAGO, INDIANAPOLIS, DALLAS = (-87.6298, 41.8781), (-86.1581, 39.7684), (-96.797, 32.7767)
+
+
+def stub_route(planner, coordinates, spacing=1.0):
+    """A mapped route as get_route returns it, built by the OSRM stub instead of fetched"""
+    return planner.map_osrm_response(build_route_response(list(coordinates), spacing))
+
+
+class FuelStopTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.table = StationTable.from_csv(DEFAULT_STATIONS_CSV)
+
+    def test_stop_fields(self):
+        planner = RoutePlanner(fuel_stations=self.table)
+        route = stub_route(planner, [CHICAGO, DALLAS])
+        coordinates = route['routes'][0]['geometry']['coordinates']
+        total = cumulative_distances(coordinates)[-1]
+        stops = planner.find_optimal_fuel_stops(route)
+        self.assertGreaterEqual(len(stops), 1)
+        for stop in stops:
+            # distance keeps its meaning: miles from the route to the station; detour_miles is the same number
+            self.assertEqual(stop['distance'], stop['detour_miles'])
+            nearest = haversine(stop['latitude'], stop['longitude'],
+                                np.array(coordinates)[:, 1], np.array(coordinates)[:, 0]).min()
+            self.assertAlmostEqual(stop['detour_miles'], nearest, delta=0.1 + 0.006 * nearest)
+            self.assertTrue(0 <= stop['distance_from_start'] <= total)
+            self.assertEqual(stop['cost'], round(stop['price'] * stop['gallons'], 2))
+        along = [stop['distance_from_start'] for stop in stops]
+        self.assertEqual(along, sorted(along))
+
+    def test_simplified_search_finds_the_same_stops(self):
+        planner = RoutePlanner(fuel_stations=self.table)
+        route = stub_route(planner, [CHICAGO, INDIANAPOLIS, DALLAS], spacing=0.1)
+        # GPS-like wiggle of a few metres, which is what the simplification stage removes
+        geometry = route['routes'][0]['geometry']
+        noise = np.random.default_rng(1).uniform(-3e-5, 3e-5, (len(geometry['coordinates']), 2))
+        geometry['coordinates'] = (np.array(geometry['coordinates']) + noise).tolist()
+        expected = planner.find_optimal_fuel_stops(route)
+        with override_settings(ROUTE_SIMPLIFY_TOLERANCE_METERS=25):
+            simplified = RoutePlanner(fuel_stations=self.table)
+        self.assertGreater(simplified.search_tolerance, 0)
+        stops = simplified.find_optimal_fuel_stops(route)
+        self.assertEqual([(stop['name'], stop['latitude'], stop['longitude']) for stop in stops],
+                         [(stop['name'], stop['latitude'], stop['longitude']) for stop in expected])
+        for stop, reference in zip(stops, expected):
+            self.assertAlmostEqual(stop['distance_from_start'], reference['distance_from_start'], delta=0.1)
+            self.assertAlmostEqual(stop['detour_miles'], reference['detour_miles'], delta=0.05)
+            self.assertAlmostEqual(stop['gallons'], reference['gallons'], delta=0.05)
+        self.assertAlmostEqual(simplified.calculate_total_cost(route, stops),
+                               planner.calculate_total_cost(route, expected), delta=1.0)
+
+
+class WaypointTests(SimpleTestCase):
+    LOUISVILLE, NASHVILLE = (-85.7585, 38.2527), (-86.7816, 36.1627)
+
+    def test_legs(self):
+        # Cheapest at the two waypoints, dearer halfway along each leg
+        rows = [(1, 'Indianapolis', INDIANAPOLIS[1], INDIANAPOLIS[0], 3.0),
+                (2, 'Louisville', self.LOUISVILLE[1], self.LOUISVILLE[0], 2.9),
+                (3, 'Seymour', 38.959, -85.89, 3.6),
+                (4, 'Bowling Green', 36.99, -86.44, 3.8)]
+        table = StationTable.from_rows(rows, source='test', mtime=1)
+        planner = RoutePlanner(max_range=200, mpg=10, fuel_stations=table)
+        route = stub_route(planner, [CHICAGO, INDIANAPOLIS, self.LOUISVILLE, self.NASHVILLE])
+        coordinates = np.array(route['routes'][0]['geometry']['coordinates'])
+        cumulative = cumulative_distances(coordinates)
+        # The waypoints are route vertices, so their distances from the start are known exactly
+        waypoint_miles = [cumulative[np.argmin(haversine(lat, lon, coordinates[:, 1], coordinates[:, 0]))]
+                          for lon, lat in (INDIANAPOLIS, self.LOUISVILLE)]
+        self.assertEqual(planner._leg_ends(route, coordinates, cumulative), [*waypoint_miles, cumulative[-1]])
+
+        stops = planner.find_optimal_fuel_stops(route)
+        self.assertEqual([stop['name'] for stop in stops], ['Indianapolis', 'Louisville'])
+        # Stations right at a waypoint are on the leg that starts there
+        np.testing.assert_allclose([stop['distance_from_start'] for stop in stops], waypoint_miles, atol=0.05)
+        self.assertEqual([stop['leg'] for stop in stops], [1, 2])
+        # The full start tank carries into the second leg, so Indianapolis only tops up enough to reach Louisville
+        indianapolis, louisville = (stop['distance_from_start'] for stop in stops)
+        off_indianapolis, off_louisville = (stop['detour_miles'] for stop in stops)
+        arrival = 20 - (indianapolis + off_indianapolis) / 10
+        self.assertAlmostEqual(stops[0]['gallons'],
+                               (louisville - indianapolis + off_indianapolis + off_louisville) / 10 - arrival,
+                               places=6)
+        self.assertAlmostEqual(stops[1]['gallons'], (cumulative[-1] - louisville + off_louisville) / 10, places=6)
+        self.assertAlmostEqual(20 + sum(stop['gallons'] for stop in stops),
+                               (cumulative[-1] + 2 * off_indianapolis + 2 * off_louisville) / 10, places=6)
+
+    def test_stops_at_a_waypoint_start_the_next_leg(self):
+        ends = [100.0, 250.0, 400.0]
+        for along, leg in ((0, 0), (99.8, 0), (99.95, 1), (100, 1), (249.99, 2), (250, 2), (400, 2)):
+            with self.subTest(along=along):
+                self.assertEqual(RoutePlanner._leg(ends, along), leg)
+
+class DetourScoringTests(SimpleTestCase):
+    def test_effective_cost_ranking(self):
+        # 10 mpg, 25 reference gallons, $20 an hour at 40 mph: each detour mile costs 0.2 * price + $1
+        scoring = DetourScoring(10, 25, time_value_per_hour=20, detour_speed_mph=40)
+        prices, detours = np.array([3.0, 2.8, 3.1]), np.array([1.0, 20.0, 0.0])
+        np.testing.assert_allclose(scoring.detour_costs(prices, detours), [1.6, 31.2, 0.0])
+        costs = scoring.effective_costs(prices, detours, 25)
+        np.testing.assert_allclose(costs, [76.6, 101.2, 77.5])
+        np.testing.assert_allclose(scoring.effective_prices(prices, detours), [3.064, 4.048, 3.1])
+        # The cheapest pump is the dearest stop once its 40-mile round trip is paid for
+        self.assertEqual(top_k(costs, 3), [0, 2, 1])
+
+    def test_top_k_matches_sorting(self):
+        rng = np.random.default_rng(6)
+        for case in range(50):
+            # Rounded so there are ties, which go to the earlier station
+            costs = rng.uniform(50, 60, int(rng.integers(1, 30))).round(0)
+            for k in (0, 1, 3, len(costs) + 1):
+                for exclude in (-1, 0, len(costs) // 2):
+                    with self.subTest(case=case, k=k, exclude=exclude):
+                        expected = sorted((cost, i) for i, cost in enumerate(costs.tolist()) if i != exclude)
+                        self.assertEqual(top_k(costs, k, exclude=exclude), [i for _, i in expected[:k]])
+
+    def test_cheap_station_off_the_route_loses_to_a_dearer_one_on_it(self):
+        planner = RoutePlanner(max_range=100, mpg=10, fuel_stations=StationTable.from_rows([], source='test', mtime=1))
+        route = stub_route(planner, [CHICAGO, INDIANAPOLIS])
+        coordinates = route['routes'][0]['geometry']['coordinates']
+        lon, lat = coordinates[len(coordinates) // 2]
+        # About 5 miles east of the halfway point, 10 cents cheaper
+        rows = [(1, 'On route', lat, lon, 3.05), (2, 'Off route', lat, lon + 0.1, 2.95)]
+        table = StationTable.from_rows(rows, source='test', mtime=1)
+
+        with override_settings(DETOUR_SCORING={'ENABLED': False}):
+            by_price = RoutePlanner(max_range=100, mpg=10, fuel_stations=table)
+        by_price.corridor_radii = (10,)
+        self.assertEqual([stop['name'] for stop in by_price.find_optimal_fuel_stops(route)], ['Off route'])
+
+        planner = RoutePlanner(max_range=100, mpg=10, fuel_stations=table)
+        planner.corridor_radii = (10,)
+        stops = planner.find_optimal_fuel_stops(route, alternates=1)
+        self.assertEqual([stop['name'] for stop in stops], ['On route'])
+        [stop] = stops
+        off_route = stop['alternates'][0]
+        self.assertEqual(off_route['name'], 'Off route')
+        self.assertGreater(off_route['detour_miles'], 4)
+        self.assertLess(stop['effective_cost'], off_route['effective_cost'])
+
+    def test_total_cost_counts_detour_fuel_and_time(self):
+        summary_miles = 300
+        stops = [{'price': 3.0, 'gallons': 32.0, 'detour_miles': 5.0},
+                 {'price': 4.0, 'gallons': 9.0, 'detour_miles': 0.0}]
+        route = {'routes': [{'summary': {'distance': summary_miles * METERS_PER_MILE, 'duration': 18000}}]}
+        with override_settings(DETOUR_SCORING={'TIME_VALUE_PER_HOUR': 35, 'DETOUR_SPEED_MPH': 35}):
+            planner = RoutePlanner(max_range=100, mpg=10)
+        # Every gallon bought is paid for, even past the 30 the route alone needs, plus 10 detour miles of time
+        self.assertAlmostEqual(planner.calculate_total_cost(route, stops), 96.0 + 36.0 + 10.0)
+
+
+class VehicleTests(SimpleTestCase):
+    # Out of order on purpose: profiles are sorted by speed on load
+    CURVE = [[65, 6.0], [45, 8.0], [55, 7.0]]
+
+    def vehicle(self, **options):
+        options = dict({'mpg_curve': self.CURVE}, **options)
+        return Vehicle('truck', 'Truck', 'diesel', options.pop('tank_gallons', 100), options.pop('mpg', 7.5),
+                       **options)
+
+    def test_mpg_at_interpolates_and_clamps(self):
+        vehicle = self.vehicle()
+        for speed, mpg in ((45, 8.0), (50, 7.5), (62, 6.3), (65, 6.0), (20, 8.0), (90, 6.0), (None, 7.5)):
+            with self.subTest(speed=speed):
+                self.assertAlmostEqual(vehicle.mpg_at(speed), mpg)
+        self.assertEqual(self.vehicle(mpg_curve=()).mpg_at(50), 7.5)
+
+    def test_zero_duration_route_uses_the_flat_mpg(self):
+        planner = RoutePlanner(vehicle=self.vehicle(mpg=9),
+                               fuel_stations=StationTable.from_rows([], source='test', mtime=1))
+        route = {'routes': [{'summary': {'distance': 100 * METERS_PER_MILE, 'duration': 0}}]}
+        self.assertEqual(planner.trip_mpg(route), 9.0)
+        self.assertEqual(planner.calculate_total_cost(route, []), 0.0)
+        # 100 miles in two hours is 50 mph on the curve
+        route['routes'][0]['summary']['duration'] = 7200
+        self.assertAlmostEqual(planner.trip_mpg(route), 7.5)
+        route['routes'][0]['summary']['duration'] = 3600
+        self.assertAlmostEqual(planner.trip_mpg(route), 6.0)
+
+    def test_tank_size_changes_the_stops(self):
+        route = stub_route(RoutePlanner(max_range=500, mpg=10), [CHICAGO, DALLAS])
+        coordinates = route['routes'][0]['geometry']['coordinates']
+        # A station on the route every tenth of the way, dearer at the even ones
+        points = [coordinates[len(coordinates) * k // 10] for k in range(1, 10)]
+        rows = [(k, f'Station {k}', lat, lon, 3.2 if k % 2 == 0 else 3.0) for k, (lon, lat) in enumerate(points, 1)]
+        table = StationTable.from_rows(rows, source='test', mtime=1)
+        miles = cumulative_distances(coordinates_array(coordinates))[-1]
+
+        plans = {}
+        for tank_gallons in (30, 60, 150):
+            vehicle = self.vehicle(tank_gallons=tank_gallons, mpg=10, mpg_curve=(), reserve_fraction=0.1)
+            planner = RoutePlanner(vehicle=vehicle, fuel_stations=table)
+            self.assertAlmostEqual(planner.max_range, tank_gallons * 0.9 * 10)
+            stops = planner.find_optimal_fuel_stops(route)
+            for stop in stops:
+                self.assertLessEqual(stop['gallons'], vehicle.usable_gallons + 1e-9)
+            bought = sum(stop['gallons'] for stop in stops)
+            self.assertGreaterEqual(vehicle.starting_gallons + bought, miles / 10 - 1e-6)
+            plans[tank_gallons] = [stop['name'] for stop in stops]
+        # Small tanks stop more often; the biggest covers the trip on what it starts with
+        self.assertGreater(len(plans[30]), len(plans[60]))
+        self.assertGreater(len(plans[60]), 0)
+        self.assertEqual(plans[150], [])
+
+
+class SQLiteBackendTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'routes.sqlite3')
+
+    def rows(self, backend):
+        return backend._connection().execute('SELECT key FROM route_cache ORDER BY key').fetchall()
+
+    def test_expired_rows_are_deleted_on_read(self):
+        backend = SQLiteBackend(self.path)
+        backend.set('old', {'a': 1}, -1)
+        backend.set('new', {'b': 2}, 60)
+        self.assertIsNone(backend.get('old'))
+        self.assertEqual(backend.get('new'), {'b': 2})
+        self.assertEqual(self.rows(backend), [('new',)])
+
+    def test_expired_rows_are_purged_on_write(self):
+        backend = SQLiteBackend(self.path, purge_interval=0)
+        backend.set('old', {'a': 1}, -1)
+        backend.set('new', {'b': 2}, 60)
+        self.assertEqual(self.rows(backend), [('new',)])
+
+    def test_hit_and_miss_counts(self):
+        cache = RouteCache(SQLiteBackend(self.path))
+        cache.set('key', {'route': 1})
+        cache.get('key')
+        cache.get('other')
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'errors': 0, 'hit_ratio': 0.5})
+
+
+def small_table(**kwargs):
+    rows = [(11, 'A', 40.0, -100.0, 3.5), (22, 'B', 41.0, -101.0, 3.7), (11, 'A2', 40.1, -100.1, 3.5),
+            (33, 'C', 42.0, -102.0, 3.9)]
+    return StationTable.from_rows(rows, source='test', mtime=1, **kwargs)
+
+
+class StationTableTests(SimpleTestCase):
+    def test_with_prices_copies_on_write(self):
+        table = small_table()
+        before = table.price.copy()
+        repriced, repriced_rows, unknown = table.with_prices(
+            [(np.array([11, 99]), np.array([3.1, 4.0])), (np.array([33]), np.array([3.2]))], 'feed-1')
+        # Both rows of the duplicated station, and the later chunk wins
+        self.assertEqual((repriced_rows, unknown), (3, 1))
+        np.testing.assert_array_equal(repriced.price, [3.1, 3.7, 3.1, 3.2])
+        np.testing.assert_array_equal(table.price, before)
+        self.assertNotEqual(repriced.version, table.version)
+        self.assertIsNone(table.price_stamp)
+        # Everything but the price column is shared
+        self.assertIs(repriced.index, table.index)
+        self.assertIs(repriced.latitude, table.latitude)
+        self.assertFalse(repriced.price.flags.writeable)
+
+    def test_each_repricing_bumps_the_version(self):
+        table = small_table()
+        first, _, _ = table.with_prices([(np.array([22]), np.array([3.0]))], 'feed-1')
+        second, _, _ = first.with_prices([(np.array([22]), np.array([3.0]))], 'feed-2')
+        self.assertEqual(len({table.version, first.version, second.version}), 3)
+        self.assertEqual(first.price[1], 3.0)
+        self.assertEqual(table.price[1], 3.7)
+
+    def test_bad_prices_publish_nothing(self):
+        table = small_table()
+        for price in (0.0, -1.0, np.nan, np.inf):
+            with self.subTest(price=price):
+                with self.assertRaises(ValueError):
+                    table.with_prices([(np.array([22]), np.array([3.0])), (np.array([33]), np.array([price]))], 'x')
+                self.assertEqual(table.price[1], 3.7)
+
+    def test_index_reused_when_positions_are_unchanged(self):
+        table = small_table()
+        self.assertIs(small_table(previous=table).index, table.index)
+
+
+class StationFilesTestCase(SimpleTestCase):
+    """A scratch directory holding a price file with the first 200 stations of the shipped one"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.csv = os.path.join(directory.name, 'stations.csv')
+        with open(DEFAULT_STATIONS_CSV, encoding='utf-8') as f:
+            self.lines = f.readlines()[:201]
+        self.writes = 0
+        self.write_csv(self.lines)
+
+    def write_file(self, path, lines):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        # A second later per write, so coarse filesystem timestamps still differ
+        self.writes += 1
+        mtime = os.stat(path).st_mtime_ns + self.writes * 10 ** 9
+        os.utime(path, ns=(mtime, mtime))
+
+    def write_csv(self, lines):
+        self.write_file(self.csv, lines)
+
+
+class StationStoreTests(StationFilesTestCase):
+    def counting_loads(self):
+        return mock.patch.object(StationTable, 'from_csv', wraps=StationTable.from_csv)
+
+    def test_parses_once_and_shares_the_table(self):
+        store = StationStore(self.csv)
+        with self.counting_loads() as from_csv:
+            tables = [store.get() for _ in range(5)]
+        self.assertEqual(from_csv.call_count, 1)
+        self.assertTrue(all(table is tables[0] for table in tables))
+        self.assertEqual(len(tables[0]), 200)
+
+    def test_concurrent_first_requests_parse_once(self):
+        store = StationStore(self.csv)
+        barrier = threading.Barrier(8)
+        tables = []
+
+        def request():
+            barrier.wait()
+            tables.append(store.get())
+
+        with self.counting_loads() as from_csv:
+            threads = [threading.Thread(target=request) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(from_csv.call_count, 1)
+        self.assertEqual(len({id(table) for table in tables}), 1)
+
+    def test_reloads_when_the_file_changes(self):
+        store = StationStore(self.csv)
+        before = store.get()
+        self.write_csv(self.lines[:51])
+        after = store.get()
+        self.assertIsNot(after, before)
+        self.assertEqual(len(after), 50)
+        self.assertNotEqual(after.version, before.version)
+        # Requests still holding the old table keep a consistent one
+        self.assertEqual(len(before), 200)
+
+    def test_keeps_serving_through_a_missing_file(self):
+        store = StationStore(self.csv)
+        table = store.get()
+        os.remove(self.csv)
+        self.assertIs(store.get(), table)
+        with self.assertRaises(FileNotFoundError):
+            StationStore(self.csv).get()
+
+    def test_planners_share_the_worker_table(self):
+        with override_settings(FUEL_STATIONS_CSV=self.csv, FUEL_STATIONS_SNAPSHOT=None, FUEL_STATIONS_SOURCE='csv'), \
+                mock.patch.dict('route_planner.stations._stores', clear=True):
+            with self.counting_loads() as from_csv:
+                first, second = RoutePlanner(), RoutePlanner()
+            self.assertIs(first.fuel_stations, second.fuel_stations)
+            self.assertIs(first.fuel_stations, get_station_table())
+            self.assertEqual(from_csv.call_count, 1)
+
+
+class SnapshotStationStoreTests(StationFilesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.snapshot = os.path.join(self.directory, 'stations.snapshot')
+        self.source = StationStore(self.csv)
+        write_snapshot(self.source.get(), self.snapshot)
+        self.store = SnapshotStationStore(self.snapshot, self.source)
+
+    def test_serves_a_current_snapshot(self):
+        table = self.store.get()
+        self.assertEqual(table.source, self.snapshot)
+        self.assertEqual(len(table), 200)
+
+    def test_falls_back_to_a_newer_source(self):
+        self.store.get()
+        self.write_csv(self.lines[:101])
+        with self.assertLogs('route_planner.stations', 'WARNING'):
+            table = self.store.get()
+        self.assertEqual(table.source, self.csv)
+        self.assertEqual(len(table), 100)
+
+        write_snapshot(self.source.get(), self.snapshot)
+        table = self.store.get()
+        self.assertEqual(table.source, self.snapshot)
+        self.assertEqual(len(table), 100)
+
+
+class PriceFeedTests(StationFilesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.feed = os.path.join(self.directory, 'feed.csv')
+        self.ids = [int(line.split(',')[1]) for line in self.lines[1:4]]
+
+    def write_feed(self, prices, path=None):
+        self.write_file(path or self.feed, ['OPIS Truckstop ID,Retail Price\n',
+                                            *(f'{opis_id},{price}\n' for opis_id, price in prices.items())])
+
+    def assert_prices(self, table, prices):
+        for opis_id, price in prices.items():
+            np.testing.assert_array_equal(table.price[table.opis_id == opis_id], price)
+
+    def updates(self, prices):
+        return [(np.array(list(prices), dtype=np.int64), np.array(list(prices.values()), dtype=np.float64))]
+
+    def test_csv_store(self):
+        store = StationStore(self.csv, PriceFeed(self.feed))
+        plain = store.get()
+        self.write_feed({self.ids[0]: 9.99, 1: 5.0})
+        table = store.get()
+        self.assert_prices(table, {self.ids[0]: 9.99})
+        self.assertNotEqual(table.version, plain.version)
+        self.assertIs(table.index, plain.index)
+        # New station data supersedes an older feed
+        self.write_csv(self.lines)
+        self.assert_prices(store.get(), {self.ids[0]: plain.price[plain.opis_id == self.ids[0]][0]})
+
+    def test_bad_feed_keeps_the_current_prices(self):
+        store = StationStore(self.csv, PriceFeed(self.feed))
+        plain = store.get()
+        self.write_feed({self.ids[0]: -1})
+        with self.assertLogs('route_planner.stations', 'ERROR'):
+            self.assertIs(store.get(), plain)
+
+    def test_snapshot_store(self):
+        snapshot = os.path.join(self.directory, 'stations.snapshot')
+        source = StationStore(self.csv)
+        write_snapshot(source.get(), snapshot)
+        store = SnapshotStationStore(snapshot, source, PriceFeed(self.feed))
+        self.write_feed({self.ids[0]: 9.99})
+        table = store.get()
+        self.assertEqual(table.source, snapshot)
+        self.assert_prices(table, {self.ids[0]: 9.99})
+
+        self.assertEqual(store.apply_prices(self.updates({self.ids[1]: 8.88}), 'manual'), (1, 0))
+        self.assert_prices(store.get(), {self.ids[0]: 9.99, self.ids[1]: 8.88})
+
+    def test_stale_snapshot_patches_the_source(self):
+        snapshot = os.path.join(self.directory, 'stations.snapshot')
+        source = StationStore(self.csv)
+        write_snapshot(source.get(), snapshot)
+        store = SnapshotStationStore(snapshot, source)
+        self.write_csv(self.lines[:101])
+        with self.assertLogs('route_planner.stations', 'WARNING'):
+            self.assertEqual(store.apply_prices(self.updates({self.ids[0]: 9.99}), 'manual'), (1, 0))
+        table = store.get()
+        self.assertEqual(table.source, self.csv)
+        self.assertIs(table, source.get())
+        self.assert_prices(table, {self.ids[0]: 9.99})
+
+    def test_apply_price_feed_command(self):
+        delta = os.path.join(self.directory, 'delta.csv')
+        self.write_feed({self.ids[0]: 9.99, self.ids[1]: 8.88, 1: 5.0}, delta)
+        feed = os.path.join(self.directory, 'feed.jsonl')
+        with override_settings(FUEL_STATIONS_CSV=self.csv, FUEL_STATIONS_SNAPSHOT=None, FUEL_STATIONS_SOURCE='csv',
+                               FUEL_PRICE_FEED=feed), \
+                mock.patch.dict('route_planner.stations._stores', clear=True):
+            out = io.StringIO()
+            call_command('apply_price_feed', delta, '--check', stdout=out)
+            self.assertEqual(out.getvalue().strip(), '2 station rows repriced, 1 unknown OPIS IDs')
+            self.assertFalse(os.path.exists(feed))
+
+            call_command('apply_price_feed', delta, stdout=out)
+            self.assertEqual(len(open(feed, encoding='utf-8').readlines()), 3)
+            # write_file dates the price file ahead of the clock; the feed has to be newer
+            mtime = os.stat(self.csv).st_mtime_ns + 10 ** 9
+            os.utime(feed, ns=(mtime, mtime))
+            # The worker's own store picks the published feed up; the check above left it unpatched
+            worker = StationStore(self.csv, PriceFeed(feed))
+            self.assert_prices(worker.get(), {self.ids[0]: 9.99, self.ids[1]: 8.88})
+
+            self.write_feed({self.ids[0]: 'free'}, delta)
+            with self.assertRaisesMessage(CommandError, 'line 2'):
+                call_command('apply_price_feed', delta, stdout=out)
+            self.assertEqual(len(open(feed, encoding='utf-8').readlines()), 3)
+
+
+class DatabasePriceFeedTests(TestCase):
+    def test_database_store(self):
+        FuelStation.objects.bulk_create([
+            FuelStation(opis_id=7, name='WOODSHED', price=3.0, latitude=34.86, longitude=-99.36),
+            FuelStation(opis_id=9, name='KWIK TRIP #796', price=3.3, latitude=43.03, longitude=-89.17),
+        ])
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        feed = os.path.join(directory.name, 'feed.jsonl')
+        with open(feed, 'w', encoding='utf-8') as f:
+            f.write('{"opis_id": 9, "price": 3.1}\n')
+        later = time.time_ns() + 10 ** 9
+        os.utime(feed, ns=(later, later))
+
+        store = DatabaseStationStore(recheck_seconds=0, feed=PriceFeed(feed))
+        table = store.get()
+        self.assertEqual(table.price.tolist(), [3.0, 3.1])
+        self.assertEqual(store.apply_prices([(np.array([7]), np.array([2.9]))], 'manual'), (1, 0))
+        self.assertEqual(store.get().price.tolist(), [2.9, 3.1])
+
+def grid_edges(size=12, seed=0, oneway_share=0.15):
+    """Road segments of a jittered grid with random speeds, some of them one-way"""
+    rng = np.random.default_rng(seed)
+    jitter = rng.uniform(-0.01, 0.01, (size, size, 2))
+
+    def point(i, j):
+        return 40 + 0.05 * i + jitter[i, j, 0], -100 + 0.05 * j + jitter[i, j, 1]
+
+    edges = []
+    for i in range(size):
+        for j in range(size):
+            for di, dj in ((1, 0), (0, 1), (1, 1)):
+                if i + di < size and j + dj < size and (di + dj == 1 or rng.random() < 0.3):
+                    edges.append((*point(i, j), *point(i + di, j + dj), f'road {i}-{j}',
+                                  float(rng.uniform(25, 75)), bool(rng.random() < oneway_share)))
+    return edges
+
+
+class RoadGraphTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.graph = RoadGraph.from_edges(grid_edges())
+        graph = cls.graph
+        cls.matrix = csr_matrix((graph.duration, graph.indices, graph.indptr), shape=(len(graph), len(graph)))
+
+    def path_cost(self, path, source, target):
+        graph = self.graph
+        node = source
+        for edge in path:
+            self.assertTrue(graph.indptr[node] <= edge < graph.indptr[node + 1], 'path edges must chain')
+            node = graph.indices[edge]
+        self.assertEqual(node, target)
+        return graph.duration[path].sum(), graph.distance[path].sum()
+
+    def test_a_star_matches_dijkstra(self):
+        rng = np.random.default_rng(1)
+        sources = rng.choice(len(self.graph), 10, replace=False)
+        costs = dijkstra(self.matrix, indices=sources)
+        for row, source in enumerate(sources):
+            for target in rng.choice(len(self.graph), 15, replace=False):
+                with self.subTest(source=source, target=target):
+                    path = self.graph.shortest_path(int(source), int(target))
+                    duration, _ = self.path_cost(path, source, target)
+                    self.assertAlmostEqual(duration, costs[row, target], places=6)
+
+    def test_table_matches_dijkstra(self):
+        graph = self.graph
+        nodes = [0, 7, 40, len(graph) // 2, len(graph) - 1]
+        coordinates = [(graph.longitude[n], graph.latitude[n]) for n in nodes]
+        table = graph.table(coordinates, range(len(nodes)), range(len(nodes)))
+        costs = dijkstra(self.matrix, indices=nodes)[:, nodes]
+        np.testing.assert_allclose(np.array(table['durations'], dtype=float), costs, rtol=1e-9)
+        for i, source in enumerate(nodes):
+            for j, target in enumerate(nodes):
+                _, distance = self.path_cost(graph.shortest_path(source, target), source, target)
+                self.assertAlmostEqual(table['distances'][i][j], distance, places=3)
+
+    def test_table_sources_and_destinations_subsets(self):
+        graph = self.graph
+        coordinates = [(graph.longitude[n], graph.latitude[n]) for n in (3, 30, 60)]
+        full = graph.table(coordinates, [0, 1, 2], [0, 1, 2])
+        part = graph.table(coordinates, [2], [0, 1])
+        self.assertEqual(part['durations'], [full['durations'][2][:2]])
+        self.assertEqual(part['distances'], [full['distances'][2][:2]])
+
+    def test_unreachable_pairs_are_null(self):
+        island = [(45.0, -90.0, 45.01, -90.0, 'island', 30.0, False)]
+        graph = RoadGraph.from_edges(grid_edges(4) + island, largest_component=False)
+        coordinates = [(-100.0, 40.0), (-90.0, 45.0)]
+        table = graph.table(coordinates, [0, 1], [0, 1])
+        self.assertIsNone(table['durations'][0][1])
+        self.assertIsNone(table['distances'][1][0])
+        self.assertEqual(table['durations'][0][0], 0.0)
+        self.assertIsNone(graph.shortest_path(graph.nearest(40.0, -100.0)[0], graph.nearest(45.0, -90.0)[0]))
+
+    def test_snaps_too_far_away_are_null(self):
+        graph = self.graph
+        coordinates = [(graph.longitude[0], graph.latitude[0]), (-80.0, 30.0)]
+        table = graph.table(coordinates, [0, 1], [0, 1], max_snap_miles=5)
+        self.assertEqual(table['durations'], [[0.0, None], [None, None]])
+
+
+class LaneStalenessTests(SimpleTestCase):
+    ROUTE = [(-100.0, 40.0), (-99.0, 40.5), (-97.5, 40.6)]
+
+    def lane(self, table, opis_ids, cell_degrees=0.25, radius=10):
+        ids = np.array(opis_ids, dtype=np.int64)
+        return Lane('lane', ids, station_prices(table, ids), station_positions(table, ids),
+                    corridor_cells(self.ROUTE, radius, cell_degrees), b'')
+
+    def test_corridor_cells_cover_the_corridor(self):
+        rng = np.random.default_rng(5)
+        for radius, cell_degrees in ((10, 0.25), (100, 0.25), (50, 1.0)):
+            cells = corridor_cells(self.ROUTE, radius, cell_degrees)
+            # Random points within the radius of random points on the route
+            t = rng.uniform(0, 1, 2000)
+            lons = np.interp(t, [0, 0.5, 1], [lon for lon, _ in self.ROUTE])
+            lats = np.interp(t, [0, 0.5, 1], [lat for _, lat in self.ROUTE])
+            bearing, miles = rng.uniform(0, 2 * np.pi, 2000), rng.uniform(0, radius, 2000)
+            lats_out = lats + miles * np.cos(bearing) / 69.05
+            lons_out = lons + miles * np.sin(bearing) / (69.05 * np.cos(np.radians(lats)))
+            within = haversine(lats, lons, lats_out, lons_out) <= radius
+            with self.subTest(radius=radius, cell_degrees=cell_degrees):
+                self.assertTrue(np.all(np.isin(cell_keys(lats_out[within], lons_out[within], cell_degrees), cells)))
+
+    def test_unchanged_table_keeps_the_lane(self):
+        table = small_table()
+        self.assertEqual(stale_lanes([self.lane(table, [11, 22])], table), set())
+
+    def test_repriced_moved_or_removed_station(self):
+        rows = [(11, 'A', 40.0, -100.0, 3.5), (22, 'B', 40.5, -99.0, 3.7)]
+        table = StationTable.from_rows(rows, source='test', mtime=1)
+        lane = self.lane(table, [11, 22])
+        changes = {
+            'repriced': [(11, 'A', 40.0, -100.0, 3.4), rows[1]],
+            'moved': [(11, 'A', 40.05, -100.0, 3.5), rows[1]],
+            'removed': [rows[1]],
+        }
+        for name, changed in changes.items():
+            with self.subTest(name):
+                self.assertEqual(stale_lanes([lane], StationTable.from_rows(changed, source='test', mtime=2)),
+                                 {'lane'})
+
+    def test_new_station_in_the_corridor(self):
+        rows = [(11, 'A', 40.0, -100.0, 3.5), (22, 'B', 40.5, -99.0, 3.7)]
+        table = StationTable.from_rows(rows, source='test', mtime=1)
+        lane = self.lane(table, [11, 22])
+        nearby = StationTable.from_rows(rows + [(33, 'New', 40.55, -98.2, 2.9)], source='test', mtime=2)
+        self.assertEqual(stale_lanes([lane], nearby), {'lane'})
+        far_away = StationTable.from_rows(rows + [(33, 'New', 34.0, -84.0, 2.9)], source='test', mtime=2)
+        self.assertEqual(stale_lanes([lane], far_away), set())
+
+    def test_lanes_without_cells_are_stale(self):
+        table = small_table()
+        lane = self.lane(table, [11, 22])
+        lane.cells = np.empty(0, dtype=np.int64)
+        self.assertEqual(stale_lanes([lane], table), {'lane'})
+
+
+class FakeRoutingClient:
+    """Answers route() like the routing clients, from the OSRM stub's builder instead of the network"""
+
+    def __init__(self, spacing=1.0, failing=()):
+        self.spacing = spacing
+        # Start points ([lon, lat]) whose routes fail, as an unreachable backend would
+        self.failing = {recording_key([point])[0] for point in failing}
+        self.calls = 0
+
+    def route(self, coordinates, params, profile='driving'):
+        self.calls += 1
+        if recording_key(coordinates[:1])[0] in self.failing:
+            raise RoutingError('Routing service unavailable')
+        return build_route_response(list(coordinates), self.spacing, steps=params.get('steps') == 'true',
+                                    annotations=params.get('annotations') == 'true')
+
+    def table(self, coordinates, params, profile='driving'):
+        self.calls += 1
+        return build_table_response(list(coordinates), [int(i) for i in params['sources'].split(';')],
+                                    [int(i) for i in params['destinations'].split(';')])
+
+
+class AsyncFakeRoutingClient(FakeRoutingClient):
+    async def route(self, coordinates, params, profile='driving'):
+        return super().route(coordinates, params, profile)
+
+
+class ViewTestCase(TestCase):
+    """
+    Drives the views through the test client with routing answered by a
+    FakeRoutingClient; the worker's route cache, lanes and vehicle profiles
+    start empty for every test.
+    """
+
+    def setUp(self):
+        self.routing = FakeRoutingClient()
+        self.async_routing = AsyncFakeRoutingClient()
+        for target, value in (('route_planner.utils.get_routing_client', lambda: self.routing),
+                              ('route_planner.utils.get_async_routing_client', lambda: self.async_routing),
+                              ('route_planner.matrix.get_routing_client', lambda: self.routing),
+                              ('route_planner.route_cache._caches', {}),
+                              ('route_planner.lanes._store', None),
+                              ('route_planner.vehicles._store', None)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def trip(start, end, **data):
+        """Request body for a trip between two (lon, lat) points"""
+        return {'start_lat': start[1], 'start_lon': start[0], 'end_lat': end[1], 'end_lon': end[0], **data}
+
+
+class AsyncViewTests(ViewTestCase):
+    async def test_route_matches_sync_view(self):
+        body = self.trip(CHICAGO, DALLAS, geometry='none')
+        response = await self.async_client.post('/route/async/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Route-Cache'], 'MISS')
+        self.assertEqual(self.routing.calls, 0)
+        expected = await sync_to_async(self.client.post)('/route/', body, content_type='application/json')
+        self.assertEqual(response.json()['fuel_stops'], expected.json()['fuel_stops'])
+        self.assertEqual(response.json()['total_cost'], expected.json()['total_cost'])
+        # The sync view found the route the async one cached
+        self.assertEqual(expected['X-Route-Cache'], 'HIT')
+
+    async def test_map(self):
+        # Django 3.2's AsyncClient drops GET data, so the query goes in the URL
+        response = await self.async_client.get(f'/map/async/?{urlencode(self.trip(CHICAGO, INDIANAPOLIS))}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'leaflet', response.content)
+        self.assertTrue(response['ETag'])
+
+    async def test_routing_errors_are_502(self):
+        self.async_routing.failing = {recording_key([CHICAGO])[0]}
+        response = await self.async_client.post('/route/async/', self.trip(CHICAGO, DALLAS),
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 502)
+        self.assertIn('error', response.json())
+
+    async def test_open_breaker_is_502_without_calling_out(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        # Nothing listens on the discard port; an open breaker never gets that far
+        client = AsyncOSRMClient('http://127.0.0.1:9', breaker=breaker)
+        with mock.patch('route_planner.utils.get_async_routing_client', lambda: client):
+            response = await self.async_client.post('/route/async/', self.trip(CHICAGO, DALLAS),
+                                                    content_type='application/json')
+        await client.client.aclose()
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(breaker.state, 'open')
+
+
+class BatchRouteTests(ViewTestCase):
+    def stream(self, routes, **data):
+        response = self.client.post('/route/batch/', {'routes': routes, **data}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_one_line_per_route(self):
+        routes = [self.trip(CHICAGO, DALLAS, id='a'), self.trip(CHICAGO, INDIANAPOLIS, id='b'),
+                  self.trip(CHICAGO, DALLAS, id='c', mpg=6)]
+        lines = self.stream(routes)
+        self.assertEqual(sorted(line['index'] for line in lines), [0, 1, 2])
+        by_index = {line['index']: line for line in lines}
+        for index, route in enumerate(routes):
+            self.assertEqual(by_index[index]['id'], route['id'])
+            self.assertEqual(by_index[index]['status'], 200)
+        # Chicago-Indianapolis is within one tank; the 6 mpg truck buys more fuel on the same lane
+        self.assertEqual(by_index[1]['fuel_stops'], [])
+        self.assertGreater(by_index[2]['total_cost'], by_index[0]['total_cost'])
+        # The two Dallas trips share one routing call
+        self.assertEqual(self.routing.calls, 2)
+
+    def test_failed_items_get_their_own_line(self):
+        self.routing.failing = {recording_key([INDIANAPOLIS])[0]}
+        routes = [self.trip(CHICAGO, DALLAS), {'start_lat': 'north'}, self.trip(INDIANAPOLIS, DALLAS), 'nope']
+        lines = {line['index']: line for line in self.stream(routes)}
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[0]['status'], 200)
+        self.assertEqual([lines[i]['status'] for i in (1, 2, 3)], [400, 502, 400])
+        for i in (1, 2, 3):
+            self.assertIn('error', lines[i])
+
+    @override_settings(ROUTE_BATCH_MAX_ITEMS=2)
+    def test_size_limit(self):
+        routes = [self.trip(CHICAGO, INDIANAPOLIS)] * 3
+        response = self.client.post('/route/batch/', {'routes': routes}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.routing.calls, 0)
+        self.assertEqual(len(self.stream(routes[:2])), 2)
+
+
+class ResponseShapeTests(ViewTestCase):
+    def test_polyline_reference_example(self):
+        # Google's documented example, then a repeated point for zero deltas
+        points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453), (43.252, -126.453)]
+        encoded = encode_polyline([(lon, lat) for lat, lon in points])
+        self.assertEqual(encoded, '_p~iF~ps|U_ulLnnqC_mqNvxq`@??')
+        self.assertEqual(polyline.decode(encoded), points)
+
+    def test_polyline_route(self):
+        body = self.trip(CHICAGO, INDIANAPOLIS, geometry='polyline', steps='false')
+        route = self.client.post('/route/', body, content_type='application/json').json()['route']['routes'][0]
+        full = self.client.post('/route/', self.trip(CHICAGO, INDIANAPOLIS), content_type='application/json')
+        coordinates = full.json()['route']['routes'][0]['geometry']['coordinates']
+        decoded = np.array(polyline.decode(route['geometry'], geojson=True))
+        np.testing.assert_allclose(decoded, coordinates, atol=1e-5)
+        self.assertNotIn('steps', route['segments'][0])
+
+    def test_orjson_writes_nan_as_null(self):
+        data = {'cost': float('nan'), 'range': float('inf'), 'prices': np.array([3.5, np.nan])}
+        self.assertEqual(json.loads(ORJSONRenderer().render(data)),
+                         {'cost': None, 'range': None, 'prices': [3.5, None]})
+        # Only the route views render this way; everything else keeps DRF's strict renderer
+        self.assertIn(ORJSONRenderer, RouteAPIView.renderer_classes)
+        self.assertNotIn(ORJSONRenderer, APIView.renderer_classes)
+        with self.assertRaises(ValueError):
+            JSONRenderer().render({'cost': float('nan')})
+
+
+class MapCacheTests(ViewTestCase):
+    def test_revalidation(self):
+        params = self.trip(CHICAGO, INDIANAPOLIS)
+        response = self.client.get('/map/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Map-Cache'], 'MISS')
+        etag = response['ETag']
+
+        response = self.client.get('/map/', params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get('/map/', params)
+        self.assertEqual(response['X-Map-Cache'], 'HIT')
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.routing.calls, 1)
+
+    def test_etag_follows_the_trip_and_tolerance(self):
+        etag = self.client.get('/map/', self.trip(CHICAGO, INDIANAPOLIS))['ETag']
+        other_route = self.client.get('/map/', self.trip(INDIANAPOLIS, CHICAGO))
+        self.assertNotEqual(other_route['ETag'], etag)
+        with override_settings(MAP_SIMPLIFY_TOLERANCE_METERS=200):
+            other_tolerance = self.client.get('/map/', self.trip(CHICAGO, INDIANAPOLIS),
+                                              HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(other_tolerance.status_code, 200)
+        self.assertNotEqual(other_tolerance['ETag'], etag)
+        self.assertEqual(self.client.get('/map/', self.trip(CHICAGO, INDIANAPOLIS))['ETag'], etag)
+
+
+class ImportStationsTests(TestCase):
+    HEADER = ',OPIS Truckstop ID,Truckstop Name,Address,City,State,Rack ID,Retail Price,Latitude,Longitude'
+    ROWS = [
+        '0,7,WOODSHED OF BIG CABIN,"I-44, EXIT 283",Big Cabin,OK,307,3.007,34.856393,-99.363463',
+        '1,9,KWIK TRIP #796,"I-94, EXIT 143",Tomah,WI,420,3.287,43.032232,-89.172131',
+        # The price file lists some stations twice; the last row wins
+        '2,7,WOODSHED,"I-44, EXIT 283",Big Cabin,OK,307,3.017,34.856393,-99.363463',
+        '3,21,PILOT #1243,"I-80, EXIT 161",Hudson,CO,,3.699,40.0717,-104.6436',
+    ]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'prices.csv')
+
+    def load(self, rows, *args):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join([self.HEADER, *rows]) + '\n')
+        out = io.StringIO()
+        call_command('import_stations', self.path, *args, stdout=out)
+        return out.getvalue().strip()
+
+    def stations(self):
+        return {station.opis_id: station for station in FuelStation.objects.all()}
+
+    def test_import_and_reimport(self):
+        self.assertEqual(self.load(self.ROWS),
+                         '3 stations: 3 created, 0 updated, 0 unchanged (1 duplicate rows skipped)')
+        first = self.stations()
+        self.assertEqual(first[7].name, 'WOODSHED')
+        self.assertIsNone(first[21].rack_id)
+
+        rows = list(self.ROWS)
+        rows[1] = rows[1].replace('3.287', '3.259')
+        self.assertEqual(self.load(rows, '--chunk-size', '2'),
+                         '3 stations: 0 created, 1 updated, 2 unchanged (1 duplicate rows skipped)')
+        second = self.stations()
+        self.assertEqual(second[9].price, 3.259)
+        self.assertGreater(second[9].updated_at, first[9].updated_at)
+        for opis_id in (7, 21):
+            self.assertEqual(second[opis_id].updated_at, first[opis_id].updated_at)
+
+    def test_truncate(self):
+        self.load(self.ROWS)
+        self.assertEqual(self.load(self.ROWS[1:2], '--truncate'),
+                         '1 stations: 1 created, 0 updated, 0 unchanged (0 duplicate rows skipped)')
+        self.assertEqual(list(self.stations()), [9])
+
+    def test_bad_rows(self):
+        self.load(self.ROWS)
+        rows = [*self.ROWS[:2], self.ROWS[3].replace('3.699', 'n/a')]
+        with self.assertRaisesMessage(CommandError, 'prices.csv, line 4:'):
+            self.load(rows)
+        # Nothing is written from a file with a bad row
+        self.assertEqual(self.stations()[9].price, 3.287)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write('OPIS Truckstop ID,Retail Price\n9,3.1\n')
+        with self.assertRaisesMessage(CommandError, 'is missing columns'):
+            call_command('import_stations', self.path, stdout=io.StringIO())
+
+
+class StartupTests(SimpleTestCase):
+    CHILD = '''
+import json, os, sys
+os.environ['DJANGO_SETTINGS_MODULE'] = 'fuel_route_api.settings'
+import django
+django.setup()
+from django.conf import settings
+from django.urls import get_resolver
+get_resolver(settings.ROOT_URLCONF).url_patterns
+loaded = [name for name in ('folium', 'pandas', 'branca') if name in sys.modules]
+from route_planner.map_visualizer import create_route_map
+create_route_map([[-87.63, 41.88], [-86.16, 39.77]], [])._repr_html_()
+print(json.dumps({'at_startup': loaded, 'after_map': 'folium' in sys.modules}))
+'''
+
+    def test_folium_loads_with_the_first_map(self):
+        result = subprocess.run([sys.executable, '-c', self.CHILD], cwd=settings.BASE_DIR, capture_output=True,
+                                text=True, timeout=120, check=True)
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        self.assertEqual(report['at_startup'], [])
+        self.assertTrue(report['after_map'])
+
+
+class InstrumentationTests(ViewTestCase):
+    def server_timing(self, response):
+        return {name: float(duration.split('=')[1])
+                for name, duration in (entry.strip().split(';') for entry in response['Server-Timing'].split(','))}
+
+    def test_server_timing_and_metrics(self):
+        response = self.client.post('/route/', self.trip(CHICAGO, DALLAS), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        timings = self.server_timing(response)
+        for name in ('route-cache', 'osrm', 'distance', 'search', 'serialize', 'total'):
+            self.assertIn(name, timings)
+        self.assertEqual(list(timings)[-1], 'total')
+        self.assertGreaterEqual(timings['total'], max(timings.values()))
+
+        metrics = self.client.get('/metrics/').content.decode()
+        self.assertIn('route_planner_request_seconds_count{view="route",method="POST",status="200"}', metrics)
+        self.assertIn('route_planner_span_seconds_count{span="osrm"}', metrics)
+        self.assertIn('route_planner_cache_misses_total{cache="route"} 1', metrics)
+
+    @override_settings(INSTRUMENTATION={'SERVER_TIMING': False})
+    def test_header_can_be_turned_off(self):
+        response = self.client.get('/metrics/')
+        self.assertNotIn('Server-Timing', response)
+
+    def test_open_breaker_is_502_without_calling_out(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        client = OSRMClient('http://127.0.0.1:9', breaker=breaker)
+        with mock.patch('route_planner.utils.get_routing_client', lambda: client), \
+                mock.patch.object(client.session, 'get') as get:
+            response = self.client.post('/route/', self.trip(CHICAGO, DALLAS), content_type='application/json')
+        self.assertEqual(response.status_code, 502)
+        get.assert_not_called()
+
+
+class OSRMResponseFormatTests(SimpleTestCase):
+    """The stub and the benchmark fixtures must carry every field map_osrm_response reads from OSRM"""
+
+    def assert_osrm_route(self, data, start, end):
+        self.assertEqual(data['code'], 'Ok')
+        route = data['routes'][0]
+        coordinates = route['geometry']['coordinates']
+        self.assertEqual(route['geometry']['type'], 'LineString')
+        np.testing.assert_allclose(coordinates[0], start, atol=1e-4)
+        np.testing.assert_allclose(coordinates[-1], end, atol=1e-4)
+        self.assertAlmostEqual(sum(leg['distance'] for leg in route['legs']), route['distance'], delta=1)
+        self.assertAlmostEqual(sum(leg['duration'] for leg in route['legs']), route['duration'], delta=1)
+        # The geometry is the road the distances were measured on
+        self.assertAlmostEqual(cumulative_distances(coordinates)[-1] * METERS_PER_MILE / route['distance'], 1,
+                               delta=0.01)
+        for leg in route['legs']:
+            self.assertGreater(len(leg['steps']), 0)
+            for step in leg['steps']:
+                for key in ('distance', 'duration', 'name', 'geometry'):
+                    self.assertIn(key, step)
+                self.assertIn('instruction', step['maneuver'])
+                self.assertIn('type', step['maneuver'])
+            self.assertAlmostEqual(sum(step['distance'] for step in leg['steps']), leg['distance'], delta=1)
+        self.assertEqual(len(data['waypoints']), len(route['legs']) + 1)
+
+        mapped = RoutePlanner().map_osrm_response(data)
+        summary = mapped['routes'][0]['summary']
+        self.assertEqual((summary['distance'], summary['duration']), (route['distance'], route['duration']))
+        self.assertEqual(len(mapped['routes'][0]['segments']), len(route['legs']))
+        first_step = mapped['routes'][0]['segments'][0]['steps'][0]
+        self.assertIsNotNone(first_step['instruction'])
+        self.assertIsNotNone(first_step['type'])
+
+    def test_stub(self):
+        self.assert_osrm_route(build_route_response([CHICAGO, INDIANAPOLIS, DALLAS]), CHICAGO, DALLAS)
+        data = build_route_response([CHICAGO, DALLAS], annotations=True)
+        annotation = data['routes'][0]['legs'][0]['annotation']
+        self.assertAlmostEqual(sum(annotation['distance']), data['routes'][0]['distance'], delta=1)
+        self.assertEqual(len(annotation['nodes']), len(data['routes'][0]['geometry']['coordinates']))
+
+    def test_benchmark_fixtures(self):
+        directory = os.path.join(settings.BASE_DIR, 'benchmarks', 'fixtures', 'osrm')
+        names = sorted(os.listdir(directory))
+        self.assertTrue(names)
+        for name in names:
+            with self.subTest(fixture=name), gzip.open(os.path.join(directory, name), 'rt', encoding='utf-8') as f:
+                fixture = json.load(f)
+                self.assert_osrm_route(fixture['response'], fixture['start'], fixture['end'])
+
+
+class LoadReplayTests(SimpleTestCase):
+    def test_replays_a_workload_end_to_end(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        workload = os.path.join(directory.name, 'workload.jsonl')
+        output = os.path.join(directory.name, 'summary.json')
+        trips = [{'endpoint': 'route', **ViewTestCase.trip(CHICAGO, INDIANAPOLIS)},
+                 {'endpoint': 'map', **ViewTestCase.trip(INDIANAPOLIS, CHICAGO)},
+                 {'endpoint': 'route', 'start_lat': 41.88}]
+        with open(workload, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(trip) + '\n' for trip in trips)
+        subprocess.run([sys.executable, os.path.join(settings.BASE_DIR, 'benchmarks', 'load_replay.py'),
+                        '--workload', workload, '--requests', '4', '--concurrency', '1', '--latency', '0',
+                        '--warmup', '0', '--output', output],
+                       cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=300, check=True)
+        with open(output, encoding='utf-8') as f:
+            summary = json.load(f)
+        self.assertEqual(summary['requests'], 4)
+        endpoints = summary['endpoints']
+        # The trip without coordinates is skipped, so the two good ones alternate
+        self.assertEqual(endpoints['route']['statuses'], {'200': 2})
+        self.assertEqual(endpoints['map']['statuses'], {'200': 2})
+        self.assertEqual(endpoints['all']['error_rate'], 0.0)
+        self.assertEqual(endpoints['route']['cache'], {'MISS': 1, 'HIT': 1})
+
+
+class MatrixTests(ViewTestCase):
+    SOURCES = [CHICAGO, INDIANAPOLIS, DALLAS]
+    DESTINATIONS = [(-85.7585, 38.2527), (-90.1994, 38.627)]
+
+    def post(self, **data):
+        body = {'sources': [[lat, lon] for lon, lat in self.SOURCES],
+                'destinations': [[lat, lon] for lon, lat in self.DESTINATIONS], 'mpg': 8, 'fuel_price': 4.0, **data}
+        return self.client.post('/matrix/', body, content_type='application/json')
+
+    @override_settings(MATRIX={'CHUNK_SIZE': 2})
+    def test_road_matrix(self):
+        response = self.post()
+        self.assertEqual(response.status_code, 200)
+        # Three sources in blocks of two, against both destinations
+        self.assertEqual(response['X-Matrix-Cache'], '0/2')
+        self.assertEqual(self.routing.calls, 2)
+        data = response.json()
+        sources, destinations = np.array(self.SOURCES), np.array(self.DESTINATIONS)
+        miles = haversine(sources[:, None, 1], sources[:, None, 0], destinations[None, :, 1], destinations[None, :, 0])
+        np.testing.assert_allclose(data['distances'], miles * METERS_PER_MILE, rtol=1e-9)
+        np.testing.assert_allclose(data['fuel_costs'], miles / 8 * 4.0, rtol=1e-9)
+        self.assertEqual(np.shape(data['durations']), (3, 2))
+
+        repeat = self.post()
+        self.assertEqual(repeat['X-Matrix-Cache'], '2/2')
+        self.assertEqual(self.routing.calls, 2)
+        self.assertEqual(repeat.json(), data)
+
+    def test_haversine_mode_does_not_route(self):
+        data = self.post(mode='haversine').json()
+        self.assertEqual(self.routing.calls, 0)
+        self.assertEqual(data['mode'], 'haversine')
+        self.assertEqual(np.shape(data['distances']), (3, 2))
+
+    @override_settings(MATRIX={'MAX_LOCATIONS': 2})
+    def test_limits(self):
+        self.assertEqual(self.post().status_code, 400)
+        self.assertEqual(self.post(mode='ferry', destinations=None).status_code, 400)
+        self.assertEqual(self.routing.calls, 0)
+
+
+class PrecomputedLaneTests(ViewTestCase):
+    def precompute(self, *trips):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'lanes.jsonl')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(trip) + '\n' for trip in trips)
+        out = io.StringIO()
+        call_command('precompute_lanes', '--lanes', path, stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_served_without_routing_and_same_as_a_live_plan(self):
+        trip = self.trip(CHICAGO, DALLAS)
+        self.assertIn('1 lanes precomputed', self.precompute(trip))
+        self.assertEqual(PrecomputedLane.objects.count(), 1)
+        calls = self.routing.calls
+
+        response = self.client.post('/route/', trip, content_type='application/json')
+        self.assertEqual(response['X-Route-Cache'], 'PRECOMPUTED')
+        self.assertEqual(self.routing.calls, calls)
+
+        live = self.client.post('/route/', dict(trip, cache='false'), content_type='application/json')
+        self.assertEqual(live['X-Route-Cache'], 'BYPASS')
+        self.assertEqual(self.routing.calls, calls + 1)
+        self.assertEqual(response.json(), live.json())
+
+    def test_only_the_same_vehicle_and_stored_fields_get_the_lane(self):
+        trip = self.trip(CHICAGO, DALLAS)
+        self.precompute(trip)
+        # A lean shape is cut from the stored route
+        lean = self.client.post('/route/', dict(trip, geometry='polyline', steps='false'),
+                                content_type='application/json')
+        self.assertEqual(lean['X-Route-Cache'], 'PRECOMPUTED')
+        self.assertIsInstance(lean.json()['route']['routes'][0]['geometry'], str)
+        # Not the stored plan, though the route itself is cached from precomputing it
+        other_mpg = self.client.post('/route/', dict(trip, mpg=6), content_type='application/json')
+        self.assertEqual(other_mpg['X-Route-Cache'], 'HIT')
+        # Stored routes have no annotations
+        annotated = self.client.post('/route/', dict(trip, annotations='true'), content_type='application/json')
+        self.assertEqual(annotated['X-Route-Cache'], 'MISS')
@@ -1,20 +1,108 @@
 # route_planner/utils.py
-import requests
-import pandas as pd
+import hashlib
 import math
 import os
-from typing import List, Dict, Tuple
+from bisect import bisect_right
+from itertools import accumulate
+from typing import List, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .corridor import build_corridor
+from .distance import METERS_PER_MILE, coordinates_array, cumulative_distances, haversine, haversine_pairwise
+from .fuel_solver import NoFuelStopError, solve_fuel_stops
+from .geometry import simplify_route
+from .instrumentation import span
+from .route_cache import get_route_cache
+from .routing_client import get_async_routing_client, get_routing_client
+from .scoring import DetourScoring, scoring_config, top_k, window
+from .stations import StationTable, get_station_table
+from .vehicles import Vehicle
+
+# A stop this close before a waypoint counts as being at it
+WAYPOINT_SLACK_MILES = 0.1
+
+
+def parse_points(value, label: str = 'point') -> List[Tuple[float, float]]:
+    """
+    Points as (lon, lat) pairs, in order. Accepts a list of [lat, lon] pairs
+    or {"lat": ..., "lon": ...} objects (JSON bodies), or a "lat,lon;lat,lon"
+    string (query strings and forms).
+    """
+    if value is None or value == '' or value == []:
+        return []
+    if isinstance(value, str):
+        value = [pair.split(',') for pair in value.split(';') if pair.strip()]
+    if not isinstance(value, (list, tuple)):
+        raise ValueError(f'{label}s must be a list of [lat, lon] pairs')
+    points = []
+    for point in value:
+        if isinstance(point, dict):
+            point = (point.get('lat'), point.get('lon'))
+        if not isinstance(point, (list, tuple)) or len(point) != 2:
+            raise ValueError(f'Each {label} must be a [lat, lon] pair')
+        lat, lon = float(point[0]), float(point[1])
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError(f'{label.capitalize()} out of range: {lat}, {lon}')
+        points.append((lon, lat))
+    return points
+
+
+def parse_waypoints(value) -> List[Tuple[float, float]]:
+    """Intermediate stops of a trip as (lon, lat) pairs, in order; see parse_points"""
+    waypoints = parse_points(value, 'waypoint')
+    limit = getattr(settings, 'ROUTE_MAX_WAYPOINTS', 25)
+    if len(waypoints) > limit:
+        raise ValueError(f'At most {limit} waypoints per trip')
+    return waypoints
+
 
 class RoutePlanner:
-    def __init__(self):
+    def __init__(self, max_range: float = None, mpg: float = None, fuel_stations: StationTable = None,
+                 vehicle: Optional[Vehicle] = None):
         # self.OPENROUTE_API_KEY = os.getenv("OPENROUTE_API_KEY")
         self.BASE_URL = 'https://api.openrouteservice.org/v2/directions/driving-car'
-        self.fuel_stations = self.load_fuel_stations()
+        # Callers planning many routes pass one table so they all see the same snapshot
+        self.fuel_stations = fuel_stations if fuel_stations is not None else self.load_fuel_stations()
+        # A fleet profile (route_planner.vehicles); explicit max_range and mpg still override it
+        self.vehicle = vehicle
+        if vehicle is not None:
+            fuel_type = getattr(settings, 'FUEL_STATIONS_FUEL_TYPE', 'diesel')
+            if vehicle.fuel_type != fuel_type:
+                raise ValueError(f'No {vehicle.fuel_type} prices: the stations are priced for {fuel_type}')
+        # Vehicle range on a full tank (miles) and fuel economy (miles per gallon)
+        if vehicle is not None:
+            self.mpg = float(mpg or vehicle.mpg)
+            self.max_range = float(max_range or vehicle.usable_gallons * self.mpg)
+        else:
+            self.max_range = float(max_range or getattr(settings, 'VEHICLE_RANGE_MILES', 500))
+            self.mpg = float(mpg or getattr(settings, 'VEHICLE_MPG', 10))
+        if self.max_range <= 0 or self.mpg <= 0:
+            raise ValueError("max_range and mpg must be positive")
+        # Gallons the plan may use from a full tank; a profile's reserve is never planned on
+        self.tank_gallons = self.max_range / self.mpg
+        # Plannable gallons on board at the start; None is a full tank
+        self.start_fuel = vehicle.starting_gallons if vehicle is not None else None
+        # The profile's speed curve applies unless the request fixed the mpg
+        self.follows_mpg_curve = vehicle is not None and not mpg and len(vehicle.curve_speeds) > 0
+        self.corridor_radii = tuple(getattr(settings, 'FUEL_CORRIDOR_RADII_MILES', (10, 50, 100)))
+        # Stations are weighed by price plus the cost of the detour to them (settings.DETOUR_SCORING)
+        self.scoring = DetourScoring.from_settings(self.mpg, self.tank_gallons)
+        # Simplification error bounds (miles) for the stop search and for the map
+        self.search_tolerance = getattr(settings, 'ROUTE_SIMPLIFY_TOLERANCE_METERS', 0) / METERS_PER_MILE
+        self.map_tolerance = getattr(settings, 'MAP_SIMPLIFY_TOLERANCE_METERS', 50) / METERS_PER_MILE
+        # HIT, MISS or BYPASS for the last get_route call
+        self.route_cache_status = None
+        # Station table rows the last fuel plan was chosen from, and the corridor radius that held them
+        self.corridor_stations = None
+        self.corridor_radius = None
 
-    def load_fuel_stations(self) -> pd.DataFrame:
-        # Load and process the CSV file
-        df = pd.read_csv('route_planner/checkpoint(4).csv')
-        return df
+    def load_fuel_stations(self) -> StationTable:
+        # Shared per worker process; only re-read when the CSV changes on disk
+        with span('stations'):
+            return get_station_table()
 
     def calculate_distance(self, point1: Tuple[float, float], point2: Tuple[float, float]) -> float:
         """
@@ -36,6 +124,16 @@ class RoutePlanner:
         
         return R * c
 
+    def calculate_distances(self, points1: Sequence[Tuple[float, float]],
+                            points2: Sequence[Tuple[float, float]]) -> np.ndarray:
+        """
+        Vectorized calculate_distance: miles from every (lat, lon) point of
+        points1 to every point of points2, shape (len(points1), len(points2))
+        """
+        lats1, lons1 = np.asarray(points1, dtype=np.float64).reshape(-1, 2).T
+        lats2, lons2 = np.asarray(points2, dtype=np.float64).reshape(-1, 2).T
+        return haversine_pairwise(lats1, lons1, lats2, lons2)
+
     # def get_route(self, start_coords: Tuple[float, float], end_coords: Tuple[float, float]) -> Dict:
     #     """
     #     Get route using OpenRouteService API
@@ -57,41 +155,119 @@ class RoutePlanner:
     #     return response.json()
 
 
-    def get_route(self, start_coords: Tuple[float, float], end_coords: Tuple[float, float]) -> Dict:
+    def route_request(self, start_coords: Tuple[float, float], end_coords: Tuple[float, float],
+                      steps: bool = True, annotations: bool = False,
+                      waypoints: Sequence[Tuple[float, float]] = ()) -> Tuple[str, List, Dict]:
         """
-        Get route using OSRM API
-        Coordinates should be in [longitude, latitude] format
+        Profile, coordinates and query parameters of the OSRM call for a route.
+        Waypoints go between start and end, so one call returns every leg.
         """
-        # OSRM public server base URL
-        base_url = "http://router.project-osrm.org"
-
         # Profile can be 'driving', 'walking', or 'cycling'
         profile = 'driving'
-
-        # Construct the coordinates string
-        start_lon, start_lat = start_coords
-        end_lon, end_lat = end_coords
-        coords = f"{start_lon},{start_lat};{end_lon},{end_lat}"
-
-        # Build the full URL for the route request
-        url = f"{base_url}/route/v1/{profile}/{coords}"
+        coordinates = [start_coords, *waypoints, end_coords]
 
         # Set query parameters to mimic OpenRouteService as closely as possible
         params = {
             'overview': 'full', 
             'geometries': 'geojson',  
-            'steps': 'true',     
-            'annotations': 'true',
+            # Steps and annotations are a large share of OSRM's payload; only ask when they're returned
+            'steps': 'true' if steps else 'false',
+            'annotations': 'true' if annotations else 'false',
             'alternatives': 'false'
         }
+        return profile, coordinates, params
+
+    def plan_key(self, start_coords: Tuple[float, float], end_coords: Tuple[float, float], **route_options) -> Optional[str]:
+        """
+        Digest of everything the fuel plan for a trip depends on: the route
+        cache key, the vehicle, the station data and the planning settings.
+        None when the route cache is disabled, as the route can't be identified then.
+        """
+        cache = get_route_cache()
+        if cache is None:
+            return None
+        profile, coordinates, params = self.route_request(start_coords, end_coords, **route_options)
+        parts = (cache.make_key(profile, coordinates, params), self.vehicle_key,
+                 self.fuel_stations.version, self.corridor_radii, self.search_tolerance,
+                 self.scoring.key if self.scoring is not None else None)
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    @property
+    def vehicle_key(self) -> Tuple:
+        """The vehicle settings a fuel plan depends on"""
+        return (self.max_range, self.mpg, self.start_fuel,
+                self.vehicle.key if self.vehicle is not None else None, self.follows_mpg_curve)
+
+    def trip_mpg(self, route: Dict) -> float:
+        """Fuel economy for a route: the profile's curve at the route's average speed, else the flat mpg"""
+        if not self.follows_mpg_curve:
+            return self.mpg
+        summary = route['routes'][0]['summary']
+        if not summary.get('duration'):
+            return self.mpg
+        return self.vehicle.mpg_at(summary['distance'] / METERS_PER_MILE / (summary['duration'] / 3600))
 
-        # Make the GET request to the OSRM API
-        response = requests.get(url, params=params)
+    def get_route(self, start_coords: Tuple[float, float], end_coords: Tuple[float, float],
+                  use_cache: bool = True, steps: bool = True, annotations: bool = False,
+                  waypoints: Sequence[Tuple[float, float]] = ()) -> Dict:
+        """
+        Get route using OSRM API
+        Coordinates should be in [longitude, latitude] format
+        Repeat lanes are served from the route cache unless use_cache is False
+        With waypoints the route has one segment per leg
+        """
+        profile, coordinates, params = self.route_request(start_coords, end_coords, steps, annotations, waypoints)
 
-        # Parse the JSON response
-        data = response.json()
+        cache = get_route_cache() if use_cache else None
+        cache_key, cached = self._cached_route(cache, profile, coordinates, params)
+        if cached is not None:
+            return cached
+
+        # Pooled, retrying OSRM client shared by the whole worker (settings.OSRM)
+        with span('osrm'):
+            data = get_routing_client().route(coordinates, params, profile)
+
+        result = self.map_osrm_response(data)
+        # Errors are not cached so a transient upstream failure doesn't stick
+        if cache is not None and 'routes' in result:
+            cache.set(cache_key, result)
+        return result
 
-        # Map OSRM's response structure to match OpenRouteService's output
+    async def aget_route(self, start_coords: Tuple[float, float], end_coords: Tuple[float, float],
+                         use_cache: bool = True, steps: bool = True, annotations: bool = False,
+                         waypoints: Sequence[Tuple[float, float]] = ()) -> Dict:
+        """get_route for the async views; the OSRM call doesn't block the event loop"""
+        profile, coordinates, params = self.route_request(start_coords, end_coords, steps, annotations, waypoints)
+
+        cache = get_route_cache() if use_cache else None
+        # Cache backends may do blocking I/O (SQLite, Redis), so they run off the loop
+        cache_key, cached = await sync_to_async(self._cached_route, thread_sensitive=False)(
+            cache, profile, coordinates, params
+        )
+        if cached is not None:
+            return cached
+
+        with span('osrm'):
+            data = await get_async_routing_client().route(coordinates, params, profile)
+
+        result = self.map_osrm_response(data)
+        if cache is not None and 'routes' in result:
+            await sync_to_async(cache.set, thread_sensitive=False)(cache_key, result)
+        return result
+
+    def _cached_route(self, cache, profile: str, coordinates: List, params: Dict):
+        """(cache key, cached route or None), recording the outcome in route_cache_status"""
+        if cache is None:
+            self.route_cache_status = 'BYPASS'
+            return None, None
+        with span('route-cache'):
+            cache_key = cache.make_key(profile, coordinates, params)
+            cached = cache.get(cache_key)
+        self.route_cache_status = 'MISS' if cached is None else 'HIT'
+        return cache_key, cached
+
+    def map_osrm_response(self, data: Dict) -> Dict:
+        """Map OSRM's response structure to match OpenRouteService's output"""
         if 'routes' in data:
             routes = []
             for route in data['routes']:
@@ -116,6 +292,8 @@ class RoutePlanner:
                         'duration': leg.get('duration'),
                         'steps': steps
                     }
+                    if 'annotation' in leg:
+                        segment['annotation'] = leg['annotation']
                     segments.append(segment)
                 mapped_route = {
                     'summary': {
@@ -139,86 +317,185 @@ class RoutePlanner:
             }
         return result
 
-    def find_nearby_stations(self, position: Tuple[float, float], max_range: float = 50) -> List[Dict]:
-        """Find fuel stations within range (miles) of current position"""
+    def find_nearby_stations(self, position: Tuple[float, float], max_range: float = 50,
+                             gallons: Optional[float] = None) -> List[Dict]:
+        """
+        Find fuel stations within range (miles) of current position. Given the
+        gallons to buy, each station gets its effective_cost (detour there and
+        back included) and the list is ordered by it, cheapest first.
+        """
         nearby = []
-        current_lat, current_lon = position
-        
-        for _, station in self.fuel_stations.iterrows():
-            distance = self.calculate_distance(
-                (current_lat, current_lon),
-                (station['Latitude'], station['Longitude'])
-            )
-            if distance <= max_range:
-                nearby.append({
-                    'name': station['Truckstop Name'],
-                    'latitude': station['Latitude'],
-                    'longitude': station['Longitude'],
-                    'price': station['Retail Price'],
-                    'distance': distance
-                })
+        stations = self.fuel_stations
+        indices, distances = stations.index.query_radius(position, max_range)
+        costs = None
+        if gallons is not None:
+            costs = self._effective_costs(stations.price[indices], distances, gallons)
+            order = np.argsort(costs, kind='stable')
+            indices, distances, costs = indices[order], distances[order], costs[order].tolist()
+
+        for k, (i, distance) in enumerate(zip(indices.tolist(), distances.tolist())):
+            station = stations.station(i)
+            station['distance'] = distance
+            if costs is not None:
+                station['effective_cost'] = round(costs[k], 2)
+            nearby.append(station)
         return nearby
 
-    def find_optimal_fuel_stops(self, route: Dict) -> List[Dict]:
-        coordinates = route['routes'][0]['geometry']['coordinates']
-        optimal_stops = []
-        cumulative_distance = 0.0
-        next_refuel_distance = 500.0 
-        last_lat, last_lon = None, None
-
-        for i in range(len(coordinates)):
-            current_lon, current_lat= coordinates[i]
-            if last_lat is not None and last_lon is not None:
-                segment_distance = self.calculate_distance(
-                    (last_lat, last_lon),
-                    (current_lat, current_lon)
-                )
-                cumulative_distance += segment_distance
-
-                # Check if we need to refuel or if we're at the last coordinate
-                if cumulative_distance >= next_refuel_distance:
-                    nearby_stations = self.find_nearby_stations((current_lat, current_lon))        
-                    if nearby_stations:
-                        # Get the cheapest station
-                        cheapest_station = min(
-                            nearby_stations,
-                            key=lambda x: x['price']
-                        )
-                        optimal_stops.append(cheapest_station)
-                        next_refuel_distance += 500.0  # Set the next refuel point
-                    else:
-                        # If no stations found within the default range, expand search radius
-                        wider_search = self.find_nearby_stations(
-                            (current_lat, current_lon),
-                            max_range=100  # Increase search radius to 100 miles
-                        )
-                        if wider_search:
-                            cheapest_station = min(
-                                wider_search,
-                                key=lambda x: x['price']
-                            )
-                            optimal_stops.append(cheapest_station)
-                            next_refuel_distance += 500.0
-                        else:
-                            raise Exception("Could not find any suitable fuel stops along the route")
-            else:
-                pass
-            last_lat, last_lon = current_lat, current_lon
+    def _effective_costs(self, prices: np.ndarray, detours: np.ndarray, gallons: float) -> np.ndarray:
+        if self.scoring is None:
+            return prices * gallons
+        return self.scoring.effective_costs(prices, detours, gallons)
+
+    def find_optimal_fuel_stops(self, route: Dict, alternates: int = 0,
+                                corridors: Optional[Dict] = None) -> List[Dict]:
+        """
+        Cheapest way to fuel the route, one dict per stop. With detour scoring
+        on, stations are chosen by effective price, so a cheap station far off
+        the route has to save more than its detour costs. With ``alternates``
+        each stop also lists that many other stations within
+        ALTERNATE_WINDOW_MILES along the route, ranked by effective cost.
 
+        The corridors depend only on the route and the station table, not the
+        vehicle. Callers planning one route for several vehicles pass the
+        same ``corridors`` dict to every call, and each corridor is built once.
+        """
+        if corridors is None:
+            corridors = {}
+        mpg = self.trip_mpg(route)
+        max_range = self.max_range if mpg == self.mpg else self.tank_gallons * mpg
+        with span('distance'):
+            if 'geometry' not in corridors:
+                coordinates = coordinates_array(route['routes'][0]['geometry']['coordinates'])
+                cumulative = cumulative_distances(coordinates)
+                corridors['legs'] = self._leg_ends(route, coordinates, cumulative)
+                # Search along a simplified line, keeping each vertex's true distance from the start
+                if self.search_tolerance > 0:
+                    coordinates, cumulative = simplify_route(coordinates, self.search_tolerance, cumulative)
+                corridors['geometry'] = (coordinates, cumulative)
+            coordinates, cumulative = corridors['geometry']
+
+        # Start with stations close to the route and only widen the corridor
+        # when the trip can't be completed with what it contains
+        with span('search'):
+            for radius in self.corridor_radii:
+                corridor = corridors.get(radius)
+                if corridor is None:
+                    corridor = corridors[radius] = build_corridor(coordinates, self.fuel_stations, radius=radius,
+                                                                  cumulative=cumulative)
+                prices = corridor.price
+                if self.scoring is not None:
+                    prices = self.scoring.effective_prices(prices, corridor.detour)
+                try:
+                    plan = solve_fuel_stops(
+                        corridor.along, prices, corridor.total_distance,
+                        max_range=max_range, mpg=mpg, start_fuel=self.start_fuel, detours=corridor.detour
+                    )
+                    break
+                except NoFuelStopError:
+                    if radius == self.corridor_radii[-1]:
+                        raise
+
+        self.corridor_stations = corridor.stations
+        self.corridor_radius = corridor.radius
+        # The plan covers the whole trip, so fuel bought on one leg carries into the next
+        leg_ends = corridors['legs']
+        optimal_stops = []
+        for i, gallons in plan:
+            stop = self.fuel_stations.station(corridor.stations[i])
+            # Miles from the route to the station, measured from where the route passes closest
+            stop['distance'] = stop['detour_miles'] = float(corridor.detour[i])
+            stop['distance_from_start'] = float(corridor.along[i])
+            # What to buy here, including the fuel for the detours to and from this stop
+            stop['gallons'] = gallons
+            stop['cost'] = round(stop['price'] * gallons, 2)
+            if self.scoring is not None:
+                stop['detour_cost'] = round(float(self.scoring.detour_costs(stop['price'], corridor.detour[i])), 2)
+            if leg_ends is not None:
+                stop['leg'] = self._leg(leg_ends, stop['distance_from_start'])
+            if alternates:
+                stop['effective_cost'] = round(float(self._effective_costs(
+                    corridor.price[i], corridor.detour[i], gallons)), 2)
+                stop['alternates'] = self._alternates(corridor, i, gallons, alternates)
+            optimal_stops.append(stop)
         return optimal_stops
 
+    def _alternates(self, corridor, i: int, gallons: float, count: int) -> List[Dict]:
+        """The ``count`` best other stations near corridor station ``i`` for buying ``gallons``"""
+        lo, hi = window(corridor.along, float(corridor.along[i]), scoring_config()['ALTERNATE_WINDOW_MILES'])
+        # Effective cost of every station in the window at once, then a bounded heap picks the best
+        costs = self._effective_costs(corridor.price[lo:hi], corridor.detour[lo:hi], gallons)
+        ranked = []
+        for k in top_k(costs, count, exclude=i - lo):
+            station = self.fuel_stations.station(corridor.stations[lo + k])
+            station['distance'] = station['detour_miles'] = float(corridor.detour[lo + k])
+            station['distance_from_start'] = float(corridor.along[lo + k])
+            station['effective_cost'] = round(float(costs[k]), 2)
+            ranked.append(station)
+        return ranked
+
+    @staticmethod
+    def _leg_ends(route: Dict, coordinates: np.ndarray, cumulative: np.ndarray) -> Optional[List[float]]:
+        """
+        Distance from the start (miles along the geometry) at which each leg
+        ends, or None for single-leg trips. OSRM's leg lengths are scaled to
+        the geometry's haversine length, which is what stop distances use,
+        and each end is then moved onto the route vertex at its waypoint, so
+        a station right at a waypoint is on the leg that starts there.
+        """
+        segments = route['routes'][0].get('segments') or []
+        distances = [segment.get('distance') or 0.0 for segment in segments]
+        if len(distances) < 2 or sum(distances) <= 0:
+            return None
+        scale = cumulative[-1] / sum(distances)
+        ends = [end * scale for end in accumulate(distances)]
+        waypoints = route.get('waypoints') or []
+        if len(waypoints) != len(ends) + 1:
+            return ends
+        for k, waypoint in enumerate(waypoints[1:-1]):
+            location = waypoint.get('location')
+            if not location:
+                continue
+            # Only vertices near the estimate, in case the route passes the waypoint more than once
+            slack = max(1.0, 0.02 * distances[k] * scale)
+            lo, hi = np.searchsorted(cumulative, (ends[k] - slack, ends[k] + slack))
+            if lo < hi:
+                offsets = haversine(location[1], location[0], coordinates[lo:hi, 1], coordinates[lo:hi, 0])
+                ends[k] = float(cumulative[lo + int(np.argmin(offsets))])
+        return ends
+
+    @staticmethod
+    def _leg(leg_ends: List[float], along: float) -> int:
+        """Index of the leg a stop ``along`` miles from the start is on"""
+        # Station positions are projections onto a resampled route, so one at a waypoint can
+        # land a hair either side of the leg end; it goes on the leg that starts there
+        return min(bisect_right(leg_ends, along + WAYPOINT_SLACK_MILES), len(leg_ends) - 1)
+
     def calculate_total_cost(self, route: Dict, stops: List[Dict]) -> float:
+        with span('cost'):
+            return self._total_cost(route, stops)
+
+    def _total_cost(self, route: Dict, stops: List[Dict]) -> float:
         total_distance = route['routes'][0]['summary']['distance'] / 1609.34  # Convert to miles
-        gallons_needed = total_distance / 10  # 10 mpg
+        gallons_needed = total_distance / self.trip_mpg(route)
         
         total_cost = 0.0
         remaining_gallons = gallons_needed
         
         for stop in stops:
-            gallons_at_stop = min(50, remaining_gallons)  # 500 miles / 10 mpg = 50 gallons
+            if 'gallons' in stop:
+                # Stops from find_optimal_fuel_stops say how much to buy, detour fuel included
+                gallons_at_stop = stop['gallons']
+            elif remaining_gallons <= 0:
+                break  # No more fuel needed
+            else:
+                # Otherwise fill the tank
+                gallons_at_stop = min(self.tank_gallons, remaining_gallons)
             total_cost += stop['price'] * gallons_at_stop
             remaining_gallons -= gallons_at_stop
-            if remaining_gallons <= 0:
-                break  # No more fuel needed
+
+        # The driver's time off the route is part of what the trip costs (TIME_VALUE_PER_HOUR)
+        detours = [stop['detour_miles'] for stop in stops if 'detour_miles' in stop]
+        if self.scoring is not None and detours:
+            total_cost += float(self.scoring.detour_time_costs(detours).sum())
                 
-        return round(total_cost, 2)
\ No newline at end of file
+        return round(total_cost, 2)
@@ -0,0 +1,154 @@
+# route_planner/vehicles.py
+"""
+Vehicle profiles for a mixed fleet: tank size, fuel economy (flat or as a
+curve over average trip speed), a reserve the plan never touches and the
+fuel on board at the start. Profiles live in the VehicleProfile table and
+every worker keeps them in memory, so selecting one costs a dict lookup.
+"""
+import logging
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import Count, Max
+
+from .models import VehicleProfile
+
+logger = logging.getLogger(__name__)
+
+
+class Vehicle:
+    """A VehicleProfile as the planner uses it; immutable and shared between requests"""
+
+    __slots__ = ('slug', 'name', 'fuel_type', 'tank_gallons', 'mpg', 'curve_speeds', 'curve_mpg',
+                 'reserve_fraction', 'starting_fuel_fraction')
+
+    def __init__(self, slug: str, name: str, fuel_type: str, tank_gallons: float, mpg: float,
+                 mpg_curve: Sequence[Sequence[float]] = (), reserve_fraction: float = 0.0,
+                 starting_fuel_fraction: float = 1.0):
+        if tank_gallons <= 0 or mpg <= 0:
+            raise ValueError('tank_gallons and mpg must be positive')
+        if not 0 <= reserve_fraction < 1:
+            raise ValueError('reserve_fraction must be at least 0 and below 1')
+        if not 0 <= starting_fuel_fraction <= 1:
+            raise ValueError('starting_fuel_fraction must be between 0 and 1')
+        try:
+            curve = sorted((float(speed), float(economy)) for speed, economy in mpg_curve or ())
+        except (TypeError, ValueError):
+            raise ValueError('mpg_curve must be a list of [speed_mph, mpg] pairs')
+        if any(economy <= 0 for _, economy in curve):
+            raise ValueError('mpg_curve values must be positive')
+        self.slug = slug
+        self.name = name
+        self.fuel_type = fuel_type
+        self.tank_gallons = float(tank_gallons)
+        self.mpg = float(mpg)
+        self.curve_speeds = np.array([speed for speed, _ in curve])
+        self.curve_mpg = np.array([economy for _, economy in curve])
+        self.reserve_fraction = float(reserve_fraction)
+        self.starting_fuel_fraction = float(starting_fuel_fraction)
+
+    @classmethod
+    def from_model(cls, profile: VehicleProfile) -> 'Vehicle':
+        return cls(profile.slug, profile.name, profile.fuel_type, profile.tank_gallons, profile.mpg,
+                   profile.mpg_curve, profile.reserve_fraction, profile.starting_fuel_fraction)
+
+    @property
+    def usable_gallons(self) -> float:
+        """A full tank less the reserve"""
+        return self.tank_gallons * (1 - self.reserve_fraction)
+
+    @property
+    def starting_gallons(self) -> float:
+        """Plannable fuel on board at the start, i.e. above the reserve"""
+        return max(0.0, self.tank_gallons * (self.starting_fuel_fraction - self.reserve_fraction))
+
+    def mpg_at(self, speed_mph: Optional[float]) -> float:
+        """Fuel economy at an average speed, from the curve (held flat past its ends) or the flat mpg"""
+        if speed_mph is None or len(self.curve_speeds) == 0:
+            return self.mpg
+        return float(np.interp(speed_mph, self.curve_speeds, self.curve_mpg))
+
+    @property
+    def key(self) -> Tuple:
+        """Everything a plan for this vehicle depends on, for cache keys"""
+        return (self.slug, self.fuel_type, self.tank_gallons, self.mpg, tuple(self.curve_speeds.tolist()),
+                tuple(self.curve_mpg.tolist()), self.reserve_fraction, self.starting_fuel_fraction)
+
+
+class VehicleProfileStore:
+    """
+    Process-wide copy of the VehicleProfile table. At most every
+    ``recheck_seconds`` it asks the database for the profile count and the
+    newest ``updated_at``, and reloads when either has moved.
+    """
+
+    def __init__(self, using: str = 'default', recheck_seconds: float = 30.0):
+        self.using = using
+        self.recheck_seconds = recheck_seconds
+        self._profiles: Dict[str, Vehicle] = {}
+        self._stamp = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def stamp(self) -> Tuple[int, Optional[str]]:
+        stats = VehicleProfile.objects.using(self.using).aggregate(count=Count('id'), updated=Max('updated_at'))
+        return stats['count'], stats['updated'].isoformat() if stats['updated'] else None
+
+    def profiles(self) -> Dict[str, Vehicle]:
+        checked_at = self._checked_at
+        if checked_at is not None and time.monotonic() - checked_at < self.recheck_seconds:
+            return self._profiles
+        with self._lock:
+            if self._checked_at is None or time.monotonic() - self._checked_at >= self.recheck_seconds:
+                self._reload()
+                self._checked_at = time.monotonic()
+        return self._profiles
+
+    def _reload(self):
+        """Call with the lock held"""
+        try:
+            stamp = self.stamp()
+            if stamp == self._stamp:
+                return
+            profiles = {}
+            for profile in VehicleProfile.objects.using(self.using).iterator():
+                try:
+                    profiles[profile.slug] = Vehicle.from_model(profile)
+                except ValueError as e:
+                    logger.warning('Vehicle profile %s skipped: %s', profile.slug, e)
+            self._profiles = profiles
+            self._stamp = stamp
+        except DatabaseError as e:
+            # Keep serving the last good profiles through a database hiccup
+            logger.warning('Vehicle profiles not loaded from %r: %s', self.using, e)
+
+    def get(self, slug: str) -> Vehicle:
+        vehicle = self.profiles().get(slug)
+        if vehicle is None:
+            raise ValueError(f'Unknown vehicle_profile: {slug}')
+        return vehicle
+
+
+_store: Optional[VehicleProfileStore] = None
+_store_lock = threading.Lock()
+
+
+def get_vehicle_store() -> VehicleProfileStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = VehicleProfileStore(getattr(settings, 'VEHICLE_PROFILES_DATABASE', 'default'),
+                                             getattr(settings, 'VEHICLE_PROFILES_RECHECK_SECONDS', 30))
+    return _store
+
+
+def get_vehicle_profile(slug) -> Optional[Vehicle]:
+    """The profile for a ``vehicle_profile`` request parameter; None when it is absent, ValueError if unknown"""
+    if slug is None or slug == '':
+        return None
+    return get_vehicle_store().get(str(slug))
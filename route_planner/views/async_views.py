@@ -0,0 +1,156 @@
+# route_planner/views/async_views.py
+import asyncio
+import contextvars
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+
+from ..instrumentation import span
+from ..lanes import precomputed_plan
+from ..map_visualizer import create_route_map
+from ..renderers import json_response
+from ..route_cache import cache_bypassed
+from ..routing_client import RoutingError
+from ..scoring import parse_alternates
+from ..shaping import ResponseShape
+from ..utils import RoutePlanner, parse_waypoints
+from ..vehicles import get_vehicle_profile
+from .map_views import cached_map, map_cache_key, with_map_headers
+
+# Async counterparts of RouteAPIView and MapAPIView for ASGI deployments.
+# The OSRM call is awaited on the event loop; stop selection and map
+# rendering are CPU-bound and run on a small thread pool so the loop keeps
+# serving other requests while they wait on upstream I/O.
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_planning_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'PLANNER_THREADS', 4),
+                    thread_name_prefix='planner'
+                )
+    return _executor
+
+
+async def run_in_planner_pool(func, *args):
+    # Carry the request's context over so spans on the pool still reach its Server-Timing header
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(get_planning_executor(), context.run, func, *args)
+
+
+def _plan_stops(planner: RoutePlanner, route, alternates: int = 0):
+    optimal_stops = planner.find_optimal_fuel_stops(route, alternates)
+    total_cost = planner.calculate_total_cost(route, optimal_stops)
+    return optimal_stops, total_cost
+
+
+def _render_map(planner: RoutePlanner, route) -> str:
+    optimal_stops = planner.find_optimal_fuel_stops(route)
+    with span('map-render'):
+        map_obj = create_route_map(route['routes'][0]['geometry']['coordinates'], optimal_stops,
+                                   tolerance=planner.map_tolerance)
+        return map_obj._repr_html_()
+
+
+def _request_data(request):
+    if request.content_type == 'application/json':
+        return json.loads(request.body or b'{}')
+    return request.POST
+
+
+async def async_route_view(request):
+    if request.method != 'POST':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+    try:
+        data = _request_data(request)
+        start_lat = float(data.get('start_lat'))
+        start_lon = float(data.get('start_lon'))
+        end_lat = float(data.get('end_lat'))
+        end_lon = float(data.get('end_lon'))
+
+        # switched the order to lon&lat as open route expects them that way
+        start_coords = (start_lon, start_lat)
+        end_coords = (end_lon, end_lat)
+        waypoints = parse_waypoints(data.get('waypoints'))
+        vehicle = await run_in_planner_pool(get_vehicle_profile, data.get('vehicle_profile'))
+        planner = await run_in_planner_pool(RoutePlanner, data.get('max_range'), data.get('mpg'), None, vehicle)
+        shape = ResponseShape.from_params(data)
+        alternates = parse_alternates(data.get('alternates'))
+        use_cache = not cache_bypassed(request, data)
+
+        # The lane store may have to reload from the database, so off the loop
+        plan = await run_in_planner_pool(precomputed_plan, planner, start_coords, end_coords, waypoints,
+                                         shape.annotations) if use_cache and not alternates else None
+        if plan is not None:
+            response = json_response(shape.shape_response(plan))
+            response['X-Route-Cache'] = 'PRECOMPUTED'
+            return response
+
+        route = await planner.aget_route(start_coords, end_coords, use_cache=use_cache,
+                                         waypoints=waypoints, **shape.route_options())
+        optimal_stops, total_cost = await run_in_planner_pool(_plan_stops, planner, route, alternates)
+
+        response = json_response(shape.shape_response({
+            'route': route,
+            'fuel_stops': optimal_stops,
+            'total_cost': total_cost
+        }))
+        response['X-Route-Cache'] = planner.route_cache_status
+        return response
+
+    except RoutingError as e:
+        return JsonResponse({'error': str(e)}, status=502)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+
+async def async_map_view(request):
+    if request.method != 'GET':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+    try:
+        params = request.GET
+        start_lat = float(params.get('start_lat'))
+        start_lon = float(params.get('start_lon'))
+        end_lat = float(params.get('end_lat'))
+        end_lon = float(params.get('end_lon'))
+
+        start_coords = (start_lon, start_lat)
+        end_coords = (end_lon, end_lat)
+        waypoints = parse_waypoints(params.get('waypoints'))
+        vehicle = await run_in_planner_pool(get_vehicle_profile, params.get('vehicle_profile'))
+        planner = await run_in_planner_pool(RoutePlanner, params.get('max_range'), params.get('mpg'), None, vehicle)
+
+        # Same per-trip map cache and ETags as MapAPIView; cache backends may block, so off the loop
+        key = await run_in_planner_pool(map_cache_key, planner, start_coords, end_coords, 'html', waypoints)
+        not_modified, html, map_cache = await run_in_planner_pool(cached_map, request, key)
+        if not_modified is not None:
+            return not_modified
+        hit = html is not None
+        if not hit:
+            route = await planner.aget_route(start_coords, end_coords, use_cache=not cache_bypassed(request),
+                                             steps=False, waypoints=waypoints)
+            html = await run_in_planner_pool(_render_map, planner, route)
+            if map_cache is not None:
+                await run_in_planner_pool(map_cache.set, key, html)
+
+        return with_map_headers(HttpResponse(html), planner, key, hit)
+
+    except RoutingError as e:
+        return JsonResponse({'error': str(e)}, status=502)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+
+# API clients don't carry CSRF tokens (DRF exempts its APIViews the same way).
+# Set directly because Django 3.2's csrf_exempt wrapper hides coroutine functions.
+async_route_view.csrf_exempt = True
+async_map_view.csrf_exempt = True
@@ -0,0 +1,183 @@
+# route_planner/views/batch_views.py
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from ..fuel_solver import NoFuelStopError
+from ..lanes import precomputed_plan
+from ..renderers import dumps
+from ..route_cache import cache_bypassed, get_route_cache
+from ..routing_client import RoutingError
+from ..shaping import ResponseShape, parse_flag
+from ..stations import get_station_table
+from ..utils import RoutePlanner, parse_waypoints
+from ..vehicles import get_vehicle_profile
+
+
+def _parse_item(item) -> Dict:
+    if not isinstance(item, dict):
+        raise ValueError('Each route must be an object')
+    start_lat = float(item.get('start_lat'))
+    start_lon = float(item.get('start_lon'))
+    end_lat = float(item.get('end_lat'))
+    end_lon = float(item.get('end_lon'))
+    return {
+        # lon, lat as OSRM expects them
+        'start': (start_lon, start_lat),
+        'end': (end_lon, end_lat),
+        'waypoints': parse_waypoints(item.get('waypoints')),
+        'vehicle': (item.get('max_range'), item.get('mpg')),
+        'vehicle_profile': get_vehicle_profile(item.get('vehicle_profile')),
+    }
+
+
+def _error(exc: Exception) -> Dict:
+    if isinstance(exc, RoutingError):
+        code = status.HTTP_502_BAD_GATEWAY
+    elif isinstance(exc, NoFuelStopError):
+        code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    else:
+        code = status.HTTP_400_BAD_REQUEST
+    return {'status': code, 'error': str(exc)}
+
+
+class BatchRouteAPIView(APIView):
+    """
+    Plan many loads in one request.
+
+    POST {"routes": [{"id": ..., "start_lat": ..., "start_lon": ..., "end_lat": ...,
+    "end_lon": ..., "waypoints": [[lat, lon], ...], "max_range": ..., "mpg": ...,
+    "vehicle_profile": ...}, ...],
+    "include_route": false}
+
+    Identical lanes are fetched from OSRM once, uncached lanes are fetched
+    concurrently (at most ROUTE_BATCH_CONCURRENCY at a time) and every lane is
+    planned against the same station table. The vehicles on a lane share its
+    station corridors, so a mixed fleet costs one corridor search per lane. The response is newline-delimited
+    JSON with one line per input route, in completion order; ``index`` is the
+    route's position in the request. A failed route gets an ``error`` and its
+    own ``status`` without failing the rest of the batch. With include_route,
+    routes take the same geometry/steps/annotations options as /route/.
+    """
+
+    def post(self, request):
+        routes = request.data.get('routes') if hasattr(request.data, 'get') else None
+        if not isinstance(routes, list) or not routes:
+            return Response({'error': '"routes" must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        max_items = getattr(settings, 'ROUTE_BATCH_MAX_ITEMS', 500)
+        if len(routes) > max_items:
+            return Response({'error': f'At most {max_items} routes per batch'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            include_route = parse_flag(request.data.get('include_route'), False)
+            shape = ResponseShape.from_params(request.data) if include_route else None
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        use_cache = not cache_bypassed(request)
+        response = StreamingHttpResponse(
+            self.stream(routes, use_cache, shape),
+            content_type='application/x-ndjson'
+        )
+        response['X-Batch-Size'] = str(len(routes))
+        return response
+
+    def stream(self, routes: List, use_cache: bool, shape: Optional[ResponseShape]) -> Iterator[bytes]:
+        table = get_station_table()
+        cache = get_route_cache() if use_cache else None
+        # Without include_route only the summary is returned, so OSRM can skip the steps
+        route_options = shape.route_options() if shape is not None else {'steps': False}
+
+        # Group the batch by lane; each lane is routed once and planned once per vehicle
+        lanes: Dict = {}
+        for index, item in enumerate(routes):
+            item_id = item.get('id') if isinstance(item, dict) else None
+            try:
+                parsed = _parse_item(item)
+                planner = RoutePlanner(*parsed['vehicle'], fuel_stations=table, vehicle=parsed['vehicle_profile'])
+            except Exception as e:
+                yield self.line(dict(index=index, id=item_id, **_error(e)))
+                continue
+            profile, coordinates, params = planner.route_request(parsed['start'], parsed['end'],
+                                                                 waypoints=parsed['waypoints'], **route_options)
+            if cache is not None:
+                lane_key = cache.make_key(profile, coordinates, params)
+            else:
+                lane_key = (profile, tuple(coordinates))
+            lane = lanes.setdefault(lane_key, {'start': parsed['start'], 'end': parsed['end'],
+                                               'waypoints': parsed['waypoints'], 'vehicles': {}})
+            vehicle = planner.vehicle_key
+            lane['vehicles'].setdefault(vehicle, (planner, []))[1].append((index, item_id))
+
+        if not lanes:
+            return
+        concurrency = max(1, min(getattr(settings, 'ROUTE_BATCH_CONCURRENCY', 8), len(lanes)))
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch')
+        try:
+            pending = {executor.submit(self.plan_lane, lane, use_cache, shape, route_options) for lane in lanes.values()}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for result in future.result():
+                        yield self.line(result)
+        finally:
+            # The client may hang up mid-stream; don't leave lanes queued behind it
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def plan_lane(self, lane: Dict, use_cache: bool, shape: Optional[ResponseShape],
+                  route_options: Dict) -> List[Dict]:
+        """Results for every request on one lane"""
+        results = []
+        route, route_error, cache_status = None, None, None
+        # Station corridors don't depend on the vehicle, so every vehicle on the lane shares them
+        corridors = {}
+        for planner, items in lane['vehicles'].values():
+            plan = precomputed_plan(planner, lane['start'], lane['end'], lane['waypoints'],
+                                    route_options.get('annotations', False)) if use_cache else None
+            if plan is not None:
+                outcome = {
+                    'status': status.HTTP_200_OK,
+                    'cache': 'PRECOMPUTED',
+                    'summary': plan['route']['routes'][0]['summary'],
+                    'fuel_stops': plan['fuel_stops'],
+                    'total_cost': plan['total_cost'],
+                }
+                if shape is not None:
+                    outcome['route'] = shape.shape_route(plan['route'])
+                results.extend(dict(index=index, id=item_id, **outcome) for index, item_id in items)
+                continue
+            if route is None and route_error is None:
+                try:
+                    route = planner.get_route(lane['start'], lane['end'], use_cache=use_cache,
+                                              waypoints=lane['waypoints'], **route_options)
+                    cache_status = planner.route_cache_status
+                    if 'routes' not in route:
+                        route_error = ValueError(route.get('error', 'No route found'))
+                except Exception as e:
+                    route_error = e
+            if route_error is not None:
+                outcome = _error(route_error)
+            else:
+                try:
+                    fuel_stops = planner.find_optimal_fuel_stops(route, corridors=corridors)
+                    outcome = {
+                        'status': status.HTTP_200_OK,
+                        'cache': cache_status,
+                        'summary': route['routes'][0]['summary'],
+                        'fuel_stops': fuel_stops,
+                        'total_cost': planner.calculate_total_cost(route, fuel_stops),
+                    }
+                    if shape is not None:
+                        outcome['route'] = shape.shape_route(route)
+                except Exception as e:
+                    outcome = _error(e)
+            results.extend(dict(index=index, id=item_id, **outcome) for index, item_id in items)
+        return results
+
+    @staticmethod
+    def line(result: Dict) -> bytes:
+        return dumps(result) + b'\n'
@@ -1,12 +1,80 @@
 # routing/views/route_views.py
+import hashlib
+
 from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.views.generic import TemplateView
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
-from ..utils import RoutePlanner
+from ..geometry import DEFAULT_MAX_SEGMENT_MILES, encode_polyline, simplify_coordinates
+from ..instrumentation import span
+from ..renderers import ROUTE_RENDERERS
+from ..route_cache import cache_bypassed, get_map_cache
+from ..routing_client import RoutingError
+from ..utils import RoutePlanner, parse_waypoints
+from ..vehicles import get_vehicle_profile
 from ..map_visualizer import create_route_map
 
+
+def map_cache_key(planner: RoutePlanner, start_coords, end_coords, kind: str, waypoints=()):
+    """
+    Key of a rendered map in the map cache, which doubles as its ETag.
+    Built from the trip's plan key, so a hit skips the routing, the stop
+    search and the rendering; None when maps can't be cached.
+    """
+    plan_key = planner.plan_key(start_coords, end_coords, steps=False, waypoints=waypoints)
+    if plan_key is None or get_map_cache() is None:
+        return None
+    digest = hashlib.sha1(f'{plan_key}|{planner.map_tolerance}'.encode()).hexdigest()
+    return f'map:{kind}:{digest}'
+
+
+def cached_map(request, key):
+    """(304 response or None, cached map or None, cache to store a fresh map in or None)"""
+    cache = get_map_cache() if key is not None else None
+    if cache is None:
+        return None, None, None
+    if cache_bypassed(request):
+        # Re-render, but keep the fresh copy for everyone else
+        return None, None, cache
+    etag = f'"{key}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+        return not_modified, None, cache
+    return None, cache.get(key), cache
+
+
+def with_map_headers(response, planner: RoutePlanner, key, hit: bool):
+    if planner.route_cache_status is not None:
+        response['X-Route-Cache'] = planner.route_cache_status
+    if key is None:
+        response['X-Map-Cache'] = 'BYPASS'
+    else:
+        response['X-Map-Cache'] = 'HIT' if hit else 'MISS'
+        response['ETag'] = f'"{key}"'
+    return response
+
+
+def map_data(planner: RoutePlanner, route, optimal_stops):
+    """Compact payload for the Leaflet map page: an encoded polyline plus the stops"""
+    coordinates = route['routes'][0]['geometry']['coordinates']
+    if planner.map_tolerance > 0:
+        coordinates = simplify_coordinates(coordinates, planner.map_tolerance, DEFAULT_MAX_SEGMENT_MILES)
+    return {
+        'geometry': encode_polyline(coordinates, 5),
+        'summary': route['routes'][0]['summary'],
+        'fuel_stops': [
+            {key: stop[key] for key in ('name', 'latitude', 'longitude', 'price',
+                                        'distance_from_start', 'gallons', 'cost')}
+            for stop in optimal_stops
+        ],
+        'total_cost': planner.calculate_total_cost(route, optimal_stops),
+    }
+
+
 class MapAPIView(APIView):
     def get(self, request):
         '''make this endpoint parse the coords from the link so we can use it on the browser easier'''
@@ -15,23 +83,99 @@ class MapAPIView(APIView):
             start_lon = float(request.query_params.get('start_lon'))
             end_lat = float(request.query_params.get('end_lat'))
             end_lon = float(request.query_params.get('end_lon'))
-            
+
             # switched the order to lon&lat as open route expects them that way
             start_coords = (start_lon, start_lat)
             end_coords = (end_lon, end_lat)
-            planner = RoutePlanner()
+            # Optional stops in between: waypoints=lat,lon;lat,lon
+            waypoints = parse_waypoints(request.query_params.get('waypoints'))
+            planner = RoutePlanner(
+                max_range=request.query_params.get('max_range'),
+                mpg=request.query_params.get('mpg'),
+                vehicle=get_vehicle_profile(request.query_params.get('vehicle_profile'))
+            )
 
-            route = planner.get_route(start_coords, end_coords)
+            # Rendered maps are cached per trip and revalidated with ETags
+            key = map_cache_key(planner, start_coords, end_coords, 'html', waypoints)
+            not_modified, html, map_cache = cached_map(request, key)
+            if not_modified is not None:
+                return not_modified
+            hit = html is not None
+            if not hit:
+                # The map only draws the line, so skip the turn-by-turn steps
+                route = planner.get_route(start_coords, end_coords, use_cache=not cache_bypassed(request),
+                                          steps=False, waypoints=waypoints)
 
-            # Find optimal fuel stops
-            optimal_stops = planner.find_optimal_fuel_stops(route)
+                # Find optimal fuel stops
+                optimal_stops = planner.find_optimal_fuel_stops(route)
 
-            # total_cost = planner.calculate_total_cost(route, optimal_stops) #CHANGE ME
-            map_obj = create_route_map(route['routes'][0]['geometry']['coordinates'], optimal_stops)
+                # total_cost = planner.calculate_total_cost(route, optimal_stops) #CHANGE ME
+                with span('map-render'):
+                    map_obj = create_route_map(route['routes'][0]['geometry']['coordinates'], optimal_stops,
+                                               tolerance=planner.map_tolerance)
+                    html = map_obj._repr_html_()
+                if map_cache is not None:
+                    map_cache.set(key, html)
 
-            return HttpResponse(map_obj._repr_html_())
+            return with_map_headers(HttpResponse(html), planner, key, hit)
 
+        except RoutingError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_502_BAD_GATEWAY)
         except Exception as e:
             return Response({
                 'error': str(e)
             }, status=status.HTTP_400_BAD_REQUEST)
+
+
+class MapDataAPIView(APIView):
+    """
+    Route geometry (encoded polyline, precision 5) and fuel stops as compact
+    JSON, for LeafletMapView or any other client-side map.
+    """
+    renderer_classes = ROUTE_RENDERERS
+
+    def get(self, request):
+        try:
+            start_coords = (float(request.query_params.get('start_lon')), float(request.query_params.get('start_lat')))
+            end_coords = (float(request.query_params.get('end_lon')), float(request.query_params.get('end_lat')))
+            waypoints = parse_waypoints(request.query_params.get('waypoints'))
+            planner = RoutePlanner(
+                max_range=request.query_params.get('max_range'),
+                mpg=request.query_params.get('mpg'),
+                vehicle=get_vehicle_profile(request.query_params.get('vehicle_profile'))
+            )
+
+            key = map_cache_key(planner, start_coords, end_coords, 'data', waypoints)
+            not_modified, data, map_cache = cached_map(request, key)
+            if not_modified is not None:
+                return not_modified
+            hit = data is not None
+            if not hit:
+                route = planner.get_route(start_coords, end_coords, use_cache=not cache_bypassed(request),
+                                          steps=False, waypoints=waypoints)
+                data = map_data(planner, route, planner.find_optimal_fuel_stops(route))
+                if map_cache is not None:
+                    map_cache.set(key, data)
+
+            return with_map_headers(Response(data), planner, key, hit)
+
+        except RoutingError as e:
+            return Response({'error': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class LeafletMapView(TemplateView):
+    """
+    Static map page. It takes the same query string as /map/ and draws the
+    route client-side from /map/data/, so no HTML is rendered per trip.
+    """
+    template_name = 'route_planner/leaflet_map.html'
+
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        # The page is the same for every trip; only /map/data/ varies
+        response['Cache-Control'] = 'public, max-age=3600'
+        return response
@@ -0,0 +1,90 @@
+# route_planner/views/matrix_views.py
+import numpy as np
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from ..instrumentation import span
+from ..matrix import estimate_matrix, fuel_costs, matrix_config, road_matrix
+from ..renderers import ROUTE_RENDERERS
+from ..route_cache import cache_bypassed, get_route_cache
+from ..routing_client import RoutingError
+from ..utils import RoutePlanner, parse_points
+from ..vehicles import get_vehicle_profile
+
+MODES = ('road', 'haversine')
+
+
+def _cells(matrix: np.ndarray):
+    """Nested lists with None for pairs that have no route"""
+    return [[None if value != value else value for value in row] for row in matrix.tolist()]
+
+
+class MatrixAPIView(APIView):
+    """
+    Distance, duration and fuel cost between every source and destination.
+
+    POST {"sources": [[lat, lon], ...], "destinations": [[lat, lon], ...],
+    "mode": "road", "mpg": ..., "vehicle_profile": ..., "fuel_price": ...}
+
+    mode "road" (the default) asks the routing backend's table service;
+    "haversine" estimates from great-circle distances without any routing
+    call (see MATRIX in settings). Without destinations the sources are used
+    for both. Distances are meters, durations seconds and fuel costs dollars
+    at ``fuel_price`` per gallon, by default the median station price; pairs
+    with no route are null. X-Matrix-Cache reports the table blocks served
+    from the route cache out of those needed.
+    """
+    renderer_classes = ROUTE_RENDERERS
+
+    def post(self, request):
+        try:
+            config = matrix_config()
+            sources = parse_points(request.data.get('sources'), 'source')
+            destinations = parse_points(request.data.get('destinations'), 'destination') or sources
+            if not sources:
+                raise ValueError('"sources" must be a non-empty list of [lat, lon] pairs')
+            if max(len(sources), len(destinations)) > config['MAX_LOCATIONS']:
+                raise ValueError(f'At most {config["MAX_LOCATIONS"]} sources and destinations')
+            mode = request.data.get('mode') or 'road'
+            if mode not in MODES:
+                raise ValueError(f'mode must be one of: {", ".join(MODES)}')
+            planner = RoutePlanner(mpg=request.data.get('mpg'),
+                                   vehicle=get_vehicle_profile(request.data.get('vehicle_profile')))
+            fuel_price = request.data.get('fuel_price')
+            fuel_price = float(fuel_price) if fuel_price is not None else float(np.median(planner.fuel_stations.price))
+            if not fuel_price > 0:
+                raise ValueError('fuel_price must be positive')
+
+            stats = None
+            if mode == 'road':
+                cache = None if cache_bypassed(request) else get_route_cache()
+                durations, distances, stats = road_matrix(sources, destinations, cache)
+            else:
+                with span('distance'):
+                    miles = planner.calculate_distances([(lat, lon) for lon, lat in sources],
+                                                        [(lat, lon) for lon, lat in destinations])
+                    durations, distances = estimate_matrix(miles)
+
+            response = Response({
+                'mode': mode,
+                'mpg': planner.mpg,
+                'fuel_price': fuel_price,
+                'distances': _cells(distances),
+                'durations': _cells(durations),
+                'fuel_costs': _cells(fuel_costs(distances, planner.mpg, fuel_price)),
+            })
+            if stats is not None:
+                response['X-Matrix-Cache'] = f'{stats["cached"]}/{stats["chunks"]}'
+            return response
+
+        except RoutingError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_502_BAD_GATEWAY
+            )
+        except Exception as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
@@ -0,0 +1,11 @@
+# route_planner/views/metrics_views.py
+from django.http import HttpResponse
+
+from ..instrumentation import render_metrics
+from ..route_cache import cache_metrics
+
+
+def metrics_view(request):
+    """Span and request histograms and cache counters of this worker process, in the Prometheus text format"""
+    body = render_metrics() + ''.join(f'{line}\n' for line in cache_metrics())
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
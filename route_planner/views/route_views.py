@@ -2,9 +2,18 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from ..utils import RoutePlanner
+from ..lanes import precomputed_plan
+from ..renderers import ROUTE_RENDERERS
+from ..route_cache import cache_bypassed
+from ..routing_client import RoutingError
+from ..scoring import parse_alternates
+from ..shaping import ResponseShape
+from ..utils import RoutePlanner, parse_waypoints
+from ..vehicles import get_vehicle_profile
 
 class RouteAPIView(APIView):
+    renderer_classes = ROUTE_RENDERERS
+
     def post(self, request):
         try:
             # Expect coordinates in the request
@@ -16,26 +25,49 @@ class RouteAPIView(APIView):
             # switched the order to lon&lat as open route expects them that way
             start_coords = (start_lon, start_lat)
             end_coords = (end_lon, end_lat)
-            planner = RoutePlanner()
+            # Optional pickups and drops between start and end, as [lat, lon] pairs
+            waypoints = parse_waypoints(request.data.get('waypoints'))
+            planner = RoutePlanner(
+                max_range=request.data.get('max_range'),
+                mpg=request.data.get('mpg'),
+                vehicle=get_vehicle_profile(request.data.get('vehicle_profile'))
+            )
+            # geometry / steps / annotations / fields options for a leaner payload
+            shape = ResponseShape.from_params(request.data)
+            # Ranked other stations near each stop, by effective cost
+            alternates = parse_alternates(request.data.get('alternates'))
+            use_cache = not cache_bypassed(request)
+
+            # Busy lanes are planned ahead of time (manage.py precompute_lanes)
+            plan = precomputed_plan(planner, start_coords, end_coords, waypoints,
+                                    shape.annotations) if use_cache and not alternates else None
+            if plan is not None:
+                response = Response(shape.shape_response(plan))
+                response['X-Route-Cache'] = 'PRECOMPUTED'
+                return response
 
             # Get route
-            print(start_coords,end_coords)
-            route = planner.get_route(start_coords, end_coords)
-            # print('error')
+            route = planner.get_route(start_coords, end_coords, use_cache=use_cache,
+                                      waypoints=waypoints, **shape.route_options())
 
             # Find optimal fuel stops
-            # print(route)
-            optimal_stops = planner.find_optimal_fuel_stops(route)
-            print(optimal_stops)
+            optimal_stops = planner.find_optimal_fuel_stops(route, alternates)
             # Calculate total cost
             total_cost = planner.calculate_total_cost(route, optimal_stops) #CHANGE ME
             
-            return Response({
+            response = Response(shape.shape_response({
                 'route': route,
                 'fuel_stops': optimal_stops,
                 'total_cost': total_cost
-            })
+            }))
+            response['X-Route-Cache'] = planner.route_cache_status
+            return response
             
+        except RoutingError as e:
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_502_BAD_GATEWAY
+            )
         except Exception as e:
             return Response(
                 {'error': str(e)},